@@ -1,411 +1,569 @@
+import argparse
+import contextlib
+import cProfile
 import json
 import pathlib
+import pstats
 import sqlite3
-import time
-import urllib.request as urllib
+import sys
 from datetime import datetime
 from urllib.error import HTTPError
 
-from ratelimit import limits, sleep_and_retry
 from tabulate import tabulate
 
 import src.db_util as db
 import src.variables as variables
-from src.util import *
+from src.analyzer import (
+    CATEGORIES,
+    MAX_LEVEL,
+    MIN_LEVEL,
+    analyze,
+    analyze_worlds,
+    format_table,
+    load_items,
+)
+from src.market_cache import DEFAULT_TTL, MarketCache
+from src.metrics import metrics
+from src.price_history import PriceHistory
+from src.live_market import LiveFeed
+from src.retry import NETWORK_ERRORS
+from src.scheduler import RefreshScheduler
+from src.service import (
+    ALL_WORLDS,
+    DEFAULT_HOST,
+    DEFAULT_INTERVAL,
+    DEFAULT_LIVE_INTERVAL,
+    DEFAULT_PORT,
+    MarketService,
+    fetch_recommendations,
+    make_server,
+)
+from src.universalis import get_region_worlds
+
+DB_PATH = "market_analyzer.db"
+VARIABLES_PATH = "./variables.json"
+DEFAULT_WORLD = "Faerie"
+DEFAULT_RECOMMENDATIONS = 5
+PROFILE_PATH = "market_analyzer.prof"
+PROFILE_LINES = 25
 
 #####
-# Constants
+# Commands
 #####
 
-WEIGHT_AVG_LISTING_PRICE = 25
-WEIGHT_AVG_SALE_PRICE = 50
-WEIGHT_SALE_VELOCITY = 50
-WEIGHT_MIN_AVG_PRICE_DIFF = 25
-ITEM_TYPES = [
-    "Gatherable",
-    "Painting",
-    "Orchestrion Roll",
-]
 
-#####
-# Utility Functions
-#####
+def update_db(incremental=True, verbose=True, categories=None) -> None:
+    # Also records the time of the update
+    db.update_db(incremental, verbose, categories)
+    variables.set_variable("lastUpdateTime", str(datetime.now()))
 
 
-def dict_factory(cursor, row):
-    # From the sqlite3 documentation
-    d = {}
-    for idx, col in enumerate(cursor.description):
-        d[col[0]] = row[idx]
-    return d
-
-
-@sleep_and_retry
-@limits(20, 1)
-def query_items(item_tuples, world_name, batch_size=20):
-    # Query Universalis for multiple items at once at a maximum of 20 calls per second
-    batches = []
-    entries = []  # [ { "item_name": item_name } for item_id, item_name in item_tuples ]
-    while len(item_tuples) > 0:
-        batches.append(item_tuples[:batch_size])
-        item_tuples = item_tuples[batch_size:]
-    print(f"Querying {len(batches)} batches of {batch_size} items each...")
-
-    # Get listing data from Universalis
-    for i in range(0, len(batches)):
-        batch = {item_id: item_name for item_id, item_name in batches[i]}
-        print(f"Querying Universalis for Batch {i + 1}...")
-        listings_request = urllib.Request(
-            f"https://universalis.app/api/{world_name}/{','.join((map(str, batch.keys())))}?entries=100"
-        )
-        listings_request.add_header("User-Agent", get_user_agent())
-        try:
-            listings_response = json.loads(urllib.urlopen(listings_request).read())
-        except HTTPError:
-            print("- Listings request failed. Skipping batch...")
-            continue
-        failed_items = listings_response["unresolvedItems"]
-        if len(failed_items) > 0:
-            print(f"- Failed to retrieve data for {len(failed_items)} items:")
-            for item in failed_items:
-                print(f"  - Item {item}: {batch[item]}")
-        else:
-            print("- Successfully found listing data for all items in batch:")
-
-        for listing_data in listings_response["items"]:
-            entry_data = {
-                "item_id": listing_data["itemID"],
-                "item_name": batch[listing_data["itemID"]],
-            }
-            entry_data["currentAveragePriceNQ"] = listing_data["currentAveragePriceNQ"]
-            entry_data["averagePriceNQ"] = listing_data["averagePriceNQ"]
-            entry_data["currentPriceDifferenceNQ"] = (
-                listing_data["currentAveragePriceNQ"] - listing_data["minPriceNQ"]
+def import_db(directory, categories=None) -> None:
+    db.import_csv(directory, categories, DB_PATH)
+    variables.set_variable("lastUpdateTime", str(datetime.now()))
+
+
+def open_cache(cache_ttl=None, clear=False) -> MarketCache:
+    # Market data younger than this many seconds is reused instead of requested again.
+    # A TTL from --cache-ttl only applies to this run, so it isn't saved.
+    if cache_ttl is None:
+        cache_ttl = variables.get_variable("marketCacheTTL")
+        if cache_ttl is None:
+            # Saved so that it can be changed in variables.json
+            cache_ttl = DEFAULT_TTL
+            variables.set_variable("marketCacheTTL", cache_ttl)
+    market_cache = MarketCache(DB_PATH, ttl=cache_ttl)
+    if clear:
+        print("Clearing cached market data...")
+        market_cache.clear()
+    return market_cache
+
+
+def print_results(results, output_format="table", quality="nq", title="") -> None:
+    if output_format == "json":
+        print(json.dumps([entry.to_dict() for entry in results], indent=4))
+    else:
+        print(f"\nRecommended {quality.upper()} Items{title}:")
+        print(
+            tabulate(
+                format_table(results, quality),
+                headers="keys",
+                tablefmt="fancy_grid",
+                floatfmt=".2f",
             )
-            entry_data["currentAveragePriceHQ"] = listing_data["currentAveragePriceHQ"]
-            entry_data["averagePriceHQ"] = listing_data["averagePriceHQ"]
-            entry_data["currentPriceDifferenceHQ"] = (
-                listing_data["currentAveragePriceHQ"] - listing_data["minPriceHQ"]
+        )
+
+
+def print_world_results(
+    per_world, overall, output_format="table", quality="nq"
+) -> None:
+    if output_format == "json":
+        print(
+            json.dumps(
+                {
+                    "worlds": {
+                        world_name: [entry.to_dict() for entry in results]
+                        for world_name, results in per_world.items()
+                    },
+                    "overall": [entry.to_dict() for entry in overall],
+                },
+                indent=4,
             )
-            entries.append(entry_data)
-            print(
-                f"  - Found listing data for Item {entry_data['item_id']}: {entry_data['item_name']}"
+        )
+    else:
+        for world_name, results in per_world.items():
+            print_results(results, quality=quality, title=f" on {world_name}")
+        print_results(overall, quality=quality, title=" Across All Worlds")
+
+
+def get_categories(names):
+    # "all" stands for every category
+    if "all" in names:
+        return list(CATEGORIES.keys())
+    return names
+
+
+def get_worlds(args):
+    """
+    Returns the list of worlds to scan for a multi-world analysis, or `None` for a single world.
+    """
+    if args.region is not None:
+        return get_region_worlds(args.region)
+    return args.worlds
+
+
+def run_analyze(args):
+    """
+    Returns the recommended entries for a single world,
+    or a tuple of per-world and overall entries for several worlds.
+    Either is empty if there are no results.
+    """
+    if args.server is not None:
+        return run_remote_analyze(args)
+    if args.update_db:
+        update_db(verbose=False, categories=get_categories(args.category))
+
+    con = sqlite3.connect(DB_PATH)
+    market_cache = open_cache(args.cache_ttl, args.clear_cache)
+    history = PriceHistory(DB_PATH)
+    try:
+        items = load_items(
+            con, get_categories(args.category), args.min_level, args.max_level
+        )
+        if items is None:
+            return []
+        world_names = get_worlds(args)
+        if world_names is None:
+            return analyze(
+                items,
+                args.world,
+                args.top,
+                cache=market_cache,
+                quality=args.quality,
+                history=history,
             )
-
-        # Sale velocities are kind of weird, so we need to make a separate request for historical data.
-        sale_request = urllib.Request(
-            f"https://universalis.app/api/history/{world_name}/{','.join((map(str, batch.keys())))}"
+        if len(world_names) < 1:
+            print(f"Error: No worlds found for {args.region}.")
+            return []
+        per_world, overall = analyze_worlds(
+            items,
+            world_names,
+            args.top,
+            cache=market_cache,
+            quality=args.quality,
+            history=history,
         )
-        sale_request.add_header("User-Agent", get_user_agent())
-        try:
-            sale_response = json.loads(urllib.urlopen(sale_request).read())
-        # A 404 response should only happen if the world name is wrong
-        except HTTPError:
-            for i in range(0, len(entries)):
-                entries[i]["nqSaleVelocity"] = 0
-                entries[i]["hqSaleVelocity"] = 0
-            print("- Warning: Failed to obtain sale data from Universalis.")
-            continue
-        # Set velocities to zero for all failed items
-        failed_items = set(sale_response["unresolvedItems"])
-        if len(failed_items) > 0:
-            print(f"- Failed to retrieve sales data for {len(failed_items)} items:")
-            for item in failed_items:
-                print(f"  - Item {item}: {batch[item]}")
-            for i in range(0, len(entries)):
-                if entries[i]["item_id"] in failed_items:
-                    entries[i]["nqSaleVelocity"] = 0
-                    entries[i]["hqSaleVelocity"] = 0
-        else:
-            print("- Successfully found sales data for all items in batch.")
-
-        # Annotate entries with sales data
-        sale_data = {
-            item_data["itemID"]: {
-                "nqSaleVelocity": item_data["nqSaleVelocity"],
-                "hqSaleVelocity": item_data["hqSaleVelocity"],
-            }
-            for item_data in sale_response["items"]
+        return (per_world, overall) if len(overall) > 0 else []
+    finally:
+        history.close()
+        market_cache.close()
+        con.close()
+
+
+def run_remote_analyze(args):
+    """
+    Same as `run_analyze`, but asks a running `serve` command instead of scanning.
+    """
+    if args.region is not None:
+        print("Error: --region can't be used with --server. Use --worlds instead.")
+        return []
+    try:
+        if args.worlds is None:
+            return fetch_recommendations(
+                args.server, args.world, args.top, args.quality
+            )["results"]
+        per_world = {
+            world_name: fetch_recommendations(
+                args.server, world_name, args.top, args.quality
+            )["results"]
+            for world_name in args.worlds
         }
-        for i in range(0, len(entries)):
-            if entries[i].get("nqSaleVelocity") is None:
-                entries[i]["nqSaleVelocity"] = sale_data[entries[i]["item_id"]][
-                    "nqSaleVelocity"
-                ]
-            if entries[i].get("hqSaleVelocity") is None:
-                entries[i]["hqSaleVelocity"] = sale_data[entries[i]["item_id"]][
-                    "hqSaleVelocity"
-                ]
-
-    return entries
-
-
-@sleep_and_retry
-@limits(20, 1)
-def query_item(item_tuple, world_name):
-    # Query Universalis at a maximum of 20 calls per second
-    item_id, item_name = item_tuple
-    print(f"Querying Item {item_id}: {item_name}...")
-    entry_data = {"item_name": item_name}
-
-    # Get listing data from Universalis
-    listing_request = urllib.Request(
-        f"https://universalis.app/api/{world_name}/{item_id}?entries=100"
+        overall = fetch_recommendations(
+            args.server, ALL_WORLDS, args.top, args.quality
+        )["results"]
+    except HTTPError as error:
+        print(f"Error: {error.code} from {args.server}: {error.read().decode()}")
+        return []
+    except NETWORK_ERRORS as error:
+        print(f"Error: Couldn't reach {args.server}: {error}")
+        return []
+    return (per_world, overall) if len(overall) > 0 else []
+
+
+def run_serve(args) -> int:
+    con = sqlite3.connect(DB_PATH)
+    items = load_items(
+        con, get_categories(args.category), args.min_level, args.max_level
     )
-    listing_request.add_header("User-Agent", get_user_agent())
-    try:
-        listing_data = json.loads(urllib.urlopen(listing_request).read())
-    except HTTPError:
-        print("- Listing data not found on Universalis. Skipping...")
-        return {}
-    entry_data["currentAveragePriceNQ"] = listing_data["currentAveragePriceNQ"]
-    entry_data["averagePriceNQ"] = listing_data["averagePriceNQ"]
-    entry_data["currentPriceDifferenceNQ"] = (
-        listing_data["currentAveragePriceNQ"] - listing_data["minPriceNQ"]
+    con.close()
+    if items is None:
+        return 1
+    world_names = get_worlds(args)
+    if world_names is None:
+        world_names = [args.world]
+    elif len(world_names) < 1:
+        print(f"Error: No worlds found for {args.region}.")
+        return 1
+
+    interval = args.interval
+    if interval is None:
+        interval = DEFAULT_LIVE_INTERVAL if args.live else DEFAULT_INTERVAL
+    market_cache = open_cache(args.cache_ttl, args.clear_cache)
+    history = PriceHistory(DB_PATH)
+    service = MarketService(
+        items,
+        world_names,
+        interval,
+        cache=market_cache,
+        history=history,
+        scheduler=RefreshScheduler() if args.adaptive else None,
+        live=LiveFeed(dict(items), world_names) if args.live else None,
     )
-    entry_data["currentAveragePriceHQ"] = listing_data["currentAveragePriceHQ"]
-    entry_data["averagePriceHQ"] = listing_data["averagePriceHQ"]
-    entry_data["currentPriceDifferenceHQ"] = (
-        listing_data["currentAveragePriceHQ"] - listing_data["minPriceHQ"]
+    server = make_server(service, args.host, args.port)
+    service.start()
+    if args.live:
+        schedule = f"updating from live events and rescoring every {interval} seconds"
+    elif args.adaptive:
+        schedule = "refreshing each item as often as it sells"
+    else:
+        schedule = f"refreshing every {interval} seconds"
+    print(
+        f"Serving recommendations for {', '.join(world_names)} on http://{args.host}:{server.server_port}, "
+        f"{schedule}. Press Ctrl+C to stop."
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopping...")
+    finally:
+        server.server_close()
+        service.stop()
+        history.close()
+        market_cache.close()
+    return 0
+
+
+def run_update_db(args) -> int:
+    categories = get_categories(args.categories)
+    if args.from_csv is not None:
+        import_db(args.from_csv, categories)
+    else:
+        update_db(not args.full, not args.quiet, categories)
+    return 0
+
+
+def run_interactive(args) -> int:
+    # Update last DB update time
+    last_update_time = variables.get_variable("lastUpdateTime")
+    if last_update_time is None:
+        last_update_time = str(datetime.now())
+        variables.set_variable("lastUpdateTime", last_update_time)
+    flag_update_db = (
+        input(
+            f"Item database was last updated at {last_update_time}. Update database (y/N)? "
+        ).lower()
+        == "y"
     )
-    print("- Successfully obtained listing data from Universalis.")
+    if flag_update_db:
+        update_db()
+
+    # The last choice scans every category at once
+    choices = [[category] for category in CATEGORIES] + [list(CATEGORIES.keys())]
+    selected_item_type = -1
+    while selected_item_type < 0 or selected_item_type >= len(choices):
+        print("Please select an item category from the following:")
+        for i in range(1, len(CATEGORIES) + 1):
+            print(f"  {i}. {CATEGORIES[choices[i - 1][0]]['name']}")
+        print(f"  {len(choices)}. All Categories")
+        try:
+            selected_item_type = (
+                int(input(f"Enter your selection (1 to {len(choices)}): ")) - 1
+            )
+        except ValueError:
+            print("Please enter a number.")
+    categories = choices[selected_item_type]
 
-    # Sale velocities are kind of weird, so we need to make a separate request for historical data.
-    sale_request = urllib.Request(
-        f"https://universalis.app/api/history/{world_name}/{item_id}"
+    # Get min and max gathering level for filtering items.
+    min_level = MIN_LEVEL
+    max_level = MAX_LEVEL
+    if any(CATEGORIES[category]["has_level"] for category in categories):
+        try:
+            min_level = int(
+                input(f"Enter minimum gathering level (Default: {MIN_LEVEL}): ")
+            )
+        except ValueError:
+            pass
+        try:
+            max_level = int(
+                input(f"Enter maximum gathering level (Default: {MAX_LEVEL}): ")
+            )
+        except ValueError:
+            pass
+
+    con = sqlite3.connect(DB_PATH)
+    items = load_items(con, categories, min_level, max_level)
+    con.close()
+    if items is None:
+        print("Exiting...")
+        return 1
+
+    world_name = input(
+        f"Enter name of World or Data Centre (Default: {DEFAULT_WORLD}): "
     )
-    sale_request.add_header("User-Agent", get_user_agent())
+    if len(world_name) < 1:
+        world_name = DEFAULT_WORLD
+
+    num_recommendations = DEFAULT_RECOMMENDATIONS
     try:
-        sale_data = json.loads(urllib.urlopen(sale_request).read())
-    except HTTPError:
-        entry_data["nqSaleVelocity"] = 0
-        entry_data["hqSaleVelocity"] = 0
-        print("- Warning: Failed to obtain sale data from Universalis.")
-    else:
-        entry_data["nqSaleVelocity"] = sale_data["nqSaleVelocity"]
-        entry_data["hqSaleVelocity"] = sale_data["hqSaleVelocity"]
-        print("- Successfully obtained historical sale data from Universalis.")
+        num_recommendations = int(
+            input(
+                f"Enter number of desired recommendations (Default: {DEFAULT_RECOMMENDATIONS}): "
+            )
+        )
+    except ValueError:
+        pass
 
-    return entry_data
+    market_cache = open_cache()
+    history = PriceHistory(DB_PATH)
+    results = analyze(
+        items, world_name, num_recommendations, cache=market_cache, history=history
+    )
+    history.close()
+    market_cache.close()
+    if len(results) < 1:
+        print("Exiting...")
+        return 1
+
+    print_results(results)
+    return 0
 
 
 #####
 # Main Program
 #####
 
-sqlite3.register_adapter(datetime, lambda ts: time.mktime(ts.timetuple()))
-con = sqlite3.connect("market_analyzer.db")
-con.row_factory = dict_factory
-cur = con.cursor()
-
-# Update last DB update time
-variables.init(pathlib.Path("./variables.json").resolve())
-last_update_time = variables.get_variable("lastUpdateTime")
-if last_update_time is None:
-    last_update_time = str(datetime.now())
-flag_update_db = (
-    input(
-        f"Item database was last updated at {last_update_time}. Update database (y/N)? "
-    ).lower()
-    == "y"
-)
-if flag_update_db:
-    last_update_time = str(datetime.now())
-    db.update_db()
-variables.set_variable("lastUpdateTime", last_update_time)
-
-selected_item_type = -1
-while selected_item_type < 0 or selected_item_type >= len(ITEM_TYPES):
-    print("Please select an item category from the following:")
-    for i in range(1, len(ITEM_TYPES) + 1):
-        print(f"  {i}. {ITEM_TYPES[i - 1]}")
-    try:
-        selected_item_type = (
-            int(input(f"Enter your selection (1 to {len(ITEM_TYPES)}): ")) - 1
-        )
-    except ValueError:
-        print("Please enter a number.")
-items = []
 
-# Gathering
-if selected_item_type == 0:
-    # Check whether gathering database exists
-    if (
-        cur.execute("select count(name) as count from gathering_items").fetchone()[
-            "count"
-        ]
-        < 1
-    ):
-        print("Error: Gathering item database is empty. Exiting...")
-        exit()
-    else:
-        print("Successfully connected to gathering items database.")
-
-    # Get min and max gathering level for filtering items.
-    min_level = 1
-    try:
-        level = int(input("Enter minimum gathering level (Default: 1): "))
-        min_level = clamp(level, 1, 90)
-    except ValueError:
-        pass
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Analyzes market board data from Universalis and recommends items to sell. "
+        "Runs interactively if no command is given."
+    )
+    parser.add_argument(
+        "--metrics",
+        choices=["table", "json", "prometheus"],
+        help="print timings, request statistics and cache hits after the run",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        metavar="FILE",
+        help="write the metrics to a file instead of stderr",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const=PROFILE_PATH,
+        metavar="FILE",
+        help=f"run under cProfile and save the stats (default: {PROFILE_PATH}). Only the main thread is profiled",
+    )
+    commands = parser.add_subparsers(dest="command")
 
-    max_level = 90
-    try:
-        level = int(input("Enter maximum gathering level (Default: 90): "))
-        max_level = clamp(level, 1, 90)
-    except ValueError:
-        pass
+    analyze_parser = commands.add_parser(
+        "analyze", help="analyze categories of items on a World or Data Centre"
+    )
+    add_scan_arguments(analyze_parser)
+    analyze_parser.add_argument(
+        "--top",
+        type=int,
+        default=DEFAULT_RECOMMENDATIONS,
+        help="number of recommendations to show",
+    )
+    analyze_parser.add_argument(
+        "--quality",
+        choices=["nq", "hq"],
+        default="nq",
+        help="rank items by their normal or high quality prices",
+    )
+    analyze_parser.add_argument("--format", choices=["table", "json"], default="table")
+    analyze_parser.add_argument(
+        "--update-db",
+        action="store_true",
+        help="update the item database before analyzing",
+    )
+    analyze_parser.add_argument(
+        "--server",
+        metavar="URL",
+        help="get recommendations from a running serve command instead of scanning, "
+        f"e.g. http://{DEFAULT_HOST}:{DEFAULT_PORT}",
+    )
 
-    if min_level > max_level:
-        min_level, max_level = max_level, min_level
-        print("Automatically swapped minimum and maximum level.")
+    serve_parser = commands.add_parser(
+        "serve",
+        help="keep scores for worlds up to date in the background and answer queries over HTTP",
+    )
+    add_scan_arguments(serve_parser)
+    serve_parser.add_argument(
+        "--interval",
+        type=int,
+        help=f"seconds between refreshes, or between rescoring changed items with --live "
+        f"(default: {DEFAULT_INTERVAL}, or {DEFAULT_LIVE_INTERVAL} with --live)",
+    )
+    mode_group = serve_parser.add_mutually_exclusive_group()
+    mode_group.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="refresh each item on its own schedule, based on its sale velocity, rank and price volatility, "
+        "instead of refreshing every item every --interval seconds",
+    )
+    mode_group.add_argument(
+        "--live",
+        action="store_true",
+        help="load every item once, then keep it up to date from the Universalis WebSocket API instead of polling",
+    )
+    serve_parser.add_argument("--host", default=DEFAULT_HOST)
+    serve_parser.add_argument("--port", type=int, default=DEFAULT_PORT)
 
-    items = cur.execute(
-        "select item_id, name from gathering_items where gathering_level >= ? and gathering_level <= ?",
-        (min_level, max_level),
-    ).fetchall()
-    items = list(map(lambda item: (item["item_id"], item["name"]), items))
-    print(
-        f"Found {len(items)} gatherable items between Level {min_level} and Level {max_level}"
+    update_parser = commands.add_parser(
+        "update-db", help="update the item database from XIVAPI"
     )
-# Paintings
-elif selected_item_type == 1:
-    # Check whether paintings database exists
-    if (
-        cur.execute("select count(name) as count from painting_items").fetchone()[
-            "count"
-        ]
-        < 1
-    ):
-        print("Error: Paintings database is empty. Exiting...")
-        exit()
-    else:
-        print("Successfully connected to paintings database.")
-
-    items = cur.execute("select item_id, name from painting_items").fetchall()
-    items = list(map(lambda item: (item["item_id"], item["name"]), items))
-    print(f"Found {len(items)} paintings.")
-# Orchestrion Rolls
-elif selected_item_type == 2:
-    # Check whether database exists
-    if (
-        cur.execute(
-            "select count(name) as count from orchestrion_roll_items"
-        ).fetchone()["count"]
-        < 1
-    ):
-        print("Error: Orchestrion Roll database is empty. Exiting...")
-        exit()
-    else:
-        print("Successfully connected to orchestrion roll database.")
+    add_update_db_arguments(update_parser)
+    return parser
+
 
-    items = cur.execute("select item_id, name from orchestrion_roll_items").fetchall()
-    items = list(map(lambda item: (item["item_id"], item["name"]), items))
-    print(f"Found {len(items)} orchestrion rolls.")
+def add_scan_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--category",
+        nargs="+",
+        choices=["all", *CATEGORIES.keys()],
+        help="one or more categories to scan together, or all of them",
+    )
+    parser.add_argument("--min-level", type=int, default=MIN_LEVEL)
+    parser.add_argument("--max-level", type=int, default=MAX_LEVEL)
+    worlds_group = parser.add_mutually_exclusive_group()
+    worlds_group.add_argument("--world", default=DEFAULT_WORLD)
+    worlds_group.add_argument(
+        "--worlds",
+        nargs="+",
+        help="scan several worlds at once and rank them against each other",
+    )
+    worlds_group.add_argument(
+        "--region",
+        help="scan every world in a region (e.g. North-America) or data centre",
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=int,
+        help="seconds that cached market data stays fresh for this run (0 disables the cache)",
+    )
+    parser.add_argument(
+        "--clear-cache",
+        action="store_true",
+        help="delete all cached market data before starting",
+    )
 
-world_name = input("Enter name of World or Data Centre (Default: Faerie): ")
-if len(world_name) < 1:
-    world_name = "Faerie"
 
-num_recommendations = 5
-try:
-    num_recommendations = int(
-        input("Enter number of desired recommendations (Default: 5): ")
+def add_update_db_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--categories",
+        nargs="+",
+        choices=["all", *CATEGORIES.keys()],
+        default=["all"],
+        help="categories to update (default: all)",
     )
-except ValueError:
-    pass
-
-# Gathering items don't have high-quality versions anymore, so a lot of those are going to be commented out.
-# I might still use this for other stuff though, so it's not going to be removed entirely.
-
-print("\nMaking Universalis requests...\n")
-univ_entries = []
-entry_minmaxes = {
-    "listing_price_nq": MinMax(),
-    "sale_price_nq": MinMax(),
-    "velocity_nq": MinMax(),
-    "difference_nq": MinMax(),
-    "listing_price_hq": MinMax(),
-    "sale_price_hq": MinMax(),
-    "velocity_hq": MinMax(),
-    "difference_hq": MinMax(),
-}
-entries = query_items(items, world_name)
-for entry in entries:
-    if entry == {}:
-        continue
-    univ_entries.append(entry)
-    entry = univ_entries[len(univ_entries) - 1]
-
-    entry_minmaxes["listing_price_nq"].add_value(entry["currentAveragePriceNQ"])
-    entry_minmaxes["sale_price_nq"].add_value(entry["averagePriceNQ"])
-    entry_minmaxes["velocity_nq"].add_value(entry["nqSaleVelocity"])
-    entry_minmaxes["difference_nq"].add_value(entry["currentPriceDifferenceNQ"])
-
-    # entry_minmaxes["listing_price_hq"].add_value(
-    #     entry["currentAveragePriceHQ"])
-    # entry_minmaxes["sale_price_hq"].add_value(entry["averagePriceHQ"])
-    # entry_minmaxes["velocity_hq"].add_value(entry["hqSaleVelocity"])
-    # entry_minmaxes["difference_hq"].add_value(entry["currentPriceDifferenceHQ"])
-
-if len(univ_entries) < 1:
-    print("\nError: No results found. Exiting...")
-    exit()
-else:
-    print(f"\nSuccessfully found results for {len(univ_entries)} items.")
-
-for entry in univ_entries:
-    entry["score_nq"] = (
-        entry_minmaxes["listing_price_nq"].get_t(entry["currentAveragePriceNQ"])
-        * WEIGHT_AVG_LISTING_PRICE
-        + entry_minmaxes["sale_price_nq"].get_t(entry["averagePriceNQ"])
-        * WEIGHT_AVG_SALE_PRICE
-        + entry_minmaxes["velocity_nq"].get_t(entry["nqSaleVelocity"])
-        * WEIGHT_SALE_VELOCITY
-        + WEIGHT_MIN_AVG_PRICE_DIFF
-        - (
-            entry_minmaxes["difference_nq"].get_t(entry["currentPriceDifferenceNQ"])
-            * WEIGHT_MIN_AVG_PRICE_DIFF
-        )
+    parser.add_argument(
+        "--quiet",
+        action="store_true",
+        help="show progress counters instead of a line per item",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="query every item again instead of only new ones and a tenth of the rest",
     )
-    # entry["score_hq"] = entry_minmaxes["listing_price_hq"].get_t(
-    #     entry["currentAveragePriceHQ"]) * WEIGHT_AVG_LISTING_PRICE + entry_minmaxes["sale_price_hq"].get_t(
-    #     entry["averagePriceHQ"]) * WEIGHT_AVG_SALE_PRICE + entry_minmaxes["velocity_hq"].get_t(
-    #         entry["hqSaleVelocity"]) * WEIGHT_SALE_VELOCITY + entry_minmaxes["difference_hq"].get_t(
-    #             entry["currentPriceDifferenceHQ"]) * WEIGHT_MIN_AVG_PRICE_DIFF
-
-sorted_nq_raw = sorted(univ_entries, key=lambda entry: entry["score_nq"], reverse=True)[
-    :num_recommendations
-]
-# sorted_hq_raw = sorted(univ_entries, key=lambda entry: entry["score_hq"])[:5]
-
-# Formatted for the tabulate library
-sorted_nq = {
-    "Name": [],
-    "Avg. Listing Price": [],
-    "Avg. Sale Price": [],
-    "Sales Per Day": [],
-    "Avg - Min Listing Price": [],
-}
-for entry in sorted_nq_raw:
-    sorted_nq["Name"].append(entry["item_name"])
-    sorted_nq["Avg. Listing Price"].append(entry["currentAveragePriceNQ"])
-    sorted_nq["Avg. Sale Price"].append(entry["averagePriceNQ"])
-    sorted_nq["Sales Per Day"].append(entry["nqSaleVelocity"])
-    sorted_nq["Avg - Min Listing Price"].append(entry["currentPriceDifferenceNQ"])
-
-# sorted_hq = {"Name": [], "Avg. Listing Price": [], "Avg. Sale Price": [], "Sales Per Day": [], "Avg - Min Listing Price": []}
-# for entry in sorted_nq_raw:
-#     sorted_hq["Name"].append(entry["item_name"])
-#     sorted_hq["Avg. Listing Price"].append(entry["currentAveragePriceHQ"])
-#     sorted_hq["Avg. Sale Price"].append(entry["averagePriceHQ"])
-#     sorted_hq["Sales Per Day"].append(entry["hqSaleVelocity"])
-#     sorted_hq["Avg - Min Listing Price"].append(entry["currentPriceDifferenceHQ"])
-
-print("\nRecommended NQ Items:")
-print(tabulate(sorted_nq, headers="keys", tablefmt="fancy_grid", floatfmt=".2f"))
-# print("\nRecommended HQ Items:")
-# print(tabulate(sorted_hq, headers="keys", tablefmt="fancy_grid"))
-
-variables.close()
-con.close()
+    parser.add_argument(
+        "--from-csv",
+        metavar="DIRECTORY",
+        help="build the database from game data CSV sheets instead of XIVAPI",
+    )
+
+
+def run_command(args) -> int:
+    if args.command == "analyze":
+        # Keep status messages out of machine-readable output.
+        status_output = sys.stderr if args.format == "json" else sys.stdout
+        with contextlib.redirect_stdout(status_output):
+            results = run_analyze(args)
+        if len(results) < 1:
+            return 1
+        if isinstance(results, tuple):
+            print_world_results(*results, args.format, args.quality)
+        else:
+            print_results(results, args.format, args.quality)
+        return 0
+    elif args.command == "serve":
+        return run_serve(args)
+    elif args.command == "update-db":
+        return run_update_db(args)
+    else:
+        return run_interactive(args)
+
+
+def write_metrics(output_format, path=None) -> None:
+    # Metrics go to stderr by default, so they never mix with JSON results.
+    output = metrics.format(output_format)
+    if path is None:
+        print(f"\n{output}", file=sys.stderr)
+    else:
+        pathlib.Path(path).write_text(output)
+
+
+def main(argv=None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    # A server already knows which categories it scans
+    if (
+        args.command == "serve" or (args.command == "analyze" and args.server is None)
+    ) and args.category is None:
+        parser.error("the following arguments are required: --category")
+
+    variables.init(pathlib.Path(VARIABLES_PATH).resolve())
+    profiler = None
+    if args.profile is not None:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        return run_command(args)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            print(f"\nProfile saved to {args.profile}.", file=sys.stderr)
+            pstats.Stats(profiler, stream=sys.stderr).sort_stats(
+                "cumulative"
+            ).print_stats(PROFILE_LINES)
+        if args.metrics is not None:
+            write_metrics(args.metrics, args.metrics_file)
+        variables.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,5 @@
-from src.db_util import update_db
+import sys
 
-update_db()
+from MarketAnalyzer import main
+
+sys.exit(main(["update-db", *sys.argv[1:]]))
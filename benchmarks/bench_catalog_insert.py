@@ -0,0 +1,111 @@
+# Times the catalog write of `write_sources` on a synthetic catalog, without the XIVAPI queries that come before it:
+# a first write, and syncs with nothing or only a few items changed. The old per-row inserts are timed for reference,
+# but only fill one unindexed table, while `write_sources` also keeps the indexed `items` table up to date,
+# so a first write isn't faster than them. Run from the repository root:
+#   python -m benchmarks.bench_catalog_insert [num_items]
+import contextlib
+import io
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from src import db_util
+
+NUM_ITEMS = 50000
+NUM_CHANGED = 100
+
+
+def synthetic_details(ids, verbose=True):
+    return [
+        {
+            "source_id": i,
+            "item_id": i,
+            "name": f"Synthetic Item {i}",
+            "gathering_level": i % 90 + 1,
+        }
+        for i in ids
+    ]
+
+
+def bench_per_row(path, num_items) -> float:
+    # Mirrors the original update_db: default pragmas, one execute and one print per row.
+    con = sqlite3.connect(path)
+    cur = con.cursor()
+    cur.execute(
+        "create table gathering_items (name text, item_id integer primary key, gathering_level integer)"
+    )
+    start = time.perf_counter()
+    # Line buffered like a terminal, so every printed line costs a write.
+    with open(os.devnull, "w", buffering=1) as devnull, contextlib.redirect_stdout(
+        devnull
+    ):
+        for gi in synthetic_details(range(num_items)):
+            try:
+                cur.execute(
+                    "insert into gathering_items values (?, ?, ?)",
+                    (gi["name"], gi["item_id"], gi["gathering_level"]),
+                )
+            except sqlite3.IntegrityError:
+                print(f"- Skipping Item {gi['item_id']}: {gi['name']} as ID is taken.")
+            else:
+                print(f"- Successfully added Item {gi['item_id']}: {gi['name']}.")
+        con.commit()
+    elapsed = time.perf_counter() - start
+    con.close()
+    return elapsed
+
+
+def open_bulk(path, num_items) -> sqlite3.Connection:
+    con = db_util.open_db(path)
+    db_util.create_catalog_tables(con)
+    con.execute(
+        "create temp table if not exists marketable (item_id integer primary key)"
+    )
+    with con:
+        con.executemany(
+            "insert or ignore into marketable values (?)",
+            [(i,) for i in range(num_items)],
+        )
+    return con
+
+
+def bench_bulk(path, num_items, details) -> float:
+    # Only the write is timed, since that's all the per-row version does.
+    con = open_bulk(path, num_items)
+    # Taken once per sync, before any category is written
+    marketable_hash = db_util.get_marketable_hash(range(num_items))
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        db_util.write_sources(con, "gatherable", details, set(), marketable_hash)
+    elapsed = time.perf_counter() - start
+    con.close()
+    return elapsed
+
+
+if __name__ == "__main__":
+    num_items = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_ITEMS
+    details = synthetic_details(range(num_items))
+    with tempfile.TemporaryDirectory() as directory:
+        before = bench_per_row(os.path.join(directory, "before.db"), num_items)
+        after = bench_bulk(os.path.join(directory, "after.db"), num_items, details)
+        # A second sync against the same database has no new IDs to write,
+        # and a full one queries every ID again, but finds them unchanged.
+        resync = bench_bulk(os.path.join(directory, "after.db"), num_items, [])
+        full_resync = bench_bulk(
+            os.path.join(directory, "after.db"), num_items, details
+        )
+        renamed = [
+            {**item, "name": f"Renamed Item {item['item_id']}"}
+            for item in details[:NUM_CHANGED]
+        ]
+        changed = bench_bulk(os.path.join(directory, "after.db"), num_items, renamed)
+    print(f"Catalog insert benchmark ({num_items} items):")
+    print(
+        f"- Old per-row inserts, one unindexed table: {num_items / before:,.0f} rows/sec ({before:.2f}s)"
+    )
+    print(f"- First write: {num_items / after:,.0f} rows/sec ({after:.2f}s)")
+    print(f"- Incremental sync with no changes: {resync * 1000:.1f}ms")
+    print(f"- Full sync with no changes: {full_resync * 1000:.1f}ms")
+    print(f"- Sync with {NUM_CHANGED} renamed items: {changed * 1000:.1f}ms")
@@ -0,0 +1,109 @@
+# Compares decoding a 100-item Universalis listings response with each JSON backend,
+# for a trimmed response and for a full one with every individual listing and sale.
+# Run from the repository root:
+#   python -m benchmarks.bench_json_decode [repeats]
+import json
+import random
+import sys
+import time
+import tracemalloc
+
+from src.fast_json import msgspec, orjson
+from src.market_data import DECODERS, Response, from_dict
+
+from .mock_server import synthetic_listing
+
+REPEATS = 200
+NUM_ITEMS = 100
+
+
+def synthetic_entries(item_id, count):
+    rng = random.Random(item_id)
+    return [
+        {
+            "lastReviewTime": 1700000000 + i,
+            "pricePerUnit": rng.randint(10, 10000),
+            "quantity": rng.randint(1, 99),
+            "stainID": 0,
+            "worldName": "Mock-1",
+            "creatorName": "",
+            "hq": rng.random() < 0.3,
+            "isCrafted": False,
+            "listingID": f"{item_id}{i:08d}",
+            "materia": [],
+            "onMannequin": False,
+            "retainerCity": rng.randint(1, 10),
+            "retainerID": f"{rng.getrandbits(64):016x}",
+            "retainerName": "Synthetic Retainer",
+            "sellerID": f"{rng.getrandbits(64):016x}",
+            "total": rng.randint(10, 100000),
+        }
+        for i in range(0, count)
+    ]
+
+
+def synthetic_body(full: bool) -> bytes:
+    items = {}
+    for item_id in range(1, NUM_ITEMS + 1):
+        item = synthetic_listing(item_id)
+        if full:
+            item["listings"] = synthetic_entries(item_id, 100)
+            item["recentHistory"] = synthetic_entries(-item_id, 5)
+        items[str(item_id)] = item
+    return json.dumps(
+        {
+            "itemIDs": list(range(1, NUM_ITEMS + 1)),
+            "items": items,
+            "unresolvedItems": [],
+        }
+    ).encode()
+
+
+def decode_with(loads):
+    def decode(body):
+        data = loads(body)
+        return Response(
+            [from_dict("listings", item) for item in data["items"].values()],
+            data["unresolvedItems"],
+        )
+
+    return decode
+
+
+def bench(decode, body, repeats):
+    start = time.perf_counter()
+    for _ in range(0, repeats):
+        decode(body)
+    elapsed = (time.perf_counter() - start) / repeats
+    tracemalloc.start()
+    decode(body)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main(argv) -> None:
+    repeats = int(argv[0]) if len(argv) > 0 else REPEATS
+    decoders = {"json": decode_with(json.loads)}
+    if orjson is not None:
+        decoders["orjson"] = decode_with(orjson.loads)
+    if msgspec is not None:
+        decoders["msgspec"] = DECODERS[("listings", False)]
+
+    for full in (False, True):
+        body = synthetic_body(full)
+        print(
+            f"Decoding a {'full' if full else 'trimmed'} {NUM_ITEMS}-item response ({len(body) / 1024:.0f} KiB):"
+        )
+        baseline = None
+        for name, decode in decoders.items():
+            elapsed, peak = bench(decode, body, repeats)
+            if baseline is None:
+                baseline = elapsed
+            print(
+                f"- {name}: {elapsed * 1000:.2f}ms ({baseline / elapsed:.1f}x), peak {peak / 1024:.0f} KiB"
+            )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
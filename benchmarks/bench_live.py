@@ -0,0 +1,222 @@
+# Loads a synthetic catalog from the mock server, then replays recorded events over the mock WebSocket API,
+# and reports how fast events are applied, whether the live aggregates match ones recomputed from scratch,
+# and how the traffic compares with polling.
+# Then loads everything again while the events are replayed, to check that none are lost while items are loading.
+# Run from the repository root:
+#   python -m benchmarks.bench_live [--items 10000] [--events 100000] [--record events.jsonl | --replay events.jsonl]
+import argparse
+import math
+import sys
+import time
+
+from src import universalis
+from src.live_market import LiveFeed
+from src.metrics import metrics
+from src.service import DEFAULT_INTERVAL
+from src.universalis import MAX_BATCH_SIZE, history_url, listings_url
+from src.util import TokenBucket
+
+from .mock_server import WORLDS, SyntheticCatalog, apply_listing_event, start_server
+from .mock_websocket import (
+    read_recording,
+    record_events,
+    start_websocket_server,
+    write_recording,
+)
+
+NUM_ITEMS = 10000
+NUM_EVENTS = 100000
+WORLD_NAMES = WORLDS[:2]
+# Each endpoint takes its own request per batch.
+ENDPOINTS = 2
+TIMEOUT = 120
+
+
+def replay_listings(events):
+    """
+    Recomputes the final listings of every item that had an event, from the mock server's listings
+    and the events, without any of the incremental bookkeeping.
+    Returns a dict of (world ID, item ID) to a dict of listing ID to listing.
+    """
+    listings = {}
+    for event in events:
+        apply_listing_event(listings, event)
+    return listings
+
+
+def check_aggregates(feed: LiveFeed, events) -> int:
+    """
+    Returns the number of items whose live average or minimum listing price doesn't match the recomputed one.
+    """
+    world_names = {world_id: name for name, world_id in feed.world_ids.items()}
+    mismatches = 0
+    for (world_id, item_id), listings in replay_listings(events).items():
+        entry = feed.market.entry(world_names[world_id], item_id)
+        for hq, average, difference in (
+            (False, entry.currentAveragePriceNQ, entry.currentPriceDifferenceNQ),
+            (True, entry.currentAveragePriceHQ, entry.currentPriceDifferenceHQ),
+        ):
+            prices = [
+                listing["pricePerUnit"]
+                for listing in listings.values()
+                if listing["hq"] == hq
+            ]
+            expected_average = sum(prices) / len(prices) if len(prices) > 0 else 0.0
+            expected_difference = (
+                expected_average - min(prices) if len(prices) > 0 else 0.0
+            )
+            if (
+                abs(average - expected_average) > 1e-6
+                or abs(difference - expected_difference) > 1e-6
+            ):
+                mismatches += 1
+                break
+    return mismatches
+
+
+def load_while_replaying(catalog, item_names, events, rate):
+    """
+    Loads everything from fresh mocks while the events are replayed at `rate` events per second,
+    with the served listings changing as each event is sent.
+    Returns the number of events sent before loading finished, and the number of mismatched items,
+    or `None` if the events weren't all received in time.
+    """
+    server, base_url = start_server(catalog)
+    websocket_server, websocket_url = start_websocket_server(events, rate, server)
+    total_bytes = sum(len(payload) for _, _, payload in websocket_server.frames)
+    feed = LiveFeed(item_names, WORLD_NAMES, websocket_url, f"{base_url}/api")
+    metrics.reset()
+    feed.start()
+    feed.seed()
+    sent_while_loading = websocket_server.sent_count
+
+    # Events from before an item started loading aren't applied, so this waits for every byte instead.
+    start = time.perf_counter()
+    while metrics.summary()["counters"].get("live_bytes", 0) < total_bytes:
+        if time.perf_counter() - start > TIMEOUT:
+            return None
+        time.sleep(0.01)
+    # Waits for the last event to be applied
+    feed.stop()
+    mismatches = check_aggregates(feed, events)
+    websocket_server.shutdown()
+    server.shutdown()
+    return sent_while_loading, mismatches
+
+
+def main(argv) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.bench_live",
+        description="Benchmarks live updates against local mocks of the Universalis REST and WebSocket APIs.",
+    )
+    parser.add_argument("--items", type=int, default=NUM_ITEMS)
+    parser.add_argument("--events", type=int, default=NUM_EVENTS)
+    recording_group = parser.add_mutually_exclusive_group()
+    recording_group.add_argument(
+        "--record", help="save the generated events to this file"
+    )
+    recording_group.add_argument(
+        "--replay", help="replay events saved with --record instead of generating them"
+    )
+    args = parser.parse_args(argv)
+
+    # Lift the rate limit to measure the client itself.
+    universalis.limiter = TokenBucket(1000000, 1, 1000)
+    catalog = SyntheticCatalog(args.items)
+    server, base_url = start_server(catalog)
+    world_ids = list(range(0, len(WORLD_NAMES)))
+    if args.replay is not None:
+        events = read_recording(args.replay)
+    else:
+        events = record_events(catalog, world_ids, args.events)
+        if args.record is not None:
+            write_recording(args.record, events)
+    # Held back until everything is loaded, so loading and events are measured separately
+    websocket_server, websocket_url = start_websocket_server(
+        events, rest_server=server, paused=True
+    )
+
+    item_names = {item_id: catalog.name(item_id) for item_id in catalog.item_ids()}
+    feed = LiveFeed(item_names, WORLD_NAMES, websocket_url, f"{base_url}/api")
+    feed.start()
+    metrics.reset()
+    start = time.perf_counter()
+    feed.seed()
+    seed_seconds = time.perf_counter() - start
+    seed_summary = metrics.summary()["requests"]
+    seed_requests = sum(data["count"] for data in seed_summary.values())
+    seed_bytes = sum(data["bytes"] for data in seed_summary.values())
+    print(
+        f"Loaded {len(feed.market.items)} items on {len(WORLD_NAMES)} worlds in {seed_seconds:.2f}s "
+        f"with {seed_requests} requests ({seed_bytes / 2**20:.1f} MiB)."
+    )
+    feed.market.take_changed()
+
+    metrics.reset()
+    start = time.perf_counter()
+    websocket_server.replaying.set()
+    while metrics.summary()["counters"].get("live_events", 0) < len(events):
+        if time.perf_counter() - start > TIMEOUT:
+            print("Error: Timed out waiting for events.")
+            return 1
+        time.sleep(0.01)
+    event_seconds = time.perf_counter() - start
+    live_bytes = metrics.summary()["counters"]["live_bytes"]
+    changed = sum(len(item_ids) for item_ids in feed.market.take_changed().values())
+    print(
+        f"Applied {len(events)} events in {event_seconds:.2f}s ({len(events) / event_seconds:,.0f}/s), "
+        f"{live_bytes / len(events):.0f} bytes each, changing {changed} items."
+    )
+
+    feed.stop()
+    mismatches = check_aggregates(feed, events)
+    websocket_server.shutdown()
+
+    # What polling costs, from the trimmed requests for one batch
+    sample_ids = catalog.marketable_ids()[:MAX_BATCH_SIZE]
+    metrics.reset()
+    for url, endpoint in (
+        (listings_url(WORLD_NAMES[0], sample_ids, f"{base_url}/api"), "listings"),
+        (history_url(WORLD_NAMES[0], sample_ids, f"{base_url}/api"), "history"),
+    ):
+        universalis.fetch_response(url, endpoint, False)
+    batch_bytes = sum(data["bytes"] for data in metrics.summary()["requests"].values())
+    server.shutdown()
+    num_batches = math.ceil(len(catalog.marketable_ids()) / MAX_BATCH_SIZE)
+    polls_per_hour = 60 * 60 / DEFAULT_INTERVAL
+    poll_requests = num_batches * ENDPOINTS * len(WORLD_NAMES) * polls_per_hour
+    poll_bytes = batch_bytes * num_batches * len(WORLD_NAMES)
+    print(
+        f"Polling every {DEFAULT_INTERVAL}s takes {poll_requests:,.0f} requests an hour "
+        f"({poll_bytes * polls_per_hour / 2**20:.1f} MiB), "
+        f"while live updates take none after loading, and break even with polling at "
+        f"{poll_bytes * polls_per_hour / (live_bytes / len(events)):,.0f} events an hour."
+    )
+
+    # Spread over about as long as loading took, so they keep arriving while items are loading
+    result = load_while_replaying(
+        catalog, item_names, events, len(events) / seed_seconds
+    )
+    if result is None:
+        print("Error: Timed out waiting for events while loading.")
+        return 1
+    sent_while_loading, loading_mismatches = result
+    print(
+        f"Loaded everything again while replaying the events, "
+        f"{sent_while_loading} of which were sent before loading finished."
+    )
+
+    if mismatches > 0:
+        print(f"Error: {mismatches} items don't match their recomputed aggregates.")
+        return 1
+    if loading_mismatches > 0:
+        print(
+            f"Error: {loading_mismatches} items loaded during events don't match their recomputed aggregates."
+        )
+        return 1
+    print("Every live aggregate matches its recomputed value.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
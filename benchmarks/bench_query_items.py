@@ -0,0 +1,106 @@
+# Compares the old merge in `query_items`, which walked every entry collected so far on every batch,
+# against the per-batch merge keyed by item ID, then runs `query_items` end to end against the local mock server.
+# Run from the repository root:
+#   python -m benchmarks.bench_query_items [num_items]
+import contextlib
+import io
+import sys
+import time
+
+from src import universalis
+from src.market_data import Response, from_dict
+from src.util import TokenBucket
+
+from .mock_server import SyntheticCatalog, start_server, synthetic_listing
+
+NUM_ITEMS = 10000
+BATCH_SIZE = 100
+
+
+def synthetic_batches(num_items):
+    item_tuples = [(i, f"Synthetic Item {i}") for i in range(1, num_items + 1)]
+    batches = []
+    for batch in universalis.make_batches(item_tuples, BATCH_SIZE):
+        data = [synthetic_listing(item_id) for item_id, _ in batch]
+        listings = Response([from_dict("listings", item) for item in data])
+        sales = Response([from_dict("history", item) for item in data])
+        batches.append((batch, listings, sales))
+    return item_tuples, batches
+
+
+def merge_quadratic(item_tuples, batches):
+    # Mirrors the original merge: velocities are matched against every entry found so far, for every batch.
+    entries = []
+    item_names = dict(item_tuples)
+    for batch, listings_response, sale_response in batches:
+        for listing in listings_response.items:
+            item_id = listing.itemID
+            entries.append(
+                universalis.parse_listing(listing, item_id, item_names[item_id])
+            )
+        for i in range(0, len(entries)):
+            for sales in sale_response.items:
+                if entries[i].item_id == sales.itemID:
+                    entries[i].nqSaleVelocity = sales.nqSaleVelocity
+                    entries[i].hqSaleVelocity = sales.hqSaleVelocity
+    return entries
+
+
+def merge_per_batch(item_tuples, batches):
+    entries = []
+    item_names = dict(item_tuples)
+    for batch, listings_response, sale_response in batches:
+        entries.extend(
+            universalis.merge_batch(
+                "Stub",
+                item_names,
+                [item_id for item_id, _ in batch],
+                {},
+                listings_response,
+                {},
+                sale_response,
+                None,
+                False,
+            )
+        )
+    return entries
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def main(argv) -> None:
+    num_items = int(argv[0]) if len(argv) > 0 else NUM_ITEMS
+    item_tuples, batches = synthetic_batches(num_items)
+
+    print(f"Merging {num_items} synthetic items in batches of {BATCH_SIZE}:")
+    old_time, old_entries = timed(merge_quadratic, item_tuples, batches)
+    new_time, new_entries = timed(merge_per_batch, item_tuples, batches)
+    assert old_entries == new_entries
+    print(f"- Quadratic merge: {old_time:.3f}s")
+    print(f"- Per-batch merge: {new_time:.3f}s ({old_time / new_time:.0f}x faster)")
+
+    # The mock server answers instantly, so lift the rate limit to measure the client itself.
+    universalis.limiter = TokenBucket(100000, 1, 100)
+    catalog = SyntheticCatalog(num_items)
+    server, base_url = start_server(catalog)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            query_time, entries = timed(
+                lambda: universalis.query_items(
+                    item_tuples, "Mock-1", base_url=f"{base_url}/api", verbose=False
+                )
+            )
+    finally:
+        server.shutdown()
+    assert len(entries) == len(catalog.marketable_ids())
+    print(
+        f"- query_items against mock server: {query_time:.3f}s, {server.request_count} requests"
+    )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,139 @@
+# Keeps a large synthetic ranking current while a few items change at a time, like live updates do,
+# and compares rescoring only the changed items with `IncrementalRanker` against a full pass over every item.
+# The changes favour items that sell the most, so the one holding the highest velocity keeps moving the bounds.
+# Run from the repository root:
+#   python -m benchmarks.bench_rescoring [--items 30000] [--changed 50] [--refreshes 200]
+import argparse
+import copy
+import random
+import sys
+import time
+
+from src.market_data import from_dict
+from src.metrics import metrics
+from src.scoring import FEATURES, IncrementalRanker, score_entries
+from src.universalis import parse_listing
+
+from .mock_server import SyntheticCatalog, synthetic_listing
+
+NUM_ITEMS = 30000
+NUM_CHANGED = 50
+NUM_REFRESHES = 200
+# Full passes are slow, so only this many are timed.
+NUM_FULL_PASSES = 10
+# Each change moves every feature by up to this fraction.
+SWING = 0.1
+
+
+def full_pass(entries):
+    """
+    What every refresh cost before: scoring every entry, then sorting them for each quality.
+    """
+    entries = [copy.copy(entry) for entry in entries]
+    score_entries(entries)
+    return {
+        quality: sorted(
+            entries,
+            key=lambda entry: getattr(entry, f"score_{quality}"),
+            reverse=True,
+        )
+        for quality in FEATURES
+    }
+
+
+def change(entry, rng):
+    entry = copy.copy(entry)
+    for quality in FEATURES:
+        for field in FEATURES[quality]:
+            setattr(
+                entry, field, getattr(entry, field) * rng.uniform(1 - SWING, 1 + SWING)
+            )
+    return entry
+
+
+def count_mismatches(ranker: IncrementalRanker, entries) -> int:
+    """
+    Returns the number of entries whose score or place differs from a full pass over the same entries.
+    """
+    rankings = full_pass(entries)
+    mismatches = 0
+    for quality, ranking in rankings.items():
+        name = f"score_{quality}"
+        for expected, actual in zip(ranking, ranker.top(len(ranking), quality)):
+            # Entries with equal scores can be in either order
+            if abs(getattr(expected, name) - getattr(actual, name)) > 1e-9:
+                mismatches += 1
+    return mismatches
+
+
+def main(argv) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.bench_rescoring",
+        description="Benchmarks incremental rescoring against a full pass.",
+    )
+    parser.add_argument("--items", type=int, default=NUM_ITEMS)
+    parser.add_argument("--changed", type=int, default=NUM_CHANGED)
+    parser.add_argument("--refreshes", type=int, default=NUM_REFRESHES)
+    args = parser.parse_args(argv)
+
+    catalog = SyntheticCatalog(args.items)
+    current = {}
+    for item_id in catalog.marketable_ids():
+        data = synthetic_listing(item_id)
+        current[item_id] = parse_listing(
+            from_dict("listings", data),
+            item_id,
+            catalog.name(item_id),
+            from_dict("history", data),
+        )
+    item_ids = list(current)
+    weights = [
+        entry.nqSaleVelocity + entry.hqSaleVelocity for entry in current.values()
+    ]
+
+    start = time.perf_counter()
+    for _ in range(0, NUM_FULL_PASSES):
+        full_pass(current.values())
+    full_seconds = (time.perf_counter() - start) / NUM_FULL_PASSES
+
+    start = time.perf_counter()
+    ranker = IncrementalRanker(list(current.values()))
+    build_seconds = time.perf_counter() - start
+
+    rng = random.Random(0)
+    metrics.reset()
+    elapsed = 0.0
+    for _ in range(0, args.refreshes):
+        changed = [
+            change(current[item_id], rng)
+            for item_id in set(rng.choices(item_ids, weights, k=args.changed))
+        ]
+        current.update((entry.item_id, entry) for entry in changed)
+        start = time.perf_counter()
+        ranker.update(changed)
+        elapsed += time.perf_counter() - start
+    incremental_seconds = elapsed / args.refreshes
+    full_rescores = metrics.summary()["counters"].get("full_rescores", 0)
+
+    print(f"Ranked {len(current)} items:")
+    print(f"- Full pass: {full_seconds * 1000:.1f}ms per refresh")
+    print(f"- First incremental build: {build_seconds * 1000:.1f}ms")
+    print(
+        f"- Incremental, {args.changed} changed items: {incremental_seconds * 1000:.2f}ms per refresh, "
+        f"{full_seconds / incremental_seconds:.0f}x faster"
+    )
+    print(
+        f"- Bounds moved in {full_rescores} of {args.refreshes * len(FEATURES)} quality updates, "
+        f"which rescored every item"
+    )
+
+    mismatches = count_mismatches(ranker, current.values())
+    if mismatches > 0:
+        print(f"Error: {mismatches} places don't match a full pass.")
+        return 1
+    print("Every score and place matches a full pass.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,137 @@
+# Simulates a day of refreshes for a synthetic catalog, and compares the requests made by
+# `RefreshScheduler` with refreshing every item every 300 seconds, along with how often
+# items that sell at different rates are refreshed.
+# Time is simulated, so no requests are actually made.
+# Run from the repository root:
+#   python -m benchmarks.bench_scheduler [num_items]
+import math
+import random
+import sys
+import time
+
+from tabulate import tabulate
+
+from src.market_data import from_dict
+from src.scheduler import DAY, RefreshScheduler
+from src.scoring import score_entries
+from src.service import DEFAULT_INTERVAL, Snapshot
+from src.universalis import MAX_BATCH_SIZE, parse_listing
+
+from .mock_server import SyntheticCatalog, synthetic_listing
+
+NUM_ITEMS = 20000
+WORLD_NAME = "Mock-1"
+# Each endpoint takes its own request per batch.
+ENDPOINTS = 2
+# Sales per day that each row of the results covers
+VELOCITY_BANDS = [(0, 10), (10, 50), (50, 100), (100, 150)]
+
+
+class SyntheticMarket(object):
+    """
+    Listing prices that swing around their synthetic values by a different amount for each item.
+    """
+
+    def __init__(self, catalog: SyntheticCatalog) -> None:
+        self.catalog = catalog
+        self.listings = {
+            item_id: synthetic_listing(item_id) for item_id in catalog.marketable_ids()
+        }
+        rng = random.Random(0)
+        self.swings = {item_id: rng.uniform(0, 0.3) for item_id in self.listings}
+        self.phases = {item_id: rng.uniform(0, math.tau) for item_id in self.listings}
+
+    def entry(self, item_id, now):
+        data = dict(self.listings[item_id])
+        factor = 1 + self.swings[item_id] * math.sin(
+            math.tau * now / DAY + self.phases[item_id]
+        )
+        for field in ("currentAveragePriceNQ", "currentAveragePriceHQ"):
+            data[field] *= factor
+        return parse_listing(
+            from_dict("listings", data),
+            item_id,
+            self.catalog.name(item_id),
+            from_dict("history", data),
+        )
+
+
+def simulate(market: SyntheticMarket, duration=DAY):
+    """
+    Returns the number of requests made over `duration` seconds, and a dict of item ID to its number of refreshes.
+    """
+    scheduler = RefreshScheduler()
+    item_ids = list(market.listings)
+    scheduler.add(WORLD_NAME, item_ids, 0)
+    refreshes = dict.fromkeys(item_ids, 0)
+    ranks = None
+    requests = 0
+    now = 0
+    while (next_check := scheduler.next_check()) is not None:
+        now = max(now, next_check)
+        if now >= duration:
+            break
+        batches = scheduler.take_due(WORLD_NAME, now)
+        requests += len(batches) * ENDPOINTS
+        due_ids = [item_id for batch in batches for item_id in batch]
+        entries = [market.entry(item_id, now) for item_id in due_ids]
+        if ranks is None:
+            # Rankings barely move in a day, so they're only worked out once to keep the simulation quick.
+            ranks = Snapshot(entries, now).ranks()
+        for item_id in due_ids:
+            refreshes[item_id] += 1
+        scheduler.update(WORLD_NAME, due_ids, entries, ranks, now)
+    return requests, refreshes
+
+
+def main(argv) -> None:
+    num_items = int(argv[0]) if len(argv) > 0 else NUM_ITEMS
+    market = SyntheticMarket(SyntheticCatalog(num_items))
+    num_marketable = len(market.listings)
+
+    start = time.perf_counter()
+    requests, refreshes = simulate(market)
+    elapsed = time.perf_counter() - start
+    fixed_refreshes = DAY // DEFAULT_INTERVAL
+    fixed_requests = (
+        math.ceil(num_marketable / MAX_BATCH_SIZE) * ENDPOINTS * fixed_refreshes
+    )
+    print(f"Simulated a day of refreshes for {num_marketable} items in {elapsed:.1f}s:")
+    print(
+        f"- Every {DEFAULT_INTERVAL} seconds: {fixed_requests} requests ({fixed_requests / DAY:.2f}/s)"
+    )
+    print(
+        f"- Scheduled: {requests} requests ({requests / DAY:.2f}/s), {fixed_requests / requests:.1f}x fewer"
+    )
+
+    entries = [market.entry(item_id, 0) for item_id in market.listings]
+    score_entries(entries)
+    rows = []
+    for low, high in VELOCITY_BANDS:
+        band = [
+            entry
+            for entry in entries
+            if low <= entry.nqSaleVelocity + entry.hqSaleVelocity < high
+        ]
+        if len(band) < 1:
+            continue
+        mean_refreshes = sum(refreshes[entry.item_id] for entry in band) / len(band)
+        rows.append(
+            [
+                f"{low}-{high}",
+                len(band),
+                f"{mean_refreshes:.1f}",
+                f"{DAY / mean_refreshes / 60:.1f}",
+            ]
+        )
+    print(
+        tabulate(
+            rows,
+            headers=["Sales/day", "Items", "Refreshes/day", "Minutes between"],
+            disable_numparse=True,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
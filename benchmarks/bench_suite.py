@@ -0,0 +1,359 @@
+# Runs each stage of the script against the local mock server at several catalog sizes,
+# and reports throughput and peak memory, so regressions are caught before a release.
+# Each benchmark runs in its own process, so one can't inflate the memory of another.
+# Run from the repository root:
+#   python -m benchmarks.bench_suite [--sizes 1000 10000] [--only query_items scoring]
+#       [--latency 0.05] [--error-rate 0.01] [--throttle-rate 0.01]
+#       [--output results.json] [--baseline results.json]
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from tabulate import tabulate
+
+from src import db_util, universalis
+from src.analyzer import load_items
+from src.categories import CATEGORIES
+from src.market_data import from_dict
+from src.metrics import metrics
+from src.scoring import StreamingRanker, score_entries
+from src.util import TokenBucket, make_batches
+
+from .mock_server import SyntheticCatalog, start_server, synthetic_listing
+
+SIZES = [1000, 10000, 100000]
+# Slower than the baseline by more than this fraction counts as a regression.
+TOLERANCE = 0.2
+LOAD_REPEATS = 10
+NUM_RECOMMENDATIONS = 10
+
+
+def new_path(directory) -> str:
+    return os.path.join(tempfile.mkdtemp(dir=directory), "market_analyzer.db")
+
+
+def setup_query_items(catalog, base_url, directory):
+    item_tuples = [(item_id, catalog.name(item_id)) for item_id in catalog.item_ids()]
+
+    def run():
+        return len(
+            universalis.query_items(
+                item_tuples, "Mock-1", base_url=f"{base_url}/api", verbose=False
+            )
+        )
+
+    return run
+
+
+def setup_update_db(catalog, base_url, directory):
+    db_util.XIVAPI_URL = f"{base_url}/xivapi"
+    db_util.MARKETABLE_URL = f"{base_url}/api/marketable"
+    path = new_path(directory)
+
+    def run():
+        db_util.update_db(
+            incremental=False, verbose=False, categories=list(CATEGORIES), path=path
+        )
+        con = db_util.open_db(path)
+        # Every source is either behind an item or kept in `catalog_sources`
+        count = sum(
+            len(db_util.get_known_ids(con, category)) for category in CATEGORIES
+        )
+        con.close()
+        return count
+
+    return run
+
+
+def setup_import_csv(catalog, base_url, directory):
+    csv_directory = tempfile.mkdtemp(dir=directory)
+    catalog.write_csv(csv_directory)
+    path = new_path(directory)
+
+    def run():
+        db_util.import_csv(csv_directory, path=path)
+        return catalog.num_items
+
+    return run
+
+
+def setup_load_items(catalog, base_url, directory):
+    csv_directory = tempfile.mkdtemp(dir=directory)
+    catalog.write_csv(csv_directory)
+    path = new_path(directory)
+    with contextlib.redirect_stdout(io.StringIO()):
+        db_util.import_csv(csv_directory, path=path)
+    con = db_util.open_db(path)
+
+    def run():
+        count = 0
+        for _ in range(0, LOAD_REPEATS):
+            count += len(load_items(con, list(CATEGORIES)))
+            count += len(load_items(con, ["gatherable"], 20, 60))
+        return count
+
+    return run
+
+
+def setup_scoring(catalog, base_url, directory):
+    entries = []
+    for item_id in catalog.marketable_ids():
+        data = synthetic_listing(item_id)
+        entries.append(
+            universalis.parse_listing(
+                from_dict("listings", data),
+                item_id,
+                catalog.name(item_id),
+                from_dict("history", data),
+            )
+        )
+
+    def run():
+        ranker = StreamingRanker(NUM_RECOMMENDATIONS)
+        for batch in make_batches(entries, universalis.MAX_BATCH_SIZE):
+            ranker.add(batch)
+        ranker.finalize()
+        score_entries(entries)
+        return len(entries)
+
+    return run
+
+
+# Each benchmark's setup, which isn't measured, returns the function to measure.
+# That function returns the number of items it processed.
+BENCHMARKS = {
+    "query_items": setup_query_items,
+    "update_db": setup_update_db,
+    "import_csv": setup_import_csv,
+    "load_items": setup_load_items,
+    "scoring": setup_scoring,
+}
+
+
+def run_case(args) -> None:
+    """
+    Runs one benchmark in this process and prints its result as JSON.
+    The benchmark is run twice: once for timing, and once under `tracemalloc` for peak memory,
+    since tracing slows everything down.
+    """
+    catalog = SyntheticCatalog(args.size)
+    if args.rate > 0:
+        universalis.limiter = TokenBucket(args.rate, 1)
+        db_util.xivapi_limiter = TokenBucket(args.rate, 1)
+    else:
+        # Lift the rate limits to measure the client itself.
+        universalis.limiter = TokenBucket(1000000, 1, 1000)
+        db_util.xivapi_limiter = TokenBucket(1000000, 1, 1000)
+
+    result = {}
+    with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stdout(
+        io.StringIO()
+    ):
+        run = BENCHMARKS[args.case](catalog, args.base_url, directory)
+        metrics.reset()
+        start = time.perf_counter()
+        result["items"] = run()
+        result["seconds"] = time.perf_counter() - start
+        result["requests"] = sum(
+            data["count"] for data in metrics.summary()["requests"].values()
+        )
+        result["retries"] = metrics.summary()["counters"].get("retries", 0)
+
+        if args.memory:
+            run = BENCHMARKS[args.case](catalog, args.base_url, directory)
+            tracemalloc.start()
+            run()
+            result["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    print(json.dumps(result))
+
+
+def run_suite(args):
+    results = []
+    for size in args.sizes:
+        server, base_url = start_server(
+            SyntheticCatalog(size),
+            latency=args.latency,
+            error_rate=args.error_rate,
+            throttle_rate=args.throttle_rate,
+            retry_after=args.retry_after,
+        )
+        try:
+            for case in args.only or BENCHMARKS:
+                print(f"- Running {case} with {size} items...")
+                command = [
+                    sys.executable,
+                    "-m",
+                    "benchmarks.bench_suite",
+                    "--case",
+                    case,
+                    "--size",
+                    str(size),
+                    "--base-url",
+                    base_url,
+                    "--rate",
+                    str(args.rate),
+                ]
+                if not args.memory:
+                    command.append("--no-memory")
+                output = subprocess.run(
+                    command, capture_output=True, text=True, check=True
+                ).stdout
+                result = json.loads(output.splitlines()[-1])
+                result["benchmark"] = case
+                result["size"] = size
+                results.append(result)
+        finally:
+            server.shutdown()
+    return results
+
+
+def get_rates(results):
+    """
+    Returns a dict of (benchmark, size) to items per second.
+    """
+    return {
+        (result["benchmark"], result["size"]): result["items"] / result["seconds"]
+        for result in results
+    }
+
+
+def format_results(results, baseline=None) -> str:
+    rates = get_rates(results)
+    baseline_rates = {} if baseline is None else get_rates(baseline)
+    rows = []
+    for result in results:
+        key = (result["benchmark"], result["size"])
+        row = [
+            result["benchmark"],
+            result["size"],
+            result["items"],
+            f"{result['seconds']:.3f}",
+            f"{rates[key]:,.0f}",
+            (f"{result['peak_bytes'] / 2**20:.1f}" if "peak_bytes" in result else "-"),
+            result["requests"],
+            result["retries"],
+        ]
+        if baseline is not None:
+            row.append(
+                f"{rates[key] / baseline_rates[key]:.2f}x"
+                if key in baseline_rates
+                else "-"
+            )
+        rows.append(row)
+    headers = [
+        "Benchmark",
+        "Size",
+        "Items",
+        "Seconds",
+        "Items/sec",
+        "Peak MiB",
+        "Requests",
+        "Retries",
+    ]
+    if baseline is not None:
+        headers.append("vs. Baseline")
+    return tabulate(rows, headers=headers, disable_numparse=True)
+
+
+def find_regressions(results, baseline, tolerance=TOLERANCE):
+    """
+    Returns the results whose throughput fell by more than `tolerance` from the baseline.
+    """
+    rates = get_rates(results)
+    baseline_rates = get_rates(baseline)
+    return [
+        result
+        for result in results
+        if (key := (result["benchmark"], result["size"])) in baseline_rates
+        and rates[key] < baseline_rates[key] * (1 - tolerance)
+    ]
+
+
+def main(argv) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.bench_suite",
+        description="Benchmarks the script against a local mock of Universalis and XIVAPI.",
+    )
+    parser.add_argument("--sizes", nargs="+", type=int, default=SIZES)
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS.keys()))
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds added to every response"
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="fraction of requests that fail with a 500",
+    )
+    parser.add_argument(
+        "--throttle-rate",
+        type=float,
+        default=0.0,
+        help="fraction of requests that fail with a 429",
+    )
+    parser.add_argument(
+        "--retry-after",
+        type=float,
+        default=1,
+        help="seconds that throttled requests are asked to wait",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=0,
+        help="requests per second allowed by the rate limiters, or 0 for no limit",
+    )
+    parser.add_argument(
+        "--no-memory",
+        dest="memory",
+        action="store_false",
+        help="skip the peak memory run, which doubles the time taken",
+    )
+    parser.add_argument("--output", help="save the results to this JSON file")
+    parser.add_argument(
+        "--baseline",
+        help="compare against results saved with --output, and fail on regressions",
+    )
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    # Used by the suite to run each benchmark in its own process
+    parser.add_argument(
+        "--case", choices=list(BENCHMARKS.keys()), help=argparse.SUPPRESS
+    )
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--base-url", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.case is not None:
+        run_case(args)
+        return 0
+
+    results = run_suite(args)
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    print(format_results(results, baseline))
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=4)
+    if baseline is not None:
+        regressions = find_regressions(results, baseline, args.tolerance)
+        for result in regressions:
+            print(
+                f"Regression: {result['benchmark']} with {result['size']} items is more than {args.tolerance:.0%} slower than the baseline."
+            )
+        if len(regressions) > 0:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,398 @@
+# A local stand-in for the Universalis and XIVAPI endpoints used by the script,
+# for benchmarks that shouldn't touch the real services.
+# Universalis is served under /api and XIVAPI under /xivapi, both from a synthetic catalog.
+import csv
+import json
+import math
+import pathlib
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# XIVAPI returns at most this many results per page.
+PAGE_SIZE = 3000
+WORLDS = ["Mock-1", "Mock-2", "Mock-3", "Mock-4"]
+
+
+def synthetic_listing(item_id):
+    # Seeded by item ID, so every request for an item returns the same data
+    rng = random.Random(item_id)
+    nq_price = rng.uniform(10, 10000)
+    hq_price = rng.uniform(10, 20000)
+    return {
+        "itemID": item_id,
+        "currentAveragePriceNQ": nq_price,
+        "averagePriceNQ": rng.uniform(10, 10000),
+        "minPriceNQ": nq_price * rng.uniform(0.5, 1),
+        "currentAveragePriceHQ": hq_price,
+        "averagePriceHQ": rng.uniform(10, 20000),
+        "minPriceHQ": hq_price * rng.uniform(0.5, 1),
+        "nqSaleVelocity": rng.uniform(0, 100),
+        "hqSaleVelocity": rng.uniform(0, 50),
+        "listingsCount": rng.randint(0, 100),
+    }
+
+
+def synthetic_listings(item_id):
+    """
+    Returns the individual listings of an item, for requests that don't skip them.
+    """
+    rng = random.Random(-item_id)
+    return [
+        {
+            "listingID": f"{item_id}-{i}",
+            "pricePerUnit": rng.randint(10, 20000),
+            "quantity": rng.randint(1, 99),
+            "hq": rng.random() < 0.3,
+        }
+        for i in range(0, rng.randint(0, 20))
+    ]
+
+
+def apply_listing_event(listings, event) -> None:
+    """
+    Applies a WebSocket event to `listings`, a dict of (world ID, item ID) to a dict of listing ID to listing,
+    starting each item from its synthetic listings. Sales don't change any listings.
+    """
+    key = (event["world"], event["item"])
+    if key not in listings:
+        listings[key] = {
+            listing["listingID"]: listing
+            for listing in synthetic_listings(event["item"])
+        }
+    if event["event"] == "listings/add":
+        for listing in event["listings"]:
+            listings[key][listing["listingID"]] = listing
+    elif event["event"] == "listings/remove":
+        for listing in event["listings"]:
+            listings[key].pop(listing["listingID"], None)
+
+
+class SyntheticCatalog(object):
+    """
+    A made-up game catalog with items 1 to `num_items`, laid out like the real one:
+    every 97th item has no market board search category, so it isn't marketable,
+    every 50th item is a painting, every 40th is an orchestrion roll,
+    and every odd item is gathered from its own GatheringItem row.
+    """
+
+    def __init__(self, num_items) -> None:
+        self.num_items = num_items
+
+    def item_ids(self):
+        return range(1, self.num_items + 1)
+
+    def name(self, item_id) -> str:
+        return f"Synthetic Item {item_id}"
+
+    def has_item(self, item_id) -> bool:
+        return 1 <= item_id <= self.num_items
+
+    def fields(self, item_id):
+        if item_id % 97 == 0:
+            search_category = 0
+        elif item_id % 50 == 0:
+            search_category = 82
+        else:
+            search_category = 1 + item_id % 81
+        return {
+            "ItemSearchCategory": search_category,
+            "ItemUICategory": 94 if item_id % 40 == 0 else 1 + item_id % 93,
+        }
+
+    def is_marketable(self, item_id) -> bool:
+        return self.has_item(item_id) and self.fields(item_id)["ItemSearchCategory"] > 0
+
+    def marketable_ids(self):
+        return [item_id for item_id in self.item_ids() if self.is_marketable(item_id)]
+
+    def search(self, field, value):
+        return [
+            item_id
+            for item_id in self.item_ids()
+            if self.fields(item_id)[field] == value
+        ]
+
+    def gathering_ids(self):
+        return range(1, (self.num_items + 1) // 2 + 1)
+
+    def gathering_item(self, gathering_id):
+        """
+        Returns the item ID and level of a GatheringItem row.
+        """
+        return 2 * gathering_id - 1, gathering_id % 90 + 1
+
+    def write_csv(self, directory) -> None:
+        """
+        Writes the catalog as game data sheets in the community CSV format, for `db_util.import_csv`.
+        """
+        directory = pathlib.Path(directory)
+        write_sheet(
+            directory / "Item.csv",
+            ["Name", "ItemSearchCategory", "ItemUICategory"],
+            (
+                (item_id, self.name(item_id), *self.fields(item_id).values())
+                for item_id in self.item_ids()
+            ),
+        )
+        write_sheet(
+            directory / "GatheringItem.csv",
+            ["Item", "GatheringItemLevel"],
+            (
+                (gathering_id, *self.gathering_item(gathering_id))
+                for gathering_id in self.gathering_ids()
+            ),
+        )
+        write_sheet(
+            directory / "GatheringItemLevelConvertTable.csv",
+            ["GatheringItemLevel"],
+            ((level, level) for level in range(0, 91)),
+        )
+        write_sheet(
+            directory / "ItemSearchCategory.csv",
+            ["Name"],
+            ((i, "Paintings" if i == 82 else f"Category {i}") for i in range(0, 101)),
+        )
+        write_sheet(
+            directory / "ItemUICategory.csv",
+            ["Name"],
+            (
+                (i, "Orchestrion Roll" if i == 94 else f"Category {i}")
+                for i in range(0, 101)
+            ),
+        )
+
+
+def write_sheet(path, columns, rows) -> None:
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(["key", *range(0, len(columns))])
+        writer.writerow(["#", *columns])
+        writer.writerow(["int32", *("str" for _ in columns)])
+        writer.writerows(rows)
+
+
+def paginate(results, query):
+    page = int(query.get("page", ["1"])[0])
+    limit = min(int(query.get("limit", [str(PAGE_SIZE)])[0]), PAGE_SIZE)
+    page_total = max(1, math.ceil(len(results) / limit))
+    page_results = results[(page - 1) * limit : page * limit]
+    return {
+        "Pagination": {
+            "Page": page,
+            "PageTotal": page_total,
+            "Results": len(page_results),
+            "ResultsPerPage": limit,
+            "ResultsTotal": len(results),
+        },
+        "Results": page_results,
+    }
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops connections when every worker connects at once,
+    # and each dropped connection waits a second to retry.
+    request_queue_size = 128
+
+    def apply_event(self, event) -> None:
+        """
+        Changes the listings that are served, to match a WebSocket event that's about to be sent.
+        """
+        with self.lock:
+            apply_listing_event(self.live_listings, event)
+
+    def get_listings(self, world_name, item_id):
+        world_id = WORLDS.index(world_name) if world_name in WORLDS else None
+        with self.lock:
+            listings = self.live_listings.get((world_id, item_id))
+            if listings is not None:
+                return list(listings.values())
+        return synthetic_listings(item_id)
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, which Nagle's algorithm would hold back for a delayed ACK.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        server = self.server
+        with server.lock:
+            server.request_count += 1
+            roll = server.rng.random()
+        if server.latency > 0:
+            time.sleep(server.latency)
+
+        # Failures are drawn before routing, so they hit every endpoint equally.
+        if roll < server.throttle_rate:
+            with server.lock:
+                server.throttled_count += 1
+            self.send_json(429, {}, {"Retry-After": str(server.retry_after)})
+            return
+        if roll < server.throttle_rate + server.error_rate:
+            with server.lock:
+                server.error_count += 1
+            self.send_json(500, {})
+            return
+
+        parts = urlsplit(self.path)
+        segments = parts.path.strip("/").split("/")
+        query = parse_qs(parts.query)
+        try:
+            if segments[0] == "api":
+                status, data = self.universalis(segments[1:], query)
+            elif segments[0] == "xivapi":
+                status, data = self.xivapi(segments[1:], query)
+            else:
+                status, data = 404, {}
+        except (IndexError, KeyError, ValueError):
+            status, data = 404, {}
+        self.send_json(status, data)
+
+    def universalis(self, segments, query):
+        catalog = self.server.catalog
+        if segments == ["marketable"]:
+            return 200, catalog.marketable_ids()
+        if segments == ["v2", "worlds"]:
+            return 200, [{"id": i, "name": name} for i, name in enumerate(WORLDS)]
+        if segments == ["v2", "data-centers"]:
+            return 200, [
+                {"name": "Mock", "region": "Mock", "worlds": list(range(len(WORLDS)))}
+            ]
+
+        # /{world}/{ids} and /history/{world}/{ids}
+        item_ids = [int(item_id) for item_id in segments[-1].split(",")]
+        endpoint = "history" if segments[0] == "history" else "listings"
+        if not self.server.failing_ids.get(endpoint, set()).isdisjoint(item_ids):
+            return 404, {}
+        resolved = {
+            item_id
+            for item_id in item_ids
+            if catalog.is_marketable(item_id)
+            and item_id not in self.server.unresolved_ids
+        }
+        # Listings are only skipped on request, and history has none.
+        with_listings = segments[0] != "history" and query.get("listings") != ["0"]
+
+        def make_item(item_id):
+            item = synthetic_listing(item_id)
+            if with_listings:
+                item["listings"] = self.server.get_listings(segments[0], item_id)
+            return item
+
+        if len(item_ids) == 1:
+            if len(resolved) == 0:
+                return 404, {}
+            return 200, make_item(item_ids[0])
+        return 200, {
+            "itemIDs": item_ids,
+            "items": {
+                str(item_id): make_item(item_id)
+                for item_id in item_ids
+                if item_id in resolved
+            },
+            "unresolvedItems": [
+                item_id for item_id in item_ids if item_id not in resolved
+            ],
+        }
+
+    def xivapi(self, segments, query):
+        catalog = self.server.catalog
+        sheet = segments[0]
+        if sheet == "search":
+            # filters=Field.ID=value
+            field, value = query["filters"][0].split("=")
+            return 200, paginate(
+                [
+                    {"ID": item_id}
+                    for item_id in catalog.search(field.split(".")[0], int(value))
+                ],
+                query,
+            )
+
+        if sheet == "gatheringitem":
+            all_ids = catalog.gathering_ids()
+            make_row = self.gathering_row
+        elif sheet == "item":
+            all_ids = catalog.item_ids()
+            make_row = self.item_row
+        else:
+            return 404, {}
+
+        if len(segments) > 1:
+            row_id = int(segments[1])
+            if row_id not in all_ids:
+                return 404, {}
+            return 200, make_row(row_id)
+        if "ids" in query:
+            row_ids = [int(row_id) for row_id in query["ids"][0].split(",")]
+            return 200, {
+                "Results": [make_row(row_id) for row_id in row_ids if row_id in all_ids]
+            }
+        return 200, paginate([{"ID": row_id} for row_id in all_ids], query)
+
+    def gathering_row(self, gathering_id):
+        item_id, level = self.server.catalog.gathering_item(gathering_id)
+        return {
+            "ID": gathering_id,
+            "Item": {"ID": item_id, "Name": self.server.catalog.name(item_id)},
+            "GatheringItemLevel": {"GatheringItemLevel": level},
+        }
+
+    def item_row(self, item_id):
+        return {"ID": item_id, "Name": self.server.catalog.name(item_id)}
+
+    def send_json(self, status, data, headers=None) -> None:
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_server(
+    catalog=None,
+    latency=0.0,
+    error_rate=0.0,
+    throttle_rate=0.0,
+    retry_after=1,
+    unresolved_ids=(),
+    failing_ids=None,
+    seed=0,
+):
+    """
+    Starts the mock server on a free local port in a background thread.
+    `latency` is added to every response, and a random `error_rate` fraction of requests fail with a 500,
+    and a `throttle_rate` fraction with a 429 asking to wait `retry_after` seconds.
+    `failing_ids` is a dict of "listings" or "history" to item IDs whose requests to that endpoint always fail with a 404,
+    which is neither retried nor split.
+    Returns the server and its base URL. Universalis is at `{base_url}/api`, and XIVAPI at `{base_url}/xivapi`.
+    """
+    server = MockServer(("127.0.0.1", 0), MockHandler)
+    server.catalog = SyntheticCatalog(10000) if catalog is None else catalog
+    server.latency = latency
+    server.error_rate = error_rate
+    server.throttle_rate = throttle_rate
+    server.retry_after = retry_after
+    server.unresolved_ids = set(unresolved_ids)
+    server.failing_ids = {
+        endpoint: set(item_ids) for endpoint, item_ids in (failing_ids or {}).items()
+    }
+    server.rng = random.Random(seed)
+    server.request_count = 0
+    server.error_count = 0
+    server.throttled_count = 0
+    # Listings changed by WebSocket events, keyed like `apply_listing_event`
+    server.live_listings = {}
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
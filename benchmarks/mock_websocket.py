@@ -0,0 +1,216 @@
+# A local stand-in for the Universalis WebSocket API, which replays a recording of events
+# to every client that subscribed to them, for benchmarks that shouldn't touch the real service.
+# Recordings are JSON lines of decoded events, and are sent as BSON like the real API does.
+import json
+import random
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+from src import bson_codec
+from src.websocket import (
+    OPCODE_BINARY,
+    OPCODE_CLOSE,
+    WebSocket,
+    get_accept_key,
+)
+
+from .mock_server import synthetic_listings
+
+# Clients get this long after their first subscription to send the rest, before the replay starts.
+SUBSCRIBE_WAIT = 0.2
+
+
+def record_events(catalog, world_ids, num_events, seed=0):
+    """
+    Generates a recording of random events on the given worlds, consistent with the listings
+    served by the mock server: only listings that are listed get removed, and added ones are new.
+    """
+    rng = random.Random(seed)
+    item_ids = catalog.marketable_ids()
+    # (world ID, item ID) to a dict of listing ID to listing, once an item has had an event
+    listings = {}
+    events = []
+    now = int(time.time())
+    for i in range(0, num_events):
+        world_id = rng.choice(world_ids)
+        item_id = rng.choice(item_ids)
+        key = (world_id, item_id)
+        if key not in listings:
+            listings[key] = {
+                listing["listingID"]: listing for listing in synthetic_listings(item_id)
+            }
+        current = listings[key]
+
+        roll = rng.random()
+        event = {"item": item_id, "world": world_id}
+        if roll < 0.2:
+            event["event"] = "sales/add"
+            event["sales"] = [
+                {
+                    "pricePerUnit": rng.randint(10, 20000),
+                    "quantity": rng.randint(1, 99),
+                    "hq": rng.random() < 0.3,
+                    "timestamp": now,
+                }
+                for _ in range(0, rng.randint(1, 2))
+            ]
+        elif roll < 0.6 and len(current) > 0:
+            event["event"] = "listings/remove"
+            removed = rng.sample(list(current), min(len(current), rng.randint(1, 2)))
+            event["listings"] = [current.pop(listing_id) for listing_id in removed]
+        else:
+            event["event"] = "listings/add"
+            added = [
+                {
+                    "listingID": f"live-{i}-{j}",
+                    "pricePerUnit": rng.randint(10, 20000),
+                    "quantity": rng.randint(1, 99),
+                    "hq": rng.random() < 0.3,
+                }
+                for j in range(0, rng.randint(1, 3))
+            ]
+            current.update((listing["listingID"], listing) for listing in added)
+            event["listings"] = added
+        events.append(event)
+    return events
+
+
+def write_recording(path, events) -> None:
+    with open(path, "w", encoding="utf-8") as file:
+        for event in events:
+            file.write(json.dumps(event) + "\n")
+
+
+def read_recording(path):
+    with open(path, encoding="utf-8") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def get_channel(event) -> str:
+    return f"{event['event']}{{world={event['world']}}}"
+
+
+class MockWebSocketServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+
+class MockWebSocketHandler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if not self.handshake():
+            return
+        self.subscriptions = set()
+        self.subscribed = threading.Event()
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        reader = threading.Thread(target=self.read_messages, daemon=True)
+        reader.start()
+
+        if self.subscribed.wait(5):
+            time.sleep(SUBSCRIBE_WAIT)
+            self.server.replaying.wait()
+            self.replay()
+        # Stays open until the client leaves, like the real API
+        reader.join()
+
+    def handshake(self) -> bool:
+        self.rfile.readline()
+        headers = {}
+        while True:
+            line = self.rfile.readline().decode("latin-1")
+            if line in ("\r\n", "\n", ""):
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        key = headers.get("sec-websocket-key")
+        if key is None or headers.get("upgrade", "").lower() != "websocket":
+            self.wfile.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n")
+            return False
+        self.wfile.write(
+            (
+                "HTTP/1.1 101 Switching Protocols\r\n"
+                "Upgrade: websocket\r\n"
+                "Connection: Upgrade\r\n"
+                f"Sec-WebSocket-Accept: {get_accept_key(key)}\r\n\r\n"
+            ).encode()
+        )
+        return True
+
+    def read_messages(self) -> None:
+        # Reads the client's masked frames with the client's own frame parser
+        connection = WebSocket(self.request, self.rfile)
+        while (frame := connection.read_frame()) is not None:
+            _, opcode, payload = frame
+            if opcode == OPCODE_CLOSE:
+                self.send_frame(b"", OPCODE_CLOSE)
+                break
+            if opcode != OPCODE_BINARY:
+                continue
+            message = bson_codec.decode(payload)
+            if message.get("event") == "subscribe":
+                with self.lock:
+                    self.subscriptions.add(message["channel"])
+                self.subscribed.set()
+
+    def replay(self) -> None:
+        server = self.server
+        interval = 0 if server.rate <= 0 else 1 / server.rate
+        start = time.perf_counter()
+        for i, (channel, event, payload) in enumerate(server.frames):
+            with self.lock:
+                if channel not in self.subscriptions:
+                    continue
+            if interval > 0:
+                delay = start + i * interval - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            if server.rest_server is not None:
+                server.rest_server.apply_event(event)
+            try:
+                self.send_frame(payload, OPCODE_BINARY)
+            except OSError:
+                return
+            with server.lock:
+                server.sent_count += 1
+
+    def send_frame(self, payload, opcode) -> None:
+        # Server frames aren't masked
+        length = len(payload)
+        if length < 126:
+            header = struct.pack("!BB", 0x80 | opcode, length)
+        elif length < 2**16:
+            header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+        with self.write_lock:
+            self.wfile.write(header + payload)
+
+
+def start_websocket_server(events, rate=0.0, rest_server=None, paused=False):
+    """
+    Starts the mock WebSocket server on a free local port in a background thread.
+    Each client is sent the events it subscribed to, in order, at `rate` events per second or as fast as possible.
+    With `rest_server`, the listings it serves are changed by each event just before the event is sent,
+    like Universalis does, so only one client should connect.
+    With `paused`, nothing is sent until `replaying` is set.
+    Returns the server and its URL.
+    """
+    server = MockWebSocketServer(("127.0.0.1", 0), MockWebSocketHandler)
+    # Encoded once up front, so the replay measures the client rather than the encoder.
+    server.frames = [
+        (get_channel(event), event, bson_codec.encode(event)) for event in events
+    ]
+    server.rate = rate
+    server.rest_server = rest_server
+    server.replaying = threading.Event()
+    if not paused:
+        server.replaying.set()
+    server.sent_count = 0
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"ws://127.0.0.1:{server.server_address[1]}"
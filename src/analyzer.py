@@ -0,0 +1,211 @@
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from .categories import CATEGORIES, CatalogItem, describe
+from .metrics import metrics
+from .scoring import FEATURES, StreamingRanker
+from .universalis import iter_items
+from .util import clamp
+
+MAX_WORLD_WORKERS = 4
+
+MIN_LEVEL = 1
+MAX_LEVEL = 90
+
+
+@metrics.timed("load_items")
+def load_items(con: sqlite3.Connection, categories, min_level=None, max_level=None):
+    """
+    Returns `CatalogItem` tuples for every item in any of the given categories,
+    or `None` if none of them have any items in the database.
+    Level bounds only apply to categories with levels, and are clamped and swapped if needed.
+    """
+    if isinstance(categories, str):
+        categories = [categories]
+    level_categories = [
+        category for category in categories if CATEGORIES[category]["has_level"]
+    ]
+    other_categories = [
+        category for category in categories if not CATEGORIES[category]["has_level"]
+    ]
+    try:
+        # Stops at the first matching row instead of counting them all
+        found = con.execute(
+            f"select exists (select 1 from items where category in ({','.join('?' * len(categories))}))",
+            categories,
+        ).fetchone()[0]
+    except sqlite3.OperationalError:
+        found = False
+    if not found:
+        print(
+            f"Error: {' and '.join(CATEGORIES[category]['name'] for category in categories)} database is empty."
+        )
+        return None
+    print(f"Successfully connected to {describe(categories)} database.")
+
+    # Each part can be answered from an index on its own, which an `or` between them would prevent.
+    parts = []
+    params = []
+    if len(level_categories) > 0:
+        min_level = clamp(
+            MIN_LEVEL if min_level is None else min_level, MIN_LEVEL, MAX_LEVEL
+        )
+        max_level = clamp(
+            MAX_LEVEL if max_level is None else max_level, MIN_LEVEL, MAX_LEVEL
+        )
+        if min_level > max_level:
+            min_level, max_level = max_level, min_level
+            print("Automatically swapped minimum and maximum level.")
+        parts.append(
+            f"select item_id, name from items where category in ({','.join('?' * len(level_categories))}) and gathering_level between ? and ?"
+        )
+        params.extend([*level_categories, min_level, max_level])
+    if len(other_categories) > 0:
+        parts.append(
+            f"select item_id, name from items where category in ({','.join('?' * len(other_categories))})"
+        )
+        params.extend(other_categories)
+    rows = con.execute(" union all ".join(parts), params)
+    # An item can be in more than one category, but should only be scanned once.
+    items = list(dict(rows).items()) if len(categories) > 1 else rows
+    items = list(map(CatalogItem._make, items))
+
+    if len(level_categories) > 0:
+        print(
+            f"Found {len(items)} {describe(categories)} between Level {min_level} and Level {max_level}"
+        )
+    else:
+        print(f"Found {len(items)} {describe(categories)}.")
+    return items
+
+
+@metrics.timed("analyze")
+def analyze(
+    items, world_name, num_recommendations=5, cache=None, quality="nq", history=None
+):
+    """
+    Queries Universalis for the given `(item_id, name)` tuples on a world or data centre,
+    and returns the best `num_recommendations` entries by score for the given quality ("nq" or "hq").
+    Entries are ranked as each batch arrives, so the current leader is shown while the scan runs.
+    With a `history`, new data is recorded and the results include each item's recent price trend.
+    """
+    print("\nMaking Universalis requests...\n")
+    ranker = StreamingRanker(num_recommendations, quality)
+    for entries in iter_items(items, world_name, cache=cache, history=history):
+        ranker.add(entries)
+        leaders = ranker.leaders()
+        if len(leaders) > 0:
+            print(f"- Current leader: {leaders[0].item_name}")
+    if len(ranker) < 1:
+        print("\nError: No results found.")
+        return []
+    print(f"\nSuccessfully found results for {len(ranker)} items.")
+
+    results = ranker.finalize()
+    add_trends(results, history, world_name)
+    return results
+
+
+@metrics.timed("analyze")
+def analyze_worlds(
+    items,
+    world_names,
+    num_recommendations=5,
+    cache=None,
+    quality="nq",
+    max_workers=MAX_WORLD_WORKERS,
+    history=None,
+):
+    """
+    Queries Universalis for the same items on several worlds in parallel.
+    Every worker shares the Universalis rate limiter.
+    Returns a dict of each world's best entries, scored against that world only,
+    and the best entries across all worlds, scored against each other.
+    """
+    print(f"\nMaking Universalis requests for {len(world_names)} worlds...\n")
+    overall_ranker = StreamingRanker(num_recommendations, quality)
+
+    def rank_world(world_name):
+        world_ranker = StreamingRanker(num_recommendations, quality)
+        for entries in iter_items(
+            items, world_name, cache=cache, verbose=False, history=history
+        ):
+            for entry in entries:
+                entry.world = world_name
+            world_ranker.add(entries)
+            overall_ranker.add(entries)
+        print(f"Found results for {len(world_ranker)} items on {world_name}.")
+        results = world_ranker.finalize()
+        add_trends(results, history, world_name)
+        return results
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            world_name: pool.submit(rank_world, world_name)
+            for world_name in world_names
+        }
+        per_world = {
+            world_name: future.result() for world_name, future in futures.items()
+        }
+
+    overall = overall_ranker.finalize()
+    add_trends(overall, history)
+    return per_world, overall
+
+
+def add_trends(entries, history, world_name=None) -> None:
+    """
+    Adds the moving average price and volatility of each entry's item from the price history, where known.
+    Entries from several worlds use their own `world` instead of `world_name`.
+    """
+    if history is None:
+        return
+    worlds = {entry.world or world_name for entry in entries}
+    trends = {
+        world: history.get_trends(
+            world,
+            [
+                entry.item_id
+                for entry in entries
+                if (entry.world or world_name) == world
+            ],
+        )
+        for world in worlds
+    }
+    for entry in entries:
+        trend = trends[entry.world or world_name].get(entry.item_id, {})
+        for name, value in trend.items():
+            setattr(entry, name, value)
+
+
+def format_table(entries, quality="nq"):
+    """
+    Formats the given entries for the tabulate library.
+    """
+    table = {
+        "Name": [entry.item_name for entry in entries],
+        "World": [entry.world for entry in entries],
+    }
+    for header, field in zip(
+        [
+            "Avg. Listing Price",
+            "Avg. Sale Price",
+            "Sales Per Day",
+            "Avg - Min Listing Price",
+        ],
+        FEATURES[quality],
+    ):
+        table[header] = [getattr(entry, field) for entry in entries]
+    # Trends are only known once an item has been seen before
+    moving_averages = [
+        getattr(entry, f"movingAveragePrice{quality.upper()}") for entry in entries
+    ]
+    if any(value is not None for value in moving_averages):
+        table["Moving Avg. Listing Price"] = moving_averages
+        table["Volatility"] = [
+            getattr(entry, f"volatility{quality.upper()}") for entry in entries
+        ]
+    # Only multi-world results have a world
+    if all(world is None for world in table["World"]):
+        del table["World"]
+    return table
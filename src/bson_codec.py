@@ -0,0 +1,130 @@
+# Minimal BSON encoding and decoding, for the messages of the Universalis WebSocket API.
+# Only the types that API uses are supported, so no BSON library is needed.
+import struct
+
+INT32 = struct.Struct("<i")
+INT64 = struct.Struct("<q")
+UINT64 = struct.Struct("<Q")
+DOUBLE = struct.Struct("<d")
+
+TYPE_DOUBLE = 0x01
+TYPE_STRING = 0x02
+TYPE_DOCUMENT = 0x03
+TYPE_ARRAY = 0x04
+TYPE_BINARY = 0x05
+TYPE_OBJECT_ID = 0x07
+TYPE_BOOL = 0x08
+TYPE_DATETIME = 0x09
+TYPE_NULL = 0x0A
+TYPE_INT32 = 0x10
+TYPE_TIMESTAMP = 0x11
+TYPE_INT64 = 0x12
+
+
+def decode(data: bytes):
+    """
+    Decodes a BSON document into a dict. Datetimes are returned as milliseconds since the epoch,
+    and object IDs as hex strings. Raises `ValueError` for malformed or unsupported data.
+    """
+    try:
+        value, end = decode_document(bytes(data), 0, False)
+    except (IndexError, struct.error) as error:
+        raise ValueError(f"Malformed BSON: {error}") from error
+    if end != len(data):
+        raise ValueError("Malformed BSON: trailing data after the document")
+    return value
+
+
+def decode_document(data, offset, is_array):
+    """
+    Decodes the document or array at `offset`, and returns it along with the offset after it.
+    """
+    size = INT32.unpack_from(data, offset)[0]
+    end = offset + size
+    if size < 5 or end > len(data) or data[end - 1] != 0:
+        raise ValueError("Malformed BSON: bad document size")
+    offset += 4
+    result = [] if is_array else {}
+    while offset < end - 1:
+        element_type = data[offset]
+        name_end = data.index(0, offset + 1)
+        name = data[offset + 1 : name_end].decode()
+        offset = name_end + 1
+
+        if element_type == TYPE_DOUBLE:
+            value = DOUBLE.unpack_from(data, offset)[0]
+            offset += 8
+        elif element_type == TYPE_STRING:
+            length = INT32.unpack_from(data, offset)[0]
+            # The length includes the terminating null
+            value = data[offset + 4 : offset + 3 + length].decode()
+            offset += 4 + length
+        elif element_type in (TYPE_DOCUMENT, TYPE_ARRAY):
+            value, offset = decode_document(data, offset, element_type == TYPE_ARRAY)
+        elif element_type == TYPE_BINARY:
+            length = INT32.unpack_from(data, offset)[0]
+            # Skips the subtype
+            value = data[offset + 5 : offset + 5 + length]
+            offset += 5 + length
+        elif element_type == TYPE_OBJECT_ID:
+            value = data[offset : offset + 12].hex()
+            offset += 12
+        elif element_type == TYPE_BOOL:
+            value = data[offset] != 0
+            offset += 1
+        elif element_type in (TYPE_DATETIME, TYPE_INT64):
+            value = INT64.unpack_from(data, offset)[0]
+            offset += 8
+        elif element_type == TYPE_NULL:
+            value = None
+        elif element_type == TYPE_INT32:
+            value = INT32.unpack_from(data, offset)[0]
+            offset += 4
+        elif element_type == TYPE_TIMESTAMP:
+            value = UINT64.unpack_from(data, offset)[0]
+            offset += 8
+        else:
+            raise ValueError(f"Unsupported BSON type {element_type:#04x}")
+
+        if is_array:
+            result.append(value)
+        else:
+            result[name] = value
+    if offset != end - 1:
+        raise ValueError("Malformed BSON: element runs past the end of its document")
+    return result, end
+
+
+def encode(document) -> bytes:
+    """
+    Encodes a dict of strings, numbers, booleans, `None`, lists and nested dicts into a BSON document.
+    """
+    return bytes(encode_document(document.items()))
+
+
+def encode_document(items) -> bytearray:
+    body = bytearray()
+    for name, value in items:
+        name = str(name).encode() + b"\x00"
+        # bool is checked before int, since it's a subclass of int
+        if isinstance(value, bool):
+            body += bytes([TYPE_BOOL]) + name + (b"\x01" if value else b"\x00")
+        elif isinstance(value, int):
+            if -(2**31) <= value < 2**31:
+                body += bytes([TYPE_INT32]) + name + INT32.pack(value)
+            else:
+                body += bytes([TYPE_INT64]) + name + INT64.pack(value)
+        elif isinstance(value, float):
+            body += bytes([TYPE_DOUBLE]) + name + DOUBLE.pack(value)
+        elif isinstance(value, str):
+            encoded = value.encode() + b"\x00"
+            body += bytes([TYPE_STRING]) + name + INT32.pack(len(encoded)) + encoded
+        elif value is None:
+            body += bytes([TYPE_NULL]) + name
+        elif isinstance(value, dict):
+            body += bytes([TYPE_DOCUMENT]) + name + encode_document(value.items())
+        elif isinstance(value, (list, tuple)):
+            body += bytes([TYPE_ARRAY]) + name + encode_document(enumerate(value))
+        else:
+            raise TypeError(f"Can't encode {type(value).__name__} as BSON")
+    return bytearray(INT32.pack(len(body) + 5)) + body + b"\x00"
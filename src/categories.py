@@ -0,0 +1,44 @@
+from collections import namedtuple
+
+# Item categories that can be analyzed, keyed by their command line name.
+# Each category is either every item on a gathering sheet, or every item on the Item sheet matching a filter.
+# Adding one here is enough for it to be built by `update-db` and offered by the analyzer.
+#   sheet: the game data sheet that the category's source IDs come from
+#   filter: an (Item field, ID) pair that every item in the category has, used as an XIVAPI filter and on the CSV sheets
+#   has_level: whether items have a gathering level that can be filtered on
+CATEGORIES = {
+    "gatherable": {
+        "name": "Gatherable",
+        "description": "gatherable items",
+        "sheet": "GatheringItem",
+        "filter": None,
+        "has_level": True,
+    },
+    "painting": {
+        "name": "Painting",
+        "description": "paintings",
+        "sheet": "Item",
+        "filter": ("ItemSearchCategory", 82),
+        "has_level": False,
+    },
+    "orchestrion-roll": {
+        "name": "Orchestrion Roll",
+        "description": "orchestrion rolls",
+        "sheet": "Item",
+        "filter": ("ItemUICategory", 94),
+        "has_level": False,
+    },
+}
+
+# An item loaded from the catalog. Still unpacks like the plain `(item_id, name)` tuples it replaces.
+CatalogItem = namedtuple("CatalogItem", ["item_id", "name"])
+
+
+def describe(categories) -> str:
+    """
+    Returns a readable description of the given category names, e.g. "paintings and orchestrion rolls".
+    """
+    descriptions = [CATEGORIES[category]["description"] for category in categories]
+    if len(descriptions) < 2:
+        return "".join(descriptions)
+    return f"{', '.join(descriptions[:-1])} and {descriptions[-1]}"
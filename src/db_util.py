@@ -1,30 +1,41 @@
-import json
+import csv
+import hashlib
+import pathlib
 import sqlite3
-import urllib.request as urllib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import List
 from urllib.error import HTTPError
 
 from ratelimit import limits, sleep_and_retry
 
-from .util import get_user_agent
+from .http_client import get_json
+from .categories import CATEGORIES
+from .metrics import metrics
+from .retry import NETWORK_ERRORS, call_with_retries, fetch_with_splitting
+from .util import TokenBucket, make_batches, print_progress
 
+MAX_WORKERS = 8
+BATCH_SIZE = 20
+# Incremental updates also query this fraction of the known IDs again, a different slice each time,
+# so renamed items and changed gathering levels are picked up within this many updates.
+RECHECK_UPDATES = 10
+# XIVAPI returns at most this many results per page.
+PAGE_SIZE = 3000
+# Read on every request, so they can be pointed at a local mock server.
+XIVAPI_URL = "https://xivapi.com"
+MARKETABLE_URL = "https://universalis.app/api/marketable"
 
-def dict_factory(cursor, row):
-    # From the sqlite3 documentation
-    d = {}
-    for idx, col in enumerate(cursor.description):
-        d[col[0]] = row[idx]
-    return d
+# Shared by every batched XIVAPI request, including retries.
+xivapi_limiter = TokenBucket(20, 1)
 
 
 @sleep_and_retry
 @limits(20, 1)
 def query_gathering_item(id):
-    request = urllib.Request(
-        f"https://xivapi.com/gatheringitem/{id}?columns=Item.Name,Item.ID,GatheringItemLevel.GatheringItemLevel"
+    data = get_json(
+        f"{XIVAPI_URL}/gatheringitem/{id}?columns=Item.Name,Item.ID,GatheringItemLevel.GatheringItemLevel"
     )
-    request.add_header("User-Agent", get_user_agent())
-    data = json.loads(urllib.urlopen(request).read())
 
     try:
         out_data = {}
@@ -36,59 +47,62 @@ def query_gathering_item(id):
         return {}
 
 
-@sleep_and_retry
-@limits(20, 1)
-def query_gathering_items(ids, batch_size=20):
-    batches = []
+def fetch_results(make_url, ids):
+    """
+    Requests the URL made from the given IDs and returns its list of results, retrying transient failures.
+    Rejected batches are split with `fetch_with_splitting`, so that only the bad IDs are lost.
+    Lost IDs are `False` in the results, same as missing items.
+    """
+
+    def fetch(ids):
+        return call_with_retries(get_json, make_url(ids), limiter=xivapi_limiter)[
+            "Results"
+        ]
+
+    def combine(parts):
+        return [
+            result
+            for half, results in parts
+            for result in ([False] * len(half) if results is None else results)
+        ]
+
+    results = fetch_with_splitting(fetch, ids, combine)
+    return [False] * len(ids) if results is None else results
+
+
+def query_gathering_batch(ids):
+    """
+    Queries XIVAPI for one batch of GatheringItem IDs.
+    """
+    # TODO Could probably format "columns" in a better way
+    results = fetch_results(
+        lambda ids: f"{XIVAPI_URL}/gatheringitem?limit={len(ids)}&ids={','.join(map(str, ids))}&columns=ID,Item.Name,Item.ID,GatheringItemLevel.GatheringItemLevel",
+        ids,
+    )
     entries = []
-    while len(ids) > 0:
-        batches.append(ids[:batch_size])
-        ids = ids[batch_size:]
-    print(f"Querying {len(batches)} batches of {batch_size} items each...")
-
-    for i in range(0, len(batches)):
-        id_batch = batches[i]
-        print(f"- Querying XIVAPI for Batch {i + 1}...")
-
-        request = urllib.Request(
-            # TODO Could probably format "columns" in a better way
-            f"https://xivapi.com/gatheringitem?limit={batch_size}&ids={','.join(map(str, id_batch))}&columns=Item.Name,Item.ID,GatheringItemLevel.GatheringItemLevel"
-        )
-        request.add_header("User-Agent", get_user_agent())
-        try:
-            response = json.loads(urllib.urlopen(request).read())
-        except HTTPError:
-            print("  - Request failed. Skipping batch...")
+    for item in results:
+        if not item or not item["Item"] or not item["GatheringItemLevel"]:
             continue
-        if False in response["Results"]:
-            print(
-                f"  - Failed to retrieve data for {response['Results'].count(False)} items."
-            )
-        else:
-            print("  - Successfully found item data for all items in batch:")
-
-        for item in response["Results"]:
-            if not item:
-                continue
 
-            entry_data = {
+        entries.append(
+            {
+                "source_id": item["ID"],
                 "item_id": item["Item"]["ID"],
                 "name": item["Item"]["Name"],
                 "gathering_level": item["GatheringItemLevel"]["GatheringItemLevel"],
             }
-            entries.append(entry_data)
-            print(
-                f"    - Found data for Item {entry_data['item_id']}: {entry_data['name']}, {entry_data['gathering_level']}"
-            )
+        )
     return entries
 
 
+def query_gathering_items(ids, batch_size=BATCH_SIZE, verbose=True):
+    return query_details([ids], query_gathering_batch, batch_size, verbose)[1]
+
+
 @sleep_and_retry
 @limits(20, 1)
 def query_regular_item(id):
-    request = urllib.Request(f"https://xivapi.com/item/{id}?columns=Name,ID")
-    request.add_header("User-Agent", get_user_agent())
-    data = json.loads(urllib.urlopen(request).read())
+    data = get_json(f"{XIVAPI_URL}/item/{id}?columns=Name,ID")
 
     try:
         out_data = {}
@@ -99,185 +113,606 @@ def query_regular_item(id):
         return {}
 
 
-@sleep_and_retry
-@limits(20, 1)
-def query_regular_items(ids, batch_size=20):
+def query_regular_batch(ids):
+    """
+    Queries XIVAPI for one batch of item IDs.
+    """
     # Note that querying items in batches can only retrieve name and item id.
     # Shouldn't be an issue since those are the only columns needed currently.
-
-    batches = []
-    entries = []
-    while len(ids) > 0:
-        batches.append(ids[:batch_size])
-        ids = ids[batch_size:]
-    print(f"Querying {len(batches)} batches of {batch_size} items each...")
-
-    for i in range(0, len(batches)):
-        id_batch = batches[i]
-        print(f"- Querying XIVAPI for Batch {i + 1}...")
-
-        request = urllib.Request(
-            f"https://xivapi.com/item?limit={batch_size}&ids={','.join(map(str, id_batch))}"
-        )
-        request.add_header("User-Agent", get_user_agent())
-        try:
-            response = json.loads(urllib.urlopen(request).read())
-        except HTTPError:
-            print("  - Request failed. Skipping batch...")
-            continue
-        if False in response["Results"]:
+    results = fetch_results(
+        lambda ids: f"{XIVAPI_URL}/item?limit={len(ids)}&ids={','.join(map(str, ids))}",
+        ids,
+    )
+    return [
+        {
+            "source_id": item["ID"],
+            "item_id": item["ID"],
+            "name": item["Name"],
+        }
+        for item in results
+        if item
+    ]
+
+
+def query_regular_items(ids, batch_size=BATCH_SIZE, verbose=True):
+    return query_details([ids], query_regular_batch, batch_size, verbose)[1]
+
+
+@metrics.timed("catalog_fetch")
+def query_details(
+    id_pages,
+    query_batch,
+    batch_size=BATCH_SIZE,
+    verbose=True,
+    skip_ids=frozenset(),
+    max_workers=MAX_WORKERS,
+):
+    """
+    Queries the details of every ID in the given pages, except for `skip_ids`, with `query_batch`.
+    Pages can be a generator that's still discovering IDs: each full batch is queried as soon as it's known,
+    so discovery and detail queries overlap instead of running one after the other.
+    Returns the set of every ID in the pages, and the list of details.
+    """
+    source_ids = set()
+    details = []
+    pending_ids = []
+    futures = deque()
+    num_batches = 0
+    num_received = 0
+
+    def receive(future, batch) -> None:
+        nonlocal num_received
+        entries = future.result()
+        details.extend(entries)
+        num_received += 1
+        if not verbose:
+            return
+        print(f"- Received XIVAPI Batch {num_received}:")
+        if len(entries) < len(batch):
+            print(f"  - Failed to retrieve data for {len(batch) - len(entries)} items.")
+        for entry in entries:
+            level = entry.get("gathering_level")
             print(
-                f"  - Failed to retrieve data for {response['Results'].count(False)} items."
+                f"  - Found data for Item {entry['item_id']}: {entry['name']}{'' if level is None else f', {level}'}"
             )
-        else:
-            print("  - Successfully found item data for all items in batch:")
 
-        for item in response["Results"]:
-            if not item:
-                continue
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for page in id_pages:
+            source_ids.update(page)
+            pending_ids.extend(i for i in page if i not in skip_ids)
+            # Leftover IDs wait for the next page, so batches stay full.
+            num_full = len(pending_ids) - len(pending_ids) % batch_size
+            for batch in make_batches(pending_ids[:num_full], batch_size):
+                futures.append((pool.submit(query_batch, batch), batch))
+                num_batches += 1
+            pending_ids = pending_ids[num_full:]
+            while len(futures) > 0 and futures[0][0].done():
+                receive(*futures.popleft())
+        if len(pending_ids) > 0:
+            futures.append((pool.submit(query_batch, pending_ids), pending_ids))
+            num_batches += 1
+
+        while len(futures) > 0:
+            receive(*futures.popleft())
+            if not verbose:
+                print_progress(num_received, num_batches, "Querying XIVAPI batches")
+    return source_ids, details
+
+
+def iter_item_ids(base_url: str, params: List[str], name: str, max_workers=MAX_WORKERS):
+    """
+    Yields the list of IDs on each page of an XIVAPI list or search, as each page arrives.
+    The first page says how many pages there are, and the rest are requested concurrently.
+    """
+
+    def fetch_page(page):
+        query = "&".join([*params, "columns=ID", f"limit={PAGE_SIZE}", f"page={page}"])
+        return call_with_retries(
+            get_json, f"{base_url}?{query}", limiter=xivapi_limiter
+        )
 
-            entry_data = {
-                "item_id": item["ID"],
-                "name": item["Name"],
-            }
-            entries.append(entry_data)
+    print(f"Attempting to retrieve {name}s from XIVAPI")
+    data = fetch_page(1)
+    page_total = data["Pagination"]["PageTotal"]
+    print(f"Successfully retrieved {name}s on Page 1 of {page_total} from XIVAPI.")
+    yield [item["ID"] for item in data["Results"]]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(fetch_page, page) for page in range(2, page_total + 1)]
+        for future in as_completed(futures):
+            data = future.result()
             print(
-                f"    - Found data for Item {entry_data['item_id']}: {entry_data['name']}"
+                f"Successfully retrieved {name}s on Page {data['Pagination']['Page']} of {page_total} from XIVAPI."
             )
-    return entries
+            yield [item["ID"] for item in data["Results"]]
+
+
+def open_db(path="market_analyzer.db") -> sqlite3.Connection:
+    con = sqlite3.connect(path)
+    # WAL lets the analyzer keep reading while the catalog is being written,
+    # and with WAL, NORMAL sync avoids an fsync per commit without risking corruption.
+    con.execute("pragma journal_mode = wal")
+    con.execute("pragma synchronous = normal")
+    # The scratch tables of `write_sources` never need to touch the disk
+    con.execute("pragma temp_store = memory")
+    return con
+
+
+# Catalog tables from before every category shared the `items` table.
+LEGACY_TABLES = {
+    "gathering_items": "gatherable",
+    "painting_items": "painting",
+    "orchestrion_roll_items": "orchestrion-roll",
+}
+# Where the source IDs for each sheet are listed on XIVAPI, relative to `XIVAPI_URL`, and how their details are queried.
+SHEET_QUERIES = {
+    "GatheringItem": ("gatheringitem", query_gathering_batch),
+    "Item": ("search", query_regular_batch),
+}
+
+
+# Several gathering points can share an item, in which case the item is built from the lowest level one,
+# and from the lowest source ID among those. Sources without a level come last.
+SOURCE_LEVEL = "ifnull(gathering_level, 1 << 62)"
+# In-memory tables that `write_sources` works out its changes in.
+SCRATCH_TABLES = {
+    # The details being written, and then only the ones that changed
+    "catalog_incoming": "(source_id integer primary key, item_id integer, name text, gathering_level integer)",
+    "catalog_removed": "(source_id integer primary key)",
+    # Items with a source that changed, which are built again
+    "catalog_affected": "(item_id integer primary key)",
+    # Every source of those items, kept in order so that each item's first source is the one it's built from
+    "catalog_pool": "(item_id integer, source_level integer, source_id integer, name text, gathering_level integer, primary key (item_id, source_level, source_id)) without rowid",
+}
+
+
+def create_catalog_tables(con: sqlite3.Connection) -> None:
+    # Every category's items live in one table, so any combination of categories can be loaded in one query.
+    # Each item remembers the XIVAPI row it was built from, which isn't also kept in `catalog_sources`.
+    con.execute(
+        "create table if not exists items (category text, item_id integer, name text, gathering_level integer, source_id integer, primary key (category, item_id)) without rowid"
+    )
+    # Covers level filters without touching the table itself. Item IDs are part of every index on a
+    # WITHOUT ROWID table, since they're part of the primary key.
+    con.execute("drop index if exists items_category_level")
+    con.execute(
+        "create index if not exists items_category_level_name on items (category, gathering_level, name)"
+    )
+    # Every other XIVAPI row that has been looked up, so that later updates only need to query new IDs:
+    # those of items that aren't marketable, and those of gathering items that another gathering point outranks.
+    # For gathering items, the source ID is the GatheringItem ID rather than the item ID.
+    con.execute(
+        "create table if not exists catalog_sources (category text, source_id integer, item_id integer, name text, gathering_level integer, primary key (category, source_id)) without rowid"
+    )
+    con.execute(
+        "create index if not exists catalog_sources_item on catalog_sources (category, item_id)"
+    )
+    # The marketable items each category was last built from, to tell when it has to be rebuilt.
+    con.execute(
+        "create table if not exists catalog_state (category text primary key, marketable_hash text, sync_count integer not null default 0)"
+    )
+    # Added after the table itself
+    columns = [row[1] for row in con.execute("pragma table_info(catalog_state)")]
+    if "sync_count" not in columns:
+        con.execute(
+            "alter table catalog_state add column sync_count integer not null default 0"
+        )
+    migrate_legacy_tables(con)
+    migrate_item_sources(con)
+
+
+def migrate_legacy_tables(con: sqlite3.Connection) -> None:
+    """
+    Moves the contents of the old per-category tables into `items`, and drops them.
+    """
+    with con:
+        columns = [row[1] for row in con.execute("pragma table_info(catalog_sources)")]
+        if "table_name" in columns:
+            con.execute(
+                "alter table catalog_sources rename column table_name to category"
+            )
+        for table_name, category in LEGACY_TABLES.items():
+            con.execute(
+                "update catalog_sources set category = ? where category = ?",
+                (category, table_name),
+            )
+            if (
+                con.execute(
+                    "select 1 from sqlite_master where type = 'table' and name = ?",
+                    (table_name,),
+                ).fetchone()
+                is None
+            ):
+                continue
+            level = "gathering_level" if table_name == "gathering_items" else "null"
+            con.execute(
+                f"insert or ignore into items (category, item_id, name, gathering_level) select ?, item_id, name, {level} from {table_name}",
+                (category,),
+            )
+            con.execute(f"drop table {table_name}")
+
+
+def migrate_item_sources(con: sqlite3.Connection) -> None:
+    """
+    Links each item to the source it was built from, the first time `items` has a `source_id` column,
+    and drops that source from `catalog_sources`, which used to hold every source.
+    """
+    columns = [row[1] for row in con.execute("pragma table_info(items)")]
+    if "source_id" in columns:
+        return
+    with con:
+        con.execute("alter table items add column source_id integer")
+        con.execute(
+            f"update items set source_id = (select source_id from catalog_sources where catalog_sources.category = items.category and catalog_sources.item_id = items.item_id order by {SOURCE_LEVEL}, source_id limit 1)"
+        )
+        con.execute(
+            "delete from catalog_sources where (category, source_id) in (select category, source_id from items)"
+        )
 
 
-def get_item_ids(base_url: str, params: List[str], name: str) -> List[int]:
-    params = "&".join(params)
-    cur_page = 1
-    ids = []
-    print(f"Attempting to retrieve {name}s from XIVAPI")
-    while cur_page is not None:
-        request = urllib.Request(f"{base_url}?{params}&limit=3000?page={cur_page}")
-        request.add_header("User-Agent", get_user_agent())
-        data = json.loads(urllib.urlopen(request).read())
-        if len(data) < 1:
-            print(f"Error: Failed to get {name}s from XIVAPI. Exiting...")
-        else:
-            print(f"Successfully retrieved {name}s on Page {cur_page} from XIVAPI.")
+def sync_category(
+    con: sqlite3.Connection,
+    category: str,
+    id_pages,
+    query_batch,
+    marketable_hash,
+    incremental=True,
+    verbose=True,
+) -> None:
+    """
+    Brings a category up to date with the XIVAPI IDs in the given pages, e.g. from `iter_item_ids`.
+    Only IDs that haven't been seen before are queried with `query_batch`, along with a rotating
+    `1 / RECHECK_UPDATES` of the known ones, unless `incremental` is false and every ID is queried.
+    Details are queried while the pages are still arriving.
+    All changes are applied in a single transaction, so readers never see a partially built category.
+    Expects the `marketable` temporary table to be filled with Universalis' marketable item IDs,
+    whose digest from `get_marketable_hash` is `marketable_hash`.
+    """
+    known_ids = get_known_ids(con, category)
+    sync_count = get_sync_count(con, category)
+    recheck_ids = {
+        source_id
+        for source_id in known_ids
+        if source_id % RECHECK_UPDATES == sync_count % RECHECK_UPDATES
+    }
+    try:
+        source_ids, details = query_details(
+            id_pages,
+            query_batch,
+            verbose=verbose,
+            skip_ids=known_ids - recheck_ids if incremental else frozenset(),
+        )
+    except (HTTPError, *NETWORK_ERRORS):
+        # Without every page, there's no telling which entries were actually removed.
+        print(f"Error: Failed to get every page of IDs for {category} from XIVAPI.")
+        return
+    removed_ids = known_ids - source_ids
+    print(
+        f"Found {len(source_ids - known_ids)} new and {len(removed_ids)} removed entries for {category}."
+    )
+    write_sources(con, category, details, removed_ids, marketable_hash)
+    with con:
+        con.execute(
+            "insert into catalog_state (category, sync_count) values (?, 1) on conflict (category) do update set sync_count = sync_count + 1",
+            (category,),
+        )
 
-        ids.extend(map(lambda x: x["ID"], data["Results"]))
-        # print(data)
-        if data["Pagination"]["PageNext"] != cur_page:
-            cur_page = data["Pagination"]["PageNext"]
-        else:
-            break
-    return ids
 
+def get_sync_count(con: sqlite3.Connection, category: str) -> int:
+    row = con.execute(
+        "select sync_count from catalog_state where category = ?", (category,)
+    ).fetchone()
+    return 0 if row is None else row[0]
 
-def update_db() -> None:
-    # Used to check which items are actually marketable from Universalis
-    univ_request = urllib.Request("https://universalis.app/api/marketable")
-    univ_request.add_header("User-Agent", get_user_agent())
-    univ_data = set(json.loads(urllib.urlopen(univ_request).read()))
-
-    con = sqlite3.connect("market_analyzer.db")
-    con.row_factory = dict_factory
-    cur = con.cursor()
-
-    if input("Update GatheringItem database (Y/n)? ").lower() != "n":
-        print("Building GatheringItem database...")
-        gi_ids = set(
-            get_item_ids("https://xivapi.com/gatheringitem", [], "GatheringItem")
-        )
 
-        cur.execute("drop table if exists gathering_items")
-        cur.execute(
-            "create table gathering_items (name text, item_id integer primary key, gathering_level integer)"
+def get_known_ids(con: sqlite3.Connection, category: str):
+    return {
+        row[0]
+        for row in con.execute(
+            "select source_id from catalog_sources where category = ? union all select source_id from items where category = ? and source_id is not null",
+            (category, category),
         )
-        gis = query_gathering_items(list(gi_ids))
-        for gi in gis:
-            if not "name" in gi or not "item_id" in gi or not "gathering_level" in gi:
-                continue
-            if not gi["item_id"] in univ_data:
-                continue
-            try:
-                cur.execute(
-                    "insert into gathering_items values (?, ?, ?)",
-                    (gi["name"], gi["item_id"], gi["gathering_level"]),
+    }
+
+
+@metrics.timed("catalog_write")
+def write_sources(
+    con: sqlite3.Connection, category: str, details, removed_ids, marketable_hash
+) -> None:
+    """
+    Stores the given source details, removes the given source IDs,
+    and builds the category's items with a changed source again, all in a single transaction.
+    Every item is built again if the marketable items, whose digest is `marketable_hash`,
+    changed since the category was last written. Nothing is written at all if nothing changed.
+    Expects the `marketable` temporary table to be filled with Universalis' marketable item IDs.
+    """
+    for table, definition in SCRATCH_TABLES.items():
+        con.execute(f"create temp table {table} {definition}")
+    try:
+        with con:
+            con.executemany(
+                "insert or replace into catalog_incoming values (?, ?, ?, ?)",
+                [
+                    (
+                        item["source_id"],
+                        item["item_id"],
+                        item["name"],
+                        item.get("gathering_level"),
+                    )
+                    for item in details
+                ],
+            )
+            con.executemany(
+                "insert or ignore into catalog_removed values (?)",
+                [(source_id,) for source_id in removed_ids],
+            )
+            # Details that are already stored as they are don't have to be written again.
+            # Only the incoming sources are looked up, so this doesn't grow with the catalog.
+            con.execute(
+                "delete from catalog_incoming where exists (select 1 from items where category = ? and item_id = catalog_incoming.item_id and source_id = catalog_incoming.source_id and name is catalog_incoming.name and gathering_level is catalog_incoming.gathering_level) or exists (select 1 from catalog_sources where category = ? and source_id = catalog_incoming.source_id and item_id = catalog_incoming.item_id and name is catalog_incoming.name and gathering_level is catalog_incoming.gathering_level)",
+                (category, category),
+            )
+            row = con.execute(
+                "select marketable_hash from catalog_state where category = ?",
+                (category,),
+            ).fetchone()
+            rebuild = row is None or row[0] != marketable_hash
+            changed = con.execute(
+                "select exists (select 1 from catalog_incoming)"
+            ).fetchone()[0]
+            if not changed and len(removed_ids) < 1 and not rebuild:
+                print(f"- {category} is already up to date.")
+                return
+
+            # The items of changed and removed sources, before and after the change
+            con.execute(
+                "insert or ignore into catalog_affected select item_id from catalog_incoming"
+            )
+            replaced = "select source_id from catalog_incoming union all select source_id from catalog_removed"
+            con.execute(
+                f"insert or ignore into catalog_affected select item_id from catalog_sources where category = ? and source_id in ({replaced})",
+                (category,),
+            )
+            # `items` can't be searched by source ID, so its rows are found by their incoming item IDs above,
+            # and it's only scanned for sources that may have moved to another item, or were removed.
+            lost = "select source_id from catalog_removed where not exists (select 1 from catalog_sources where category = ? and source_id = catalog_removed.source_id) union all select source_id from catalog_incoming where not exists (select 1 from items where category = ? and item_id = catalog_incoming.item_id and source_id = catalog_incoming.source_id) and not exists (select 1 from catalog_sources where category = ? and source_id = catalog_incoming.source_id)"
+            if con.execute(
+                f"select exists ({lost})", (category, category, category)
+            ).fetchone()[0]:
+                con.execute(
+                    f"insert or ignore into catalog_affected select item_id from items where category = ? and source_id in ({lost})",
+                    (category, category, category, category),
                 )
-            except sqlite3.IntegrityError:
-                print(f"- Skipping Item {gi['item_id']}: {gi['name']} as ID is taken.")
-            else:
-                print(f"- Successfully added Item {gi['item_id']}: {gi['name']}.")
-
-        con.commit()
-
-    if input("Update Paintings database (Y/n)? ").lower() != "n":
-        print("Building Paintings database...")
-        painting_ids = set(
-            get_item_ids(
-                "https://xivapi.com/search",
-                ["filters=ItemSearchCategory.ID=82"],
-                "Painting",
+            if rebuild:
+                con.execute(
+                    "insert or ignore into catalog_affected select item_id from items where category = ? union all select item_id from catalog_sources where category = ?",
+                    (category, category),
+                )
+
+            # Every remaining source of those items
+            affected = "select item_id from catalog_affected"
+            con.execute(
+                f"insert into catalog_pool select item_id, {SOURCE_LEVEL}, source_id, name, gathering_level from (select source_id, item_id, name, gathering_level from items where category = ? and item_id in ({affected}) and source_id not in ({replaced}) union all select source_id, item_id, name, gathering_level from catalog_sources where category = ? and item_id in ({affected}) and source_id not in ({replaced}) union all select source_id, item_id, name, gathering_level from catalog_incoming)",
+                (category, category),
+            )
+            con.execute(
+                f"delete from items where category = ? and item_id in ({affected})",
+                (category,),
+            )
+            con.execute(
+                f"delete from catalog_sources where category = ? and item_id in ({affected})",
+                (category,),
+            )
+            # Marketable items are built from their first source, since the rest are ignored,
+            # and every source that isn't behind an item goes into `catalog_sources`.
+            con.execute(
+                "insert or ignore into items select ?, item_id, name, gathering_level, source_id from catalog_pool where exists (select 1 from marketable where item_id = catalog_pool.item_id) order by item_id, source_level, source_id",
+                (category,),
+            )
+            con.execute(
+                "insert into catalog_sources select ?, source_id, item_id, name, gathering_level from catalog_pool where not exists (select 1 from items where category = ? and item_id = catalog_pool.item_id and source_id = catalog_pool.source_id)",
+                (category, category),
             )
+            con.execute(
+                "insert into catalog_state (category, marketable_hash) values (?, ?) on conflict (category) do update set marketable_hash = excluded.marketable_hash",
+                (category, marketable_hash),
+            )
+    finally:
+        # Dropped rather than left for the next write to clear, which would make even a write with nothing to do
+        # as slow as the last big one.
+        for table in SCRATCH_TABLES:
+            con.execute(f"drop table temp.{table}")
+    count = con.execute(
+        "select count(*) from items where category = ?", (category,)
+    ).fetchone()[0]
+    print(f"- {category} now contains {count} marketable items.")
+
+
+def get_marketable_hash(item_ids) -> str:
+    """
+    Returns a digest of the given marketable item IDs, which is the same for the same IDs in any order.
+    """
+    return hashlib.sha1(",".join(map(str, sorted(item_ids))).encode()).hexdigest()
+
+
+def update_db(
+    incremental=True, verbose=True, categories=None, path="market_analyzer.db"
+) -> None:
+    """
+    Updates the item database from XIVAPI.
+    By default, only items that weren't already in the database are queried.
+    Pass `incremental=False` to query every item again,
+    and `verbose=False` to show progress counters instead of a line per item.
+    `categories` is a list of names from `CATEGORIES` to update,
+    or `None` to ask about each category interactively.
+    """
+
+    def should_update(category):
+        if categories is None:
+            return (
+                input(f"Update {CATEGORIES[category]['name']} database (Y/n)? ").lower()
+                != "n"
+            )
+        return category in categories
+
+    # Used to check which items are actually marketable from Universalis
+    univ_data = set(get_json(MARKETABLE_URL))
+
+    con = open_db(path)
+    create_catalog_tables(con)
+    con.execute("create temp table marketable (item_id integer primary key)")
+    with con:
+        con.executemany(
+            "insert into marketable values (?)", [(item_id,) for item_id in univ_data]
         )
+    # Every category is compared against the same marketable items, so their digest is only taken once.
+    marketable_hash = get_marketable_hash(univ_data)
 
-        cur.execute("drop table if exists painting_items")
-        cur.execute(
-            "create table painting_items (name text, item_id integer primary key)"
+    for category, category_data in CATEGORIES.items():
+        if not should_update(category):
+            continue
+        print(f"Building {category_data['name']} database...")
+        list_path, query_batch = SHEET_QUERIES[category_data["sheet"]]
+        params = []
+        if category_data["filter"] is not None:
+            field, value = category_data["filter"]
+            params.append(f"filters={field}.ID={value}")
+        sync_category(
+            con,
+            category,
+            iter_item_ids(f"{XIVAPI_URL}/{list_path}", params, category_data["name"]),
+            query_batch,
+            marketable_hash,
+            incremental,
+            verbose,
         )
-        painting_items = query_regular_items(list(painting_ids))
-        for painting in painting_items:
-            if not "name" in painting or not "item_id" in painting:
-                continue
-            if not painting["item_id"] in univ_data:
-                continue
-            try:
-                cur.execute(
-                    "insert into painting_items values (?, ?)",
-                    (painting["name"], painting["item_id"]),
-                )
-            except sqlite3.IntegrityError:
-                print(
-                    f"- Skipping Item {painting['item_id']}: {painting['name']} as ID is taken."
-                )
-            else:
-                print(
-                    f"- Successfully added Item {painting['item_id']}: {painting['name']}."
-                )
 
-        con.commit()
+    con.close()
+    print("Finished setting up database.")
 
-    if input("Update Orchestrion Roll database (Y/n)? ").lower() != "n":
-        print("Building Orchestrion Roll database...")
-        orchestrion_roll_ids = set(
-            get_item_ids(
-                "https://xivapi.com/search",
-                ["filters=ItemUICategory.ID=94"],
-                "Orchestrion Roll",
-            )
-        )
 
-        cur.execute("drop table if exists orchestrion_roll_items")
-        cur.execute(
-            "create table orchestrion_roll_items (name text, item_id integer primary key)"
+def read_sheet(directory, sheet: str, columns):
+    """
+    Yields the row ID and the given columns of each row of a game data sheet,
+    in the community CSV format: a row of column indices, a row of column names and a row of types, then the data.
+    Rows are read one at a time, so the whole sheet is never in memory.
+    """
+    path = pathlib.Path(directory) / f"{sheet}.csv"
+    with open(path, newline="", encoding="utf-8-sig") as file:
+        reader = csv.reader(file)
+        next(reader)
+        names = next(reader)
+        next(reader)
+        indices = []
+        for column in columns:
+            if column not in names:
+                raise ValueError(f"{path} has no {column} column.")
+            indices.append(names.index(column))
+        for row in reader:
+            yield int(row[0]), [row[i] for i in indices]
+
+
+def to_int(value: str) -> int:
+    # Empty cells and links to nothing both count as 0
+    try:
+        return int(value)
+    except ValueError:
+        return 0
+
+
+@metrics.timed("catalog_import")
+def import_csv(directory, categories=None, path="market_analyzer.db") -> None:
+    """
+    Builds the item database from game data sheets in the given directory, without any network requests.
+    Needs `Item.csv`, `GatheringItem.csv`, `GatheringItemLevelConvertTable.csv`,
+    and a sheet for each field that categories are filtered on (`ItemSearchCategory.csv` and `ItemUICategory.csv`).
+    Writes the same tables as `update_db`, for the given categories or every category.
+    Items with a market board search category are the ones that are marketable.
+    """
+    if categories is None:
+        categories = list(CATEGORIES.keys())
+    filter_fields = sorted(
+        {
+            CATEGORIES[category]["filter"][0]
+            for category in categories
+            if CATEGORIES[category]["filter"] is not None
+        }
+        | {"ItemSearchCategory"}
+    )
+
+    print(f"Reading item data from {directory}...")
+    names = {}
+    item_fields = {}
+    for item_id, (name, *values) in read_sheet(
+        directory, "Item", ["Name", *filter_fields]
+    ):
+        if len(name) > 0:
+            names[item_id] = name
+            item_fields[item_id] = dict(zip(filter_fields, map(to_int, values)))
+    print(f"- Found {len(names)} items.")
+
+    con = open_db(path)
+    create_catalog_tables(con)
+    con.execute(
+        "create temp table if not exists marketable (item_id integer primary key)"
+    )
+    marketable_ids = [
+        item_id
+        for item_id, fields in item_fields.items()
+        if fields["ItemSearchCategory"] > 0
+    ]
+    with con:
+        con.execute("delete from marketable")
+        con.executemany(
+            "insert into marketable values (?)",
+            [(item_id,) for item_id in marketable_ids],
         )
-        orchestrion_roll_items = query_regular_items(list(orchestrion_roll_ids))
-        for orchestrion_roll in orchestrion_roll_items:
-            if not "name" in orchestrion_roll or not "item_id" in orchestrion_roll:
-                continue
-            if not orchestrion_roll["item_id"] in univ_data:
-                continue
-            try:
-                cur.execute(
-                    "insert into orchestrion_roll_items values (?, ?)",
-                    (orchestrion_roll["name"], orchestrion_roll["item_id"]),
+    marketable_hash = get_marketable_hash(marketable_ids)
+
+    for category in categories:
+        category_data = CATEGORIES[category]
+        if category_data["sheet"] == "GatheringItem":
+            print(f"Importing {category_data['name']} items from GatheringItem...")
+            levels = {
+                row_id: to_int(level)
+                for row_id, (level,) in read_sheet(
+                    directory, "GatheringItemLevelConvertTable", ["GatheringItemLevel"]
                 )
-            except sqlite3.IntegrityError:
-                print(
-                    f"- Skipping Item {orchestrion_roll['item_id']}: {orchestrion_roll['name']} as ID is taken."
+            }
+            details = [
+                {
+                    "source_id": source_id,
+                    "item_id": to_int(item_id),
+                    "name": names[to_int(item_id)],
+                    "gathering_level": levels.get(to_int(level_id)),
+                }
+                for source_id, (item_id, level_id) in read_sheet(
+                    directory, "GatheringItem", ["Item", "GatheringItemLevel"]
                 )
-            else:
+                if to_int(item_id) in names
+            ]
+        else:
+            field, value = category_data["filter"]
+            # The filter's own sheet names it, e.g. ItemSearchCategory 82 is "Paintings"
+            filter_names = dict(read_sheet(directory, field, ["Name"]))
+            print(
+                f"Importing {category_data['name']} items from {field} {value} ({filter_names.get(value, ('unknown',))[0]})..."
+            )
+            if value not in filter_names:
                 print(
-                    f"- Successfully added Item {orchestrion_roll['item_id']}: {orchestrion_roll['name']}."
+                    f"- Warning: {field}.csv has no row {value}, so the export may be incomplete."
                 )
-
-        con.commit()
-
+            details = [
+                {"source_id": item_id, "item_id": item_id, "name": names[item_id]}
+                for item_id, fields in item_fields.items()
+                if fields[field] == value
+            ]
+
+        # The sheets are complete, so anything that isn't in them has been removed from the game.
+        removed_ids = get_known_ids(con, category) - {
+            item["source_id"] for item in details
+        }
+        write_sources(con, category, details, removed_ids, marketable_hash)
+
+    con.close()
     print("Finished setting up database.")
@@ -0,0 +1,75 @@
+# JSON encoding and decoding with the fastest library that's installed.
+# msgspec and orjson are both optional, and the standard library is used when neither is.
+import json
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Picked once, and used by both `loads` and `dumps`
+if msgspec is not None:
+    BACKEND = "msgspec"
+elif orjson is not None:
+    BACKEND = "orjson"
+else:
+    BACKEND = "json"
+
+
+if BACKEND == "msgspec":
+
+    def loads(data):
+        """
+        Decodes JSON from `bytes` or `str` into plain Python objects.
+        """
+        return msgspec.json.decode(data)
+
+    def dumps(value) -> str:
+        return msgspec.json.encode(value).decode()
+
+elif BACKEND == "orjson":
+
+    def loads(data):
+        """
+        Decodes JSON from `bytes` or `str` into plain Python objects.
+        """
+        return orjson.loads(data)
+
+    def dumps(value) -> str:
+        return orjson.dumps(value).decode()
+
+else:
+
+    def loads(data):
+        """
+        Decodes JSON from `bytes` or `str` into plain Python objects.
+        """
+        return json.loads(data)
+
+    def dumps(value) -> str:
+        return json.dumps(value)
+
+
+def typed_decoder(value_type):
+    """
+    Returns a function that decodes JSON straight into `value_type`, e.g. a dataclass,
+    skipping any fields the type doesn't have without building them first.
+    Only available with msgspec, so `None` is returned without it.
+    Mismatched types are raised as `ValueError`, same as malformed JSON.
+    """
+    if msgspec is None:
+        return None
+    decoder = msgspec.json.Decoder(value_type)
+
+    def decode(data):
+        try:
+            return decoder.decode(data)
+        except msgspec.DecodeError as error:
+            raise ValueError(str(error)) from error
+
+    return decode
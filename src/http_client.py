@@ -0,0 +1,189 @@
+import gzip
+import http.client
+import io
+import queue
+import threading
+import time
+import zlib
+from urllib.error import HTTPError
+from urllib.parse import urljoin, urlsplit
+
+from .fast_json import loads
+from .metrics import metrics
+from .util import get_user_agent
+
+MAX_REDIRECTS = 5
+# Errors that mean a kept-alive connection was closed by the server while idle.
+STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.BadStatusLine,
+    BrokenPipeError,
+    ConnectionResetError,
+    ConnectionAbortedError,
+)
+
+
+class HTTPClient(object):
+    """
+    Minimal HTTP client that keeps a pool of persistent connections for each host,
+    so consecutive requests don't pay for a new TCP/TLS handshake every time.
+    Responses are requested with gzip compression and transparently decoded.
+    Safe to share between threads.
+    """
+
+    def __init__(self, max_connections=8, timeout=30) -> None:
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.pools = {}
+        self.lock = threading.Lock()
+
+    def get_pool(self, key) -> queue.LifoQueue:
+        with self.lock:
+            pool = self.pools.get(key)
+            if pool is None:
+                pool = queue.LifoQueue(maxsize=self.max_connections)
+                self.pools[key] = pool
+            return pool
+
+    def new_connection(self, key) -> http.client.HTTPConnection:
+        scheme, host, port = key
+        if scheme == "https":
+            return http.client.HTTPSConnection(host, port, timeout=self.timeout)
+        return http.client.HTTPConnection(host, port, timeout=self.timeout)
+
+    def release(self, key, connection) -> None:
+        try:
+            self.get_pool(key).put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def close(self) -> None:
+        """
+        Closes every idle connection in every pool.
+        """
+        with self.lock:
+            pools = list(self.pools.values())
+            self.pools = {}
+        for pool in pools:
+            while not pool.empty():
+                pool.get_nowait().close()
+
+    def request(self, url: str, headers=None):
+        """
+        Performs a GET request and returns `(status, headers, body)` with the body already decompressed.
+        Redirects are followed, and an `HTTPError` is raised for any 4xx or 5xx response.
+        """
+        for _ in range(MAX_REDIRECTS + 1):
+            start = time.perf_counter()
+            try:
+                status, response_headers, body = self.send(url, headers)
+            except Exception:
+                metrics.observe_request(url, time.perf_counter() - start, 0, None)
+                raise
+            metrics.observe_request(url, time.perf_counter() - start, len(body), status)
+            if status in (301, 302, 303, 307, 308) and "Location" in response_headers:
+                url = urljoin(url, response_headers["Location"])
+                continue
+            if status >= 400:
+                raise HTTPError(
+                    url,
+                    status,
+                    http.client.responses.get(status, ""),
+                    response_headers,
+                    io.BytesIO(body),
+                )
+            return status, response_headers, body
+        raise HTTPError(url, status, "Too many redirects", response_headers, None)
+
+    def send(self, url: str, headers=None):
+        parts = urlsplit(url)
+        key = (
+            parts.scheme,
+            parts.hostname,
+            parts.port or (443 if parts.scheme == "https" else 80),
+        )
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        request_headers = {
+            "User-Agent": get_user_agent(),
+            "Accept-Encoding": "gzip, deflate",
+            "Connection": "keep-alive",
+        }
+        if headers is not None:
+            request_headers.update(headers)
+
+        pool = self.get_pool(key)
+        try:
+            connection = pool.get_nowait()
+            reused = True
+        except queue.Empty:
+            connection = self.new_connection(key)
+            reused = False
+
+        try:
+            connection.request("GET", path, headers=request_headers)
+            response = connection.getresponse()
+            body = response.read()
+        except STALE_CONNECTION_ERRORS:
+            connection.close()
+            if not reused:
+                raise
+            # The server dropped an idle connection, so try once more on a fresh one.
+            connection = self.new_connection(key)
+            try:
+                connection.request("GET", path, headers=request_headers)
+                response = connection.getresponse()
+                body = response.read()
+            except Exception:
+                connection.close()
+                raise
+        except Exception:
+            connection.close()
+            raise
+
+        if response.will_close:
+            connection.close()
+        else:
+            self.release(key, connection)
+
+        return response.status, response.headers, decode_body(response.headers, body)
+
+    def get(self, url: str, headers=None) -> bytes:
+        return self.request(url, headers)[2]
+
+    def get_json(self, url: str, headers=None):
+        body = self.get(url, headers)
+        with metrics.timer("json_decode"):
+            return loads(body)
+
+
+def decode_body(headers, body: bytes) -> bytes:
+    encoding = (headers.get("Content-Encoding") or "").lower()
+    if encoding == "gzip":
+        return gzip.decompress(body)
+    if encoding == "deflate":
+        try:
+            return zlib.decompress(body)
+        except zlib.error:
+            # Some servers send raw deflate streams without the zlib header
+            return zlib.decompress(body, -zlib.MAX_WBITS)
+    return body
+
+
+# Shared by every XIVAPI and Universalis request in the script.
+client = HTTPClient()
+
+
+def get(url: str, headers=None) -> bytes:
+    """
+    Requests the given URL using the shared client, and returns the decompressed body.
+    """
+    return client.get(url, headers)
+
+
+def get_json(url: str, headers=None):
+    """
+    Requests and decodes JSON from the given URL using the shared client.
+    """
+    return client.get_json(url, headers)
@@ -0,0 +1,479 @@
+import heapq
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+from . import bson_codec
+from .market_data import Listing, MarketEntry, Sales
+from .metrics import metrics
+from .universalis import (
+    MAX_BATCH_SIZE,
+    MAX_WORKERS,
+    UNIVERSALIS_URL,
+    current_listings_url,
+    fetch_batch,
+    get_world_ids,
+    history_url,
+    parse_listing,
+)
+from .util import make_batches
+from .websocket import OPCODE_BINARY, WebSocket, WebSocketError
+
+UNIVERSALIS_WS_URL = "wss://universalis.app/api/ws"
+# Events that change the aggregates used for scoring. Each one is subscribed to per world.
+CHANNELS = ["listings/add", "listings/remove", "sales/add"]
+DAY = 24 * 60 * 60
+# Recent sales count towards the velocity and average sale price for about this long,
+# close to the week of history that Universalis averages over.
+SALE_WINDOW = 7 * DAY
+MAX_RECONNECT_DELAY = 60
+# How long loading waits for the subscriptions, before going ahead and loading again once they're sent
+SUBSCRIBE_TIMEOUT = 10
+
+
+@dataclass(slots=True)
+class QualityState:
+    """
+    The running aggregates of one quality of one item, each updated in constant time per event.
+    Sales are weighted by how recent they are, decaying over `SALE_WINDOW`,
+    so old sales fade out without having to be stored and expired one by one.
+    """
+
+    count: int = 0
+    total: float = 0.0
+    # (price, listing ID) of every listing, including some that were removed since.
+    # Removed listings are only dropped once they reach the top.
+    prices: List[Tuple[float, str]] = field(default_factory=list)
+    # Decayed number of sales per day, and weighted sum of sale prices, as of `sale_time`
+    sale_rate: float = 0.0
+    sale_weight: float = 0.0
+    sale_total: float = 0.0
+    sale_time: float = 0.0
+
+    def decay(self, now, window=SALE_WINDOW) -> float:
+        if now <= self.sale_time:
+            return 1.0
+        return math.exp((self.sale_time - now) / window)
+
+    def velocity(self, now, window=SALE_WINDOW) -> float:
+        return self.sale_rate * self.decay(now, window)
+
+    def average_sale_price(self) -> float:
+        if self.sale_weight <= 0:
+            return 0.0
+        return self.sale_total / self.sale_weight
+
+
+@dataclass(slots=True)
+class LiveItem:
+    """
+    The current listings and aggregates of one item on one world.
+    """
+
+    # Listing ID to (price, hq) of every current listing
+    listings: Dict[str, Tuple[float, bool]] = field(default_factory=dict)
+    nq: QualityState = field(default_factory=QualityState)
+    hq: QualityState = field(default_factory=QualityState)
+
+    def get_state(self, hq) -> QualityState:
+        return self.hq if hq else self.nq
+
+    def add_listing(self, listing_id, price, hq) -> None:
+        # A listing that's added again, e.g. with a new price, replaces the old one
+        self.remove_listing(listing_id)
+        self.listings[listing_id] = (price, hq)
+        state = self.get_state(hq)
+        state.count += 1
+        state.total += price
+        heapq.heappush(state.prices, (price, listing_id))
+
+    def remove_listing(self, listing_id) -> bool:
+        """
+        Removes a listing, returning `False` if it wasn't listed,
+        e.g. because it was bought before the item was first loaded.
+        """
+        listing = self.listings.pop(listing_id, None)
+        if listing is None:
+            return False
+        price, hq = listing
+        state = self.get_state(hq)
+        state.count -= 1
+        state.total -= price
+        if state.count == 0:
+            state.total = 0.0
+            state.prices.clear()
+        elif len(state.prices) > 2 * state.count + 16:
+            # Removed listings are skipped lazily, so drop them every so often to keep the heap small
+            state.prices = [
+                (price, other_id)
+                for other_id, (price, other_hq) in self.listings.items()
+                if other_hq == hq
+            ]
+            heapq.heapify(state.prices)
+        return True
+
+    def min_price(self, hq) -> float:
+        state = self.get_state(hq)
+        while len(state.prices) > 0:
+            price, listing_id = state.prices[0]
+            if self.listings.get(listing_id) == (price, hq):
+                return price
+            heapq.heappop(state.prices)
+        return 0.0
+
+    def add_sale(self, price, hq, timestamp, window=SALE_WINDOW) -> None:
+        state = self.get_state(hq)
+        decay = state.decay(timestamp, window)
+        # Each sale adds one sale per `window` to the rate, in sales per day
+        state.sale_rate = state.sale_rate * decay + DAY / window
+        state.sale_weight = state.sale_weight * decay + 1
+        state.sale_total = state.sale_total * decay + price
+        state.sale_time = max(state.sale_time, timestamp)
+
+    def seed_sales(self, hq, velocity, average_price, now, window=SALE_WINDOW) -> None:
+        """
+        Starts the sale aggregates from Universalis' own velocity and average sale price,
+        as if the sales in its history had been seen as events.
+        """
+        state = self.get_state(hq)
+        state.sale_rate = velocity
+        state.sale_weight = velocity * window / DAY
+        state.sale_total = average_price * state.sale_weight
+        state.sale_time = now
+
+
+class LiveMarket(object):
+    """
+    The current listings and recent sales of every tracked item on every tracked world,
+    kept up to date by applying Universalis events as they arrive.
+    Remembers which items changed, so only those have to be rescored.
+    Safe to share between threads.
+    """
+
+    def __init__(self, item_names, window=SALE_WINDOW) -> None:
+        self.item_names = item_names
+        self.window = window
+        # (world name, item ID) to `LiveItem`
+        self.items = {}
+        # World ID to world name, for the worlds that are tracked
+        self.world_names = {}
+        self.changed = set()
+        # (world name, item ID) to the events held back while the item is being loaded
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def add_world(self, world_name: str, world_id) -> None:
+        with self.lock:
+            self.world_names[world_id] = world_name
+
+    def begin_seed(self, world_name: str, item_ids) -> None:
+        """
+        Holds back events for items on a world until they're seeded, so ones that arrive
+        while the items are being loaded are applied on top of what was loaded, rather than lost.
+        Called before their listings are requested.
+        """
+        with self.lock:
+            for item_id in item_ids:
+                self.pending.setdefault((world_name, item_id), [])
+
+    def seed(
+        self, world_name: str, item_ids, current_listings, sales, now=None
+    ) -> None:
+        """
+        Replaces the state of items on a world with their `CurrentListings`, requested at `now`,
+        and their `Sales` from `sales`, a dict keyed by item ID, if they have any.
+        Then applies the events held back for `item_ids` since `begin_seed`.
+        Listing events can be applied again safely, but sales are only counted if they're newer than the request.
+        Items that weren't loaded keep their state, and get every event that was held back.
+        """
+        if now is None:
+            now = time.time()
+        with self.lock:
+            seeded = set()
+            for record in current_listings:
+                item = LiveItem()
+                for listing in record.listings:
+                    item.add_listing(
+                        listing.listingID, listing.pricePerUnit, listing.hq
+                    )
+                item_sales = sales.get(record.itemID)
+                if item_sales is not None:
+                    item.seed_sales(
+                        False,
+                        item_sales.nqSaleVelocity,
+                        record.averagePriceNQ,
+                        now,
+                        self.window,
+                    )
+                    item.seed_sales(
+                        True,
+                        item_sales.hqSaleVelocity,
+                        record.averagePriceHQ,
+                        now,
+                        self.window,
+                    )
+                key = (world_name, record.itemID)
+                self.items[key] = item
+                self.changed.add(key)
+                seeded.add(record.itemID)
+            for item_id in item_ids:
+                key = (world_name, item_id)
+                events = self.pending.pop(key, [])
+                item = self.items.get(key)
+                if item is None:
+                    continue
+                # Sale timestamps are in whole seconds
+                since = int(now) if item_id in seeded else None
+                for event in events:
+                    self.update(item, event, since)
+                    self.changed.add(key)
+
+    def apply(self, event) -> bool:
+        """
+        Applies one decoded Universalis event, and returns whether it changed a tracked item.
+        Events for items that are being loaded are held back until they're seeded.
+        Events for other items or worlds, or of other kinds, are ignored.
+        """
+        if event.get("event") not in CHANNELS:
+            return False
+        with self.lock:
+            world_name = self.world_names.get(event.get("world"))
+            key = (world_name, event.get("item"))
+            pending = self.pending.get(key)
+            if pending is not None:
+                pending.append(event)
+            else:
+                item = self.items.get(key)
+                if item is None:
+                    return False
+                self.update(item, event)
+                self.changed.add(key)
+        metrics.add("live_events")
+        return True
+
+    def update(self, item: LiveItem, event, since=None) -> None:
+        """
+        Applies an event to an item, skipping sales from before `since` if it's given.
+        """
+        kind = event.get("event")
+        if kind == "listings/add":
+            for listing in event.get("listings", []):
+                item.add_listing(
+                    listing["listingID"], listing["pricePerUnit"], listing["hq"]
+                )
+        elif kind == "listings/remove":
+            for listing in event.get("listings", []):
+                item.remove_listing(listing["listingID"])
+        elif kind == "sales/add":
+            for sale in event.get("sales", []):
+                timestamp = sale.get("timestamp", time.time())
+                if since is None or timestamp >= since:
+                    item.add_sale(
+                        sale["pricePerUnit"], sale["hq"], timestamp, self.window
+                    )
+
+    def take_changed(self):
+        """
+        Returns a dict of world name to the IDs of its items that changed since the last call.
+        """
+        with self.lock:
+            changed = self.changed
+            self.changed = set()
+        world_items = {}
+        for world_name, item_id in changed:
+            world_items.setdefault(world_name, []).append(item_id)
+        return world_items
+
+    def entry(self, world_name: str, item_id, now=None) -> MarketEntry:
+        """
+        Builds the `MarketEntry` of an item from its current aggregates, same as one fetched from Universalis.
+        """
+        if now is None:
+            now = time.time()
+        with self.lock:
+            item = self.items[(world_name, item_id)]
+            listing = Listing(
+                item_id,
+                currentAveragePriceNQ=get_average(item.nq),
+                averagePriceNQ=item.nq.average_sale_price(),
+                minPriceNQ=item.min_price(False),
+                currentAveragePriceHQ=get_average(item.hq),
+                averagePriceHQ=item.hq.average_sale_price(),
+                minPriceHQ=item.min_price(True),
+                listingsCount=len(item.listings),
+            )
+            sales = Sales(
+                item_id,
+                nqSaleVelocity=item.nq.velocity(now, self.window),
+                hqSaleVelocity=item.hq.velocity(now, self.window),
+            )
+        return parse_listing(listing, item_id, self.item_names[item_id], sales)
+
+
+def get_average(state: QualityState) -> float:
+    return state.total / state.count if state.count > 0 else 0.0
+
+
+class LiveFeed(object):
+    """
+    Loads the current listings of every item on the given worlds from Universalis once,
+    then keeps them up to date from the Universalis WebSocket API instead of polling.
+    Loading waits until the subscriptions are sent, and events that arrive while an item is loading
+    are applied on top of what was loaded.
+    Reconnects with a growing delay if the connection drops, and sets `resync`,
+    since events that were missed in between can only be caught up on by loading everything again.
+    """
+
+    def __init__(
+        self,
+        item_names,
+        world_names,
+        url=UNIVERSALIS_WS_URL,
+        base_url=UNIVERSALIS_URL,
+        max_workers=MAX_WORKERS,
+    ) -> None:
+        self.market = LiveMarket(item_names)
+        self.world_names = world_names
+        self.url = url
+        self.base_url = base_url
+        self.max_workers = max_workers
+        self.world_ids = {}
+        self.socket = None
+        self.stopping = threading.Event()
+        # Set while the subscriptions are sent and the connection is open
+        self.subscribed = threading.Event()
+        # Set until everything has been loaded
+        self.resync = threading.Event()
+        self.resync.set()
+        self.thread = None
+
+    def load_world_ids(self) -> None:
+        if len(self.world_ids) == len(self.world_names):
+            return
+        all_world_ids = get_world_ids(self.base_url)
+        for world_name in self.world_names:
+            world_id = all_world_ids.get(world_name.lower())
+            if world_id is None:
+                raise ValueError(f"Universalis doesn't know the world {world_name}.")
+            self.world_ids[world_name] = world_id
+            self.market.add_world(world_name, world_id)
+
+    def seed(self) -> None:
+        """
+        Loads every item on every world from Universalis, replacing what was there,
+        once the subscriptions are sent.
+        """
+        self.load_world_ids()
+        if not self.subscribed.wait(SUBSCRIBE_TIMEOUT):
+            # Subscribing sets `resync`, so this is loaded again once it's connected
+            print("Warning: Not subscribed to live updates yet. Loading anyway...")
+        self.resync.clear()
+        for world_name in self.world_names:
+            self.seed_world(world_name)
+
+    @metrics.timed("seed")
+    def seed_world(self, world_name: str) -> None:
+        def fetch(batch):
+            self.market.begin_seed(world_name, batch)
+            requested_at = time.time()
+            listings_response = fetch_batch(
+                lambda ids: current_listings_url(world_name, ids, self.base_url),
+                batch,
+                "live",
+            )
+            sale_response = fetch_batch(
+                lambda ids: history_url(world_name, ids, self.base_url),
+                batch,
+                "history",
+            )
+            return batch, requested_at, listings_response, sale_response
+
+        item_ids = list(self.market.item_names)
+        batches = make_batches(item_ids, MAX_BATCH_SIZE)
+        print(
+            f"{world_name}: Loading the listings of {len(self.market.item_names)} items..."
+        )
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                for batch, requested_at, listings_response, sale_response in pool.map(
+                    fetch, batches
+                ):
+                    if listings_response is None:
+                        print(
+                            f"- {world_name}: Listings request failed. Skipping batch..."
+                        )
+                        self.market.seed(world_name, batch, [], {})
+                        continue
+                    sales = {}
+                    if sale_response is not None:
+                        sales = {item.itemID: item for item in sale_response.items}
+                    self.market.seed(
+                        world_name,
+                        batch,
+                        listings_response.items,
+                        sales,
+                        requested_at,
+                    )
+        finally:
+            # Releases the events held back for batches that never finished loading
+            self.market.seed(world_name, item_ids, [], {})
+
+    def start(self) -> None:
+        self.load_world_ids()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopping.set()
+        if self.socket is not None:
+            self.socket.close()
+        if self.thread is not None:
+            self.thread.join()
+
+    def run(self) -> None:
+        delay = 1
+        while not self.stopping.is_set():
+            try:
+                self.socket = WebSocket.connect(self.url)
+                for world_name in self.world_names:
+                    for channel in CHANNELS:
+                        self.socket.send(
+                            bson_codec.encode(
+                                {
+                                    "event": "subscribe",
+                                    "channel": f"{channel}{{world={self.world_ids[world_name]}}}",
+                                }
+                            )
+                        )
+                # Events could have been missed while it wasn't subscribed, so everything is loaded again.
+                # The first time, `resync` is already set.
+                self.resync.set()
+                self.subscribed.set()
+                delay = 1
+                self.receive_events()
+            except (OSError, WebSocketError) as error:
+                if not self.stopping.is_set():
+                    print(f"Error: Live updates were interrupted: {error!r}")
+            finally:
+                self.subscribed.clear()
+                if self.socket is not None:
+                    self.socket.close()
+            if not self.stopping.is_set():
+                self.stopping.wait(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+    def receive_events(self) -> None:
+        while (message := self.socket.receive()) is not None:
+            opcode, payload = message
+            if opcode != OPCODE_BINARY:
+                continue
+            metrics.add("live_bytes", len(payload))
+            try:
+                event = bson_codec.decode(payload)
+            except ValueError:
+                metrics.add("live_decode_errors")
+                continue
+            self.market.apply(event)
@@ -0,0 +1,133 @@
+import sqlite3
+import threading
+import time
+
+from .fast_json import dumps
+from .market_data import CACHED_FIELDS, decode_record
+from .metrics import metrics
+
+DEFAULT_TTL = 300  # Seconds before a cached snapshot is considered stale
+DEFAULT_MAX_AGE = 60 * 60 * 24  # Seconds before a cached snapshot is evicted entirely
+DEFAULT_MAX_ENTRIES = 200000
+
+
+class MarketCache(object):
+    """
+    Stores Universalis responses per (world, item, endpoint) in the item database,
+    so repeated scans only have to hit the network for stale or missing items.
+    Safe to share between threads.
+    """
+
+    def __init__(
+        self,
+        path="market_analyzer.db",
+        ttl=DEFAULT_TTL,
+        max_age=DEFAULT_MAX_AGE,
+        max_entries=DEFAULT_MAX_ENTRIES,
+    ) -> None:
+        self.ttl = ttl
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.con = sqlite3.connect(path, check_same_thread=False)
+        self.con.execute(
+            "create table if not exists market_cache (world text, item_id integer, endpoint text, fetched_at real, data text, primary key (world, item_id, endpoint))"
+        )
+        self.con.execute(
+            "create index if not exists market_cache_fetched_at on market_cache (fetched_at)"
+        )
+        self.evict()
+
+    @metrics.timed("cache_read")
+    def get_fresh(self, world_name: str, item_ids, endpoint: str):
+        """
+        Returns a dict of item ID to cached record for every given item with a snapshot younger than the TTL.
+        """
+        if self.ttl <= 0:
+            return {}
+        cutoff = time.time() - self.ttl
+        world = world_name.lower()
+        fresh = {}
+        item_ids = list(item_ids)
+        # Stay well under SQLite's limit on bound parameters
+        for i in range(0, len(item_ids), 500):
+            chunk = item_ids[i : i + 500]
+            with self.lock:
+                rows = self.con.execute(
+                    f"select item_id, data from market_cache where world = ? and endpoint = ? and fetched_at >= ? and item_id in ({','.join('?' * len(chunk))})",
+                    (world, endpoint, cutoff, *chunk),
+                ).fetchall()
+            for item_id, data in rows:
+                try:
+                    fresh[item_id] = decode_record(endpoint, data)
+                except ValueError:
+                    # Snapshots from older versions can have missing values, so they're fetched again.
+                    continue
+        return fresh
+
+    @metrics.timed("cache_read")
+    def get_fresh_ids(self, world_name: str, item_ids, endpoint: str):
+        """
+        Returns the set of given item IDs with a snapshot younger than the TTL, without decoding any data.
+        """
+        if self.ttl <= 0:
+            return set()
+        cutoff = time.time() - self.ttl
+        world = world_name.lower()
+        fresh_ids = set()
+        item_ids = list(item_ids)
+        for i in range(0, len(item_ids), 500):
+            chunk = item_ids[i : i + 500]
+            with self.lock:
+                rows = self.con.execute(
+                    f"select item_id from market_cache where world = ? and endpoint = ? and fetched_at >= ? and item_id in ({','.join('?' * len(chunk))})",
+                    (world, endpoint, cutoff, *chunk),
+                ).fetchall()
+            fresh_ids.update(row[0] for row in rows)
+        return fresh_ids
+
+    @metrics.timed("cache_write")
+    def put(self, world_name: str, endpoint: str, items) -> None:
+        """
+        Stores the given list of the endpoint's records, replacing any older snapshots.
+        """
+        now = time.time()
+        world = world_name.lower()
+        fields = CACHED_FIELDS[endpoint]
+        with self.lock, self.con:
+            self.con.executemany(
+                "insert or replace into market_cache values (?, ?, ?, ?, ?)",
+                [
+                    (
+                        world,
+                        item.itemID,
+                        endpoint,
+                        now,
+                        dumps({field: getattr(item, field) for field in fields}),
+                    )
+                    for item in items
+                ],
+            )
+
+    @metrics.timed("cache_write")
+    def evict(self) -> None:
+        """
+        Removes snapshots older than the maximum age, then the oldest snapshots
+        until the cache holds at most `max_entries` rows.
+        """
+        with self.lock, self.con:
+            self.con.execute(
+                "delete from market_cache where fetched_at < ?",
+                (time.time() - self.max_age,),
+            )
+            self.con.execute(
+                "delete from market_cache where rowid in (select rowid from market_cache order by fetched_at desc limit -1 offset ?)",
+                (self.max_entries,),
+            )
+
+    def clear(self) -> None:
+        with self.lock, self.con:
+            self.con.execute("delete from market_cache")
+
+    def close(self) -> None:
+        self.con.close()
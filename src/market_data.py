@@ -0,0 +1,191 @@
+from dataclasses import dataclass, field, fields
+from typing import Dict, Generic, List, Optional, TypeVar, Union
+
+from .fast_json import loads, typed_decoder
+from .metrics import metrics
+
+
+# Field names match Universalis, so responses can be decoded into these directly.
+@dataclass(slots=True)
+class Listing:
+    """
+    The aggregate listing data of one item on one world.
+    """
+
+    itemID: int
+    currentAveragePriceNQ: float = 0.0
+    averagePriceNQ: float = 0.0
+    minPriceNQ: float = 0.0
+    currentAveragePriceHQ: float = 0.0
+    averagePriceHQ: float = 0.0
+    minPriceHQ: float = 0.0
+    listingsCount: int = 0
+
+
+@dataclass(slots=True)
+class Sales:
+    """
+    The sale velocities of one item on one world.
+    """
+
+    itemID: int
+    nqSaleVelocity: float = 0.0
+    hqSaleVelocity: float = 0.0
+
+
+@dataclass(slots=True)
+class MarketListing:
+    """
+    One listing on the market board.
+    """
+
+    listingID: str
+    pricePerUnit: int = 0
+    quantity: int = 0
+    hq: bool = False
+
+
+@dataclass(slots=True)
+class CurrentListings:
+    """
+    Every current listing of one item on one world, along with its average sale prices,
+    for keeping the item's aggregates up to date from live events.
+    """
+
+    itemID: int
+    averagePriceNQ: float = 0.0
+    averagePriceHQ: float = 0.0
+    listings: List[MarketListing] = field(default_factory=list)
+
+
+# The record type for each Universalis endpoint. "live" is the listings endpoint with every individual listing.
+RECORD_TYPES = {"listings": Listing, "history": Sales, "live": CurrentListings}
+# Fields holding lists of records, and the record type of their elements.
+NESTED_TYPES = {"listings": MarketListing}
+RECORD_FIELDS = {
+    record_type: [record_field.name for record_field in fields(record_type)]
+    for record_type in (*RECORD_TYPES.values(), *NESTED_TYPES.values())
+}
+# Looked up per record type, so records without nested fields don't pay for them.
+RECORD_NESTED_FIELDS = {
+    record_type: [name for name in names if name in NESTED_TYPES]
+    for record_type, names in RECORD_FIELDS.items()
+}
+# Only these fields are requested, cached and decoded for each endpoint.
+CACHED_FIELDS = {
+    endpoint: RECORD_FIELDS[record_type]
+    for endpoint, record_type in RECORD_TYPES.items()
+}
+
+T = TypeVar("T")
+
+
+@dataclass(slots=True)
+class Response(Generic[T]):
+    """
+    A multi-item Universalis response. Older API versions return `items` as a list, and newer ones as a dict keyed by item ID.
+    """
+
+    items: Union[Dict[int, T], List[T]] = field(default_factory=list)
+    unresolvedItems: List[int] = field(default_factory=list)
+
+
+# Built once per type, since building a decoder is much slower than using one.
+DECODERS = {
+    (endpoint, single): typed_decoder(record_type if single else Response[record_type])
+    for endpoint, record_type in RECORD_TYPES.items()
+    for single in (True, False)
+}
+
+
+def from_dict(endpoint: str, data):
+    """
+    Builds the record for an endpoint from a dict of Universalis fields, ignoring any others.
+    """
+    return build_record(RECORD_TYPES[endpoint], data)
+
+
+def build_record(record_type, data):
+    values = {name: data[name] for name in RECORD_FIELDS[record_type] if name in data}
+    for name in RECORD_NESTED_FIELDS[record_type]:
+        if name in values:
+            values[name] = [
+                build_record(NESTED_TYPES[name], item) for item in values[name]
+            ]
+    return record_type(**values)
+
+
+def decode_record(endpoint: str, body):
+    """
+    Decodes the JSON of a single item's data into its record.
+    """
+    decode = DECODERS[(endpoint, True)]
+    if decode is not None:
+        return decode(body)
+    return from_dict(endpoint, loads(body))
+
+
+def decode_response(endpoint: str, body, single: bool) -> Response:
+    """
+    Decodes a Universalis response into a `Response` with a list of records,
+    going straight from JSON to records with msgspec, or through plain dicts without it.
+    A single-item response is the item itself, so it's wrapped in a response.
+    """
+    with metrics.timer("json_decode"):
+        if single:
+            return Response([decode_record(endpoint, body)], [])
+        decode = DECODERS[(endpoint, False)]
+        if decode is not None:
+            response = decode(body)
+            if isinstance(response.items, dict):
+                response.items = list(response.items.values())
+            return response
+        data = loads(body)
+        items = data.get("items", [])
+        if isinstance(items, dict):
+            items = items.values()
+        return Response(
+            [from_dict(endpoint, item) for item in items],
+            data.get("unresolvedItems", []),
+        )
+
+
+@dataclass(slots=True)
+class MarketEntry:
+    """
+    One item's market data on one world, as fetched, scored and printed.
+    Scores are set by the scoring stage, and trends only once an item has price history.
+    """
+
+    item_id: int
+    item_name: str
+    currentAveragePriceNQ: float = 0.0
+    averagePriceNQ: float = 0.0
+    nqSaleVelocity: float = 0.0
+    currentPriceDifferenceNQ: float = 0.0
+    currentAveragePriceHQ: float = 0.0
+    averagePriceHQ: float = 0.0
+    hqSaleVelocity: float = 0.0
+    currentPriceDifferenceHQ: float = 0.0
+    # Only set for results from several worlds
+    world: Optional[str] = None
+    score_nq: Optional[float] = None
+    score_hq: Optional[float] = None
+    snapshots: Optional[int] = None
+    movingAveragePriceNQ: Optional[float] = None
+    volatilityNQ: Optional[float] = None
+    movingAveragePriceHQ: Optional[float] = None
+    volatilityHQ: Optional[float] = None
+
+    def to_dict(self):
+        """
+        Returns the entry as a dict for JSON output, without the fields that were never set.
+        """
+        return {
+            name: getattr(self, name)
+            for name in ENTRY_FIELDS
+            if getattr(self, name) is not None
+        }
+
+
+ENTRY_FIELDS = [entry_field.name for entry_field in fields(MarketEntry)]
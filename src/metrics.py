@@ -0,0 +1,223 @@
+import contextlib
+import functools
+import json
+import threading
+import time
+from urllib.parse import urlsplit
+
+from tabulate import tabulate
+
+# Upper bounds in seconds of each request latency bucket, as in a Prometheus histogram.
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float("inf")]
+
+
+class Metrics(object):
+    """
+    Collects timings and counters from every stage of a run, so slow runs can be explained.
+    Phase times are summed over every thread that ran the phase, so concurrent phases can add up to more than the run.
+    Safe to share between threads.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self.lock:
+            self.phases = {}
+            self.counters = {}
+            self.requests = {}
+
+    @contextlib.contextmanager
+    def timer(self, phase: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.perf_counter() - start)
+
+    def timed(self, phase: str):
+        """
+        Decorator that adds the time spent in every call of a function to the given phase.
+        """
+
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.timer(phase):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def add_time(self, phase: str, seconds: float) -> None:
+        with self.lock:
+            total, count = self.phases.get(phase, (0.0, 0))
+            self.phases[phase] = (total + seconds, count + 1)
+
+    def add(self, counter: str, value=1) -> None:
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def observe_request(self, url: str, seconds: float, num_bytes: int, status) -> None:
+        endpoint = get_endpoint(url)
+        with self.lock:
+            stats = self.requests.get(endpoint)
+            if stats is None:
+                stats = {
+                    "count": 0,
+                    "errors": 0,
+                    "bytes": 0,
+                    "seconds": 0.0,
+                    "buckets": [0] * len(LATENCY_BUCKETS),
+                }
+                self.requests[endpoint] = stats
+            stats["count"] += 1
+            if status is None or status >= 400:
+                stats["errors"] += 1
+            stats["bytes"] += num_bytes
+            stats["seconds"] += seconds
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    stats["buckets"][i] += 1
+                    break
+
+    def cache_hit_ratio(self):
+        hits = self.counters.get("cache_hits", 0)
+        total = hits + self.counters.get("cache_misses", 0)
+        return hits / total if total > 0 else None
+
+    def summary(self):
+        """
+        Returns every metric as a dict that can be serialized to JSON.
+        """
+        with self.lock:
+            return {
+                "phases": {
+                    phase: {"seconds": total, "count": count}
+                    for phase, (total, count) in self.phases.items()
+                },
+                "counters": dict(self.counters),
+                "cache_hit_ratio": self.cache_hit_ratio(),
+                "requests": {
+                    endpoint: {
+                        "count": stats["count"],
+                        "errors": stats["errors"],
+                        "bytes": stats["bytes"],
+                        "seconds": stats["seconds"],
+                        "latency_buckets": {
+                            str(bound): count
+                            for bound, count in zip(LATENCY_BUCKETS, stats["buckets"])
+                        },
+                    }
+                    for endpoint, stats in self.requests.items()
+                },
+            }
+
+    def format(self, output_format="table") -> str:
+        if output_format == "json":
+            return json.dumps(self.summary(), indent=4)
+        if output_format == "prometheus":
+            return self.format_prometheus()
+        return self.format_table()
+
+    def format_table(self) -> str:
+        summary = self.summary()
+        sections = [
+            tabulate(
+                [
+                    [phase, data["count"], data["seconds"]]
+                    for phase, data in summary["phases"].items()
+                ],
+                headers=["Phase", "Calls", "Seconds"],
+                floatfmt=".3f",
+            ),
+            tabulate(
+                [
+                    [
+                        endpoint,
+                        data["count"],
+                        data["errors"],
+                        data["bytes"],
+                        data["seconds"] / data["count"] * 1000,
+                    ]
+                    for endpoint, data in summary["requests"].items()
+                ],
+                headers=["Endpoint", "Requests", "Errors", "Bytes", "Avg. ms"],
+                floatfmt=".1f",
+            ),
+            tabulate(
+                [
+                    [counter, f"{value:.3f}" if isinstance(value, float) else value]
+                    for counter, value in [
+                        *summary["counters"].items(),
+                        ("cache_hit_ratio", summary["cache_hit_ratio"]),
+                    ]
+                ],
+                headers=["Counter", "Value"],
+                disable_numparse=True,
+            ),
+        ]
+        return "\n\n".join(sections)
+
+    def format_prometheus(self) -> str:
+        summary = self.summary()
+        lines = []
+        lines.append("# TYPE market_analyzer_phase_seconds counter")
+        for phase, data in summary["phases"].items():
+            lines.append(
+                f'market_analyzer_phase_seconds{{phase="{phase}"}} {data["seconds"]}'
+            )
+        for counter, value in summary["counters"].items():
+            lines.append(f"# TYPE market_analyzer_{counter} counter")
+            lines.append(f"market_analyzer_{counter} {value}")
+        if summary["cache_hit_ratio"] is not None:
+            lines.append("# TYPE market_analyzer_cache_hit_ratio gauge")
+            lines.append(
+                f"market_analyzer_cache_hit_ratio {summary['cache_hit_ratio']}"
+            )
+        lines.append("# TYPE market_analyzer_request_bytes counter")
+        for endpoint, data in summary["requests"].items():
+            lines.append(
+                f'market_analyzer_request_bytes{{endpoint="{endpoint}"}} {data["bytes"]}'
+            )
+        lines.append("# TYPE market_analyzer_request_errors counter")
+        for endpoint, data in summary["requests"].items():
+            lines.append(
+                f'market_analyzer_request_errors{{endpoint="{endpoint}"}} {data["errors"]}'
+            )
+        lines.append("# TYPE market_analyzer_request_seconds histogram")
+        for endpoint, data in summary["requests"].items():
+            # Prometheus buckets are cumulative
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, data["latency_buckets"].values()):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else bound
+                lines.append(
+                    f'market_analyzer_request_seconds_bucket{{endpoint="{endpoint}",le="{le}"}} {cumulative}'
+                )
+            lines.append(
+                f'market_analyzer_request_seconds_sum{{endpoint="{endpoint}"}} {data["seconds"]}'
+            )
+            lines.append(
+                f'market_analyzer_request_seconds_count{{endpoint="{endpoint}"}} {data["count"]}'
+            )
+        return "\n".join(lines) + "\n"
+
+
+def get_endpoint(url: str) -> str:
+    """
+    Returns the host and path of a URL, with every path segment containing an ID replaced by `{id}`,
+    so that requests for different items are counted together.
+    """
+    parts = urlsplit(url)
+    segments = [
+        "{id}" if any(c.isdigit() for c in segment) else segment
+        for segment in parts.path.split("/")
+    ]
+    return f"{parts.hostname}{'/'.join(segments)}"
+
+
+# Shared by every part of the script.
+metrics = Metrics()
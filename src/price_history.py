@@ -0,0 +1,154 @@
+import sqlite3
+import threading
+import time
+
+from .market_data import CACHED_FIELDS
+from .metrics import metrics
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+DEFAULT_RAW_AGE = 7 * DAY  # Snapshots older than this are averaged into one per hour
+DEFAULT_HOURLY_AGE = 30 * DAY  # Snapshots older than this are averaged into one per day
+DEFAULT_RETENTION = 365 * DAY  # Snapshots older than this are removed entirely
+DEFAULT_WINDOW = 7 * DAY
+
+# Snapshot columns and the Universalis fields they're taken from.
+SNAPSHOT_FIELDS = {
+    "listing_price_nq": "currentAveragePriceNQ",
+    "sale_price_nq": "averagePriceNQ",
+    "min_price_nq": "minPriceNQ",
+    "velocity_nq": "nqSaleVelocity",
+    "listing_price_hq": "currentAveragePriceHQ",
+    "sale_price_hq": "averagePriceHQ",
+    "min_price_hq": "minPriceHQ",
+    "velocity_hq": "hqSaleVelocity",
+    "listings_count": "listingsCount",
+}
+
+
+class PriceHistory(object):
+    """
+    Append-only record of the market data seen for each item on each world,
+    so trends can be computed locally instead of pulling sale history from Universalis again.
+    Older snapshots are downsampled by `compact` to keep the table small.
+    Safe to share between threads.
+    """
+
+    def __init__(
+        self,
+        path="market_analyzer.db",
+        raw_age=DEFAULT_RAW_AGE,
+        hourly_age=DEFAULT_HOURLY_AGE,
+        retention=DEFAULT_RETENTION,
+    ) -> None:
+        self.raw_age = raw_age
+        self.hourly_age = hourly_age
+        self.retention = retention
+        self.lock = threading.Lock()
+        self.con = sqlite3.connect(path, check_same_thread=False)
+        # The primary key doubles as the (world, item_id, ts) index, and keeps each item's snapshots together on disk.
+        self.con.execute(
+            f"create table if not exists price_history (world text, item_id integer, ts real, {', '.join(f'{column} real' for column in SNAPSHOT_FIELDS)}, primary key (world, item_id, ts)) without rowid"
+        )
+        self.con.execute(
+            "create index if not exists price_history_ts on price_history (ts)"
+        )
+        self.compact()
+
+    @metrics.timed("history_write")
+    def record(self, world_name: str, listings, sales=None) -> None:
+        """
+        Stores a snapshot of each given `Listing`,
+        along with the item's `Sales` from `sales`, a dict keyed by item ID, if it has any.
+        """
+        now = time.time()
+        world = world_name.lower()
+        if sales is None:
+            sales = {}
+        with self.lock, self.con:
+            self.con.executemany(
+                f"insert or replace into price_history values (?, ?, ?, {', '.join('?' * len(SNAPSHOT_FIELDS))})",
+                [
+                    (
+                        world,
+                        listing.itemID,
+                        now,
+                        *get_snapshot(listing, sales.get(listing.itemID)),
+                    )
+                    for listing in listings
+                ],
+            )
+
+    @metrics.timed("history_read")
+    def get_trends(self, world_name: str, item_ids, window=DEFAULT_WINDOW):
+        """
+        Returns a dict of item ID to the moving average and volatility of its listing prices over the last `window` seconds,
+        for every given item with at least one snapshot in that time.
+        Volatility is the standard deviation relative to the average, so it can be compared between items.
+        """
+        world = world_name.lower()
+        cutoff = time.time() - window
+        trends = {}
+        item_ids = list(item_ids)
+        for i in range(0, len(item_ids), 500):
+            chunk = item_ids[i : i + 500]
+            with self.lock:
+                rows = self.con.execute(
+                    f"select item_id, count(*), avg(listing_price_nq), avg(listing_price_nq * listing_price_nq), avg(listing_price_hq), avg(listing_price_hq * listing_price_hq) from price_history where world = ? and ts >= ? and item_id in ({','.join('?' * len(chunk))}) group by item_id",
+                    (world, cutoff, *chunk),
+                ).fetchall()
+            for item_id, count, nq_mean, nq_square, hq_mean, hq_square in rows:
+                trends[item_id] = {
+                    "snapshots": count,
+                    "movingAveragePriceNQ": nq_mean,
+                    "volatilityNQ": get_volatility(nq_mean, nq_square),
+                    "movingAveragePriceHQ": hq_mean,
+                    "volatilityHQ": get_volatility(hq_mean, hq_square),
+                }
+        return trends
+
+    @metrics.timed("history_write")
+    def compact(self) -> None:
+        """
+        Averages snapshots older than `raw_age` into one per hour, and older than `hourly_age` into one per day,
+        then removes snapshots older than the retention period.
+        """
+        now = time.time()
+        with self.lock, self.con:
+            self.con.execute(
+                "delete from price_history where ts < ?", (now - self.retention,)
+            )
+            for bucket, age in ((HOUR, self.raw_age), (DAY, self.hourly_age)):
+                # Only whole buckets are merged, so a bucket is never averaged twice with different rows.
+                cutoff = (now - age) // bucket * bucket
+                self.con.execute(
+                    f"create temp table compacted as select world, item_id, cast(ts / {bucket} as integer) * {bucket} as ts, {', '.join(f'avg({column})' for column in SNAPSHOT_FIELDS)} from price_history where ts < ? group by world, item_id, cast(ts / {bucket} as integer) having count(*) > 1",
+                    (cutoff,),
+                )
+                self.con.execute(
+                    f"delete from price_history where ts < ? and (world, item_id, cast(ts / {bucket} as integer) * {bucket}) in (select world, item_id, ts from compacted)",
+                    (cutoff,),
+                )
+                self.con.execute("insert into price_history select * from compacted")
+                self.con.execute("drop table compacted")
+
+    def close(self) -> None:
+        self.con.close()
+
+
+def get_snapshot(listing, sales):
+    """
+    Returns the snapshot columns for an item's `Listing` and `Sales`, in the order of `SNAPSHOT_FIELDS`.
+    """
+    return [
+        getattr(listing if field in CACHED_FIELDS["listings"] else sales, field, None)
+        for field in SNAPSHOT_FIELDS.values()
+    ]
+
+
+def get_volatility(mean, mean_square):
+    if mean is None or mean_square is None or mean <= 0:
+        return None
+    # Rounding can make the variance of nearly constant prices slightly negative
+    variance = max(0.0, mean_square - mean * mean)
+    return variance**0.5 / mean
@@ -0,0 +1,119 @@
+import email.utils
+import http.client
+import random
+import time
+from urllib.error import HTTPError
+
+from .metrics import metrics
+
+MAX_ATTEMPTS = 4
+BASE_DELAY = 0.5  # Seconds before the first retry, doubled for each one after it
+MAX_DELAY = 30
+# Statuses that mean the server is busy or briefly unavailable, rather than that the request itself is bad.
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+# Statuses a batched request can get because of one bad ID, which splitting the batch gets around.
+# Anything else, like the 404 for an unknown world, fails the same way for every ID.
+SPLITTABLE_STATUSES = (400, 414)
+# Timeouts, refused connections and resets are all `OSError`s.
+NETWORK_ERRORS = (OSError, http.client.HTTPException)
+
+
+def is_retryable(error) -> bool:
+    # `HTTPError` is also an `OSError`, so it has to be checked first
+    if isinstance(error, HTTPError):
+        return error.code in RETRYABLE_STATUSES
+    return isinstance(error, NETWORK_ERRORS)
+
+
+def get_retry_after(error):
+    """
+    Returns the number of seconds the server asked to wait in its `Retry-After` header, or `None` if it didn't.
+    """
+    if not isinstance(error, HTTPError) or error.headers is None:
+        return None
+    value = error.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    # The header can also be an HTTP date
+    try:
+        retry_time = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_time.timestamp() - time.time())
+
+
+def get_backoff(attempt, base_delay=BASE_DELAY, max_delay=MAX_DELAY) -> float:
+    """
+    Returns a random delay of up to `base_delay * 2 ** attempt` seconds.
+    The jitter keeps workers that failed together from retrying together.
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2**attempt))
+
+
+def call_with_retries(
+    function,
+    *args,
+    limiter=None,
+    max_attempts=MAX_ATTEMPTS,
+    base_delay=BASE_DELAY,
+    max_delay=MAX_DELAY,
+):
+    """
+    Calls `function(*args)`, retrying timeouts, connection errors and busy responses with exponential backoff.
+    Every attempt takes a token from `limiter`, so retries count against the same rate budget as everything else.
+    A 429 pauses the whole limiter for the requested time, since every worker sharing it would be throttled too.
+    Other errors, and the last retryable one, are raised.
+    """
+    for attempt in range(0, max_attempts):
+        if limiter is not None:
+            metrics.add("limiter_wait_seconds", limiter.acquire())
+        if attempt > 0:
+            metrics.add("retries")
+        try:
+            return function(*args)
+        except (HTTPError, *NETWORK_ERRORS) as error:
+            if not is_retryable(error) or attempt + 1 >= max_attempts:
+                raise
+            delay = get_retry_after(error)
+            if delay is None:
+                delay = get_backoff(attempt, base_delay, max_delay)
+            delay = min(delay, max_delay)
+            if limiter is not None and getattr(error, "code", None) == 429:
+                # The next `acquire` waits out the pause
+                limiter.pause(delay)
+            else:
+                metrics.add("retry_wait_seconds", delay)
+                time.sleep(delay)
+
+
+def fetch_with_splitting(fetch, ids, combine):
+    """
+    Returns `fetch(ids)` for a batched request. If the request is rejected because of its IDs,
+    or its response can't be decoded, the IDs are split in half and each half is fetched the same way,
+    so that one bad ID only loses itself instead of the whole batch. `combine` is called with a list of `(half, result)` pairs,
+    where the result is `None` for a half that failed, and returns the result for the whole batch.
+    Returns `None` if the request failed and splitting it wouldn't help.
+    """
+    try:
+        return fetch(ids)
+    except HTTPError as error:
+        if error.code not in SPLITTABLE_STATUSES or len(ids) < 2:
+            return None
+    except NETWORK_ERRORS:
+        # Retries didn't help, so the server is unreachable rather than unhappy with an ID.
+        return None
+    except ValueError:
+        if len(ids) < 2:
+            return None
+
+    middle = len(ids) // 2
+    return combine(
+        [
+            (half, fetch_with_splitting(fetch, half, combine))
+            for half in (ids[:middle], ids[middle:])
+        ]
+    )
@@ -0,0 +1,235 @@
+import heapq
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from .universalis import MAX_BATCH_SIZE
+from .util import clamp, make_batches
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+# Even the busiest items sell a few times at most in this long.
+MIN_INTERVAL = 5 * MINUTE
+MAX_INTERVAL = 6 * HOUR
+# Due items wait up to this long for others to come due, so they can share requests.
+MAX_DELAY = MINUTE
+# A typical 25% price swing between refreshes halves an item's interval.
+VOLATILITY_WEIGHT = 4
+# How much each new price change counts towards an item's volatility, between 0 and 1.
+VOLATILITY_SMOOTHING = 0.3
+
+
+@dataclass(slots=True)
+class ItemSchedule:
+    """
+    When one item on one world is next due, and what its interval was based on.
+    `due` is `None` while the item is being refreshed.
+    """
+
+    due: Optional[float]
+    interval: float = MIN_INTERVAL
+    price_nq: float = 0.0
+    price_hq: float = 0.0
+    volatility: float = 0.0
+
+
+def get_interval(
+    velocity,
+    rank=None,
+    volatility=0.0,
+    min_interval=MIN_INTERVAL,
+    max_interval=MAX_INTERVAL,
+) -> float:
+    """
+    Returns how many seconds an item can go between refreshes.
+    `velocity` is its sales per day, so an item is refreshed about as often as it sells.
+    `rank` is its place in the rankings from 0 (the best) to 1 (the worst), and the best items are refreshed
+    up to three times as often as the worst. Volatile prices shorten the interval further.
+    """
+    interval = DAY / velocity if velocity > 0 else max_interval
+    if rank is not None:
+        interval *= 0.5 + rank
+    interval /= 1 + VOLATILITY_WEIGHT * volatility
+    return clamp(interval, min_interval, max_interval)
+
+
+def get_change(old_price, new_price) -> float:
+    if old_price <= 0:
+        return 0.0
+    return abs(new_price - old_price) / old_price
+
+
+class RefreshScheduler(object):
+    """
+    Decides which items on which worlds to refresh next, giving each one its own interval
+    based on its sale velocity, rank and price volatility, so that fast-moving items stay fresh
+    without spending requests on items that hardly ever change.
+    Due items are packed into full batches, topped up with the items that are due soonest,
+    since a request costs the same whether it has one item or a hundred.
+    Safe to share between threads.
+    """
+
+    def __init__(
+        self,
+        min_interval=MIN_INTERVAL,
+        max_interval=MAX_INTERVAL,
+        max_delay=MAX_DELAY,
+        batch_size=MAX_BATCH_SIZE,
+    ) -> None:
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.max_delay = max_delay
+        self.batch_size = batch_size
+        # World name to a dict of item ID to `ItemSchedule`
+        self.schedules = {}
+        # World name to a heap of (due, item_id). Rescheduled items leave their old entry behind,
+        # which is skipped once it reaches the top, instead of being searched for and removed.
+        self.queues = {}
+        self.lock = threading.Lock()
+
+    def add(self, world_name: str, item_ids, now=None) -> None:
+        """
+        Starts scheduling the given items on a world, due right away.
+        """
+        if now is None:
+            now = time.time()
+        with self.lock:
+            schedules = self.schedules.setdefault(world_name, {})
+            queue = self.queues.setdefault(world_name, [])
+            for item_id in item_ids:
+                if item_id not in schedules:
+                    schedules[item_id] = ItemSchedule(now)
+                    queue.append((now, item_id))
+            heapq.heapify(queue)
+
+    def make_due(self, now=None) -> None:
+        """
+        Makes every scheduled item due right away, e.g. when a full refresh is requested.
+        Items that are being refreshed already are left alone.
+        """
+        if now is None:
+            now = time.time()
+        with self.lock:
+            for world_name, schedules in self.schedules.items():
+                queue = []
+                for item_id, schedule in schedules.items():
+                    if schedule.due is not None:
+                        schedule.due = now
+                        queue.append((now, item_id))
+                self.queues[world_name] = queue
+
+    def peek(self, world_name):
+        """
+        Returns the (due, item_id) of the world's next item, or `None` if nothing is scheduled.
+        Must be called with the lock held.
+        """
+        schedules = self.schedules[world_name]
+        queue = self.queues[world_name]
+        while len(queue) > 0:
+            due, item_id = queue[0]
+            if schedules[item_id].due == due:
+                return queue[0]
+            heapq.heappop(queue)
+        return None
+
+    def next_check(self):
+        """
+        Returns the time at which `take_due` should next be called, or `None` if nothing is scheduled.
+        That's once the earliest due item has waited `max_delay` for others to join it.
+        """
+        with self.lock:
+            next_items = [self.peek(world_name) for world_name in self.queues]
+        dues = [item[0] for item in next_items if item is not None]
+        if len(dues) < 1:
+            return None
+        return min(dues) + self.max_delay
+
+    def take_due(self, world_name: str, now=None):
+        """
+        Returns the world's due items split into batches, with the last batch filled up with the items due soonest.
+        The items are marked as being refreshed until they're passed to `update`.
+        """
+        if now is None:
+            now = time.time()
+        with self.lock:
+            if world_name not in self.queues:
+                return []
+            schedules = self.schedules[world_name]
+            queue = self.queues[world_name]
+            item_ids = []
+            while (next_item := self.peek(world_name)) is not None and (
+                next_item[0] <= now
+                or (len(item_ids) % self.batch_size != 0 and len(item_ids) > 0)
+            ):
+                heapq.heappop(queue)
+                item_ids.append(next_item[1])
+                schedules[next_item[1]].due = None
+        return make_batches(item_ids, self.batch_size)
+
+    def update(self, world_name: str, item_ids, entries, ranks=None, now=None) -> None:
+        """
+        Schedules the next refresh of items returned by `take_due`, from the `MarketEntry`s that were fetched for them.
+        `ranks` is a dict of item ID to its rank from 0 to 1, for the items that have one.
+        Items without an entry weren't found, or their request failed, so they're tried again with a growing interval.
+        """
+        if now is None:
+            now = time.time()
+        if ranks is None:
+            ranks = {}
+        with self.lock:
+            schedules = self.schedules[world_name]
+            queue = self.queues[world_name]
+            fetched_ids = set()
+            for entry in entries:
+                schedule = schedules.get(entry.item_id)
+                if schedule is None:
+                    continue
+                fetched_ids.add(entry.item_id)
+                change = max(
+                    get_change(schedule.price_nq, entry.currentAveragePriceNQ),
+                    get_change(schedule.price_hq, entry.currentAveragePriceHQ),
+                )
+                schedule.volatility += VOLATILITY_SMOOTHING * (
+                    change - schedule.volatility
+                )
+                schedule.price_nq = entry.currentAveragePriceNQ
+                schedule.price_hq = entry.currentAveragePriceHQ
+                schedule.interval = get_interval(
+                    entry.nqSaleVelocity + entry.hqSaleVelocity,
+                    ranks.get(entry.item_id),
+                    schedule.volatility,
+                    self.min_interval,
+                    self.max_interval,
+                )
+                schedule.due = now + schedule.interval
+                heapq.heappush(queue, (schedule.due, entry.item_id))
+
+            for item_id in item_ids:
+                if item_id in fetched_ids:
+                    continue
+                schedule = schedules[item_id]
+                schedule.interval = clamp(
+                    schedule.interval * 2, self.min_interval, self.max_interval
+                )
+                schedule.due = now + schedule.interval
+                heapq.heappush(queue, (schedule.due, item_id))
+
+    def status(self):
+        """
+        Returns the number of items scheduled on each world, and how many of those are due now.
+        """
+        now = time.time()
+        with self.lock:
+            return {
+                world_name: {
+                    "items": len(schedules),
+                    "due": sum(
+                        1
+                        for schedule in schedules.values()
+                        if schedule.due is not None and schedule.due <= now
+                    ),
+                }
+                for world_name, schedules in self.schedules.items()
+            }
@@ -0,0 +1,437 @@
+import copy
+import heapq
+import operator
+import threading
+from array import array
+
+import numpy as np
+
+from .market_data import MarketEntry
+from .metrics import metrics
+
+WEIGHT_AVG_LISTING_PRICE = 25
+WEIGHT_AVG_SALE_PRICE = 50
+WEIGHT_SALE_VELOCITY = 50
+WEIGHT_MIN_AVG_PRICE_DIFF = 25
+
+# Entry fields used for scoring each quality, in the same order as `WEIGHTS`.
+FEATURES = {
+    "nq": [
+        "currentAveragePriceNQ",
+        "averagePriceNQ",
+        "nqSaleVelocity",
+        "currentPriceDifferenceNQ",
+    ],
+    "hq": [
+        "currentAveragePriceHQ",
+        "averagePriceHQ",
+        "hqSaleVelocity",
+        "currentPriceDifferenceHQ",
+    ],
+}
+# A large difference between the average and minimum listing price is bad,
+# so that feature's weight is negative and offset by a constant.
+WEIGHTS = np.array(
+    [
+        WEIGHT_AVG_LISTING_PRICE,
+        WEIGHT_AVG_SALE_PRICE,
+        WEIGHT_SALE_VELOCITY,
+        -WEIGHT_MIN_AVG_PRICE_DIFF,
+    ],
+    dtype=np.float64,
+)
+SCORE_OFFSET = WEIGHT_MIN_AVG_PRICE_DIFF
+# Values this close to a bound snap to it, same as `util.MinMax.get_t`.
+EPSILON = 1e-6
+
+
+def to_columns(entries, fields) -> np.ndarray:
+    """
+    Returns an array with one row per entry and one column per field.
+    """
+    if len(entries) < 1:
+        return np.empty((0, len(fields)), dtype=np.float64)
+    get_row = operator.attrgetter(*fields)
+    return np.array([get_row(entry) for entry in entries], dtype=np.float64).reshape(
+        len(entries), len(fields)
+    )
+
+
+def normalize(columns: np.ndarray, minimum=None, maximum=None) -> np.ndarray:
+    """
+    Min-max normalizes each column of the given array.
+    Bounds default to each column's own minimum and maximum.
+    """
+    if minimum is None:
+        minimum = columns.min(axis=0)
+    if maximum is None:
+        maximum = columns.max(axis=0)
+    value_range = maximum - minimum
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = (columns - minimum) / value_range
+    t = np.where(np.abs(columns - minimum) < EPSILON, 0.0, t)
+    return np.where(np.abs(columns - maximum) < EPSILON, 1.0, t)
+
+
+def score_columns(columns: np.ndarray, minimum=None, maximum=None) -> np.ndarray:
+    """
+    Returns the weighted score of each row of feature columns.
+    """
+    if len(columns) < 1:
+        return np.empty(0, dtype=np.float64)
+    return normalize(columns, minimum, maximum) @ WEIGHTS + SCORE_OFFSET
+
+
+@metrics.timed("scoring")
+def score_entries(entries, qualities=("nq", "hq")):
+    """
+    Scores every entry relative to the others, storing the result in its `score_nq` and `score_hq` fields.
+    Returns a dict of each quality's score array, in the same order as the entries.
+    """
+    scores = {}
+    for quality in qualities:
+        scores[quality] = score_columns(to_columns(entries, FEATURES[quality]))
+        name = f"score_{quality}"
+        for entry, score in zip(entries, scores[quality].tolist()):
+            setattr(entry, name, score)
+    return scores
+
+
+def top_k(scores: np.ndarray, k) -> np.ndarray:
+    """
+    Returns the indices of the `k` highest scores, from highest to lowest,
+    without sorting every score.
+    """
+    k = min(k, len(scores))
+    if k < 1:
+        return np.empty(0, dtype=np.intp)
+    if k < len(scores):
+        indices = np.argpartition(-scores, k - 1)[:k]
+    else:
+        indices = np.arange(len(scores))
+    return indices[np.argsort(-scores[indices], kind="stable")]
+
+
+class StreamingRanker(object):
+    """
+    Ranks entries batch by batch as they arrive, without holding on to the entries themselves.
+    Only the scoring fields are kept, in compact arrays, along with running bounds for each feature.
+    A bounded heap tracks the provisional leaders using the bounds known so far,
+    and `finalize` re-normalizes everything against the final bounds for the exact ranking.
+    Safe to share between threads.
+    """
+
+    def __init__(self, num_recommendations, quality="nq") -> None:
+        self.num_recommendations = num_recommendations
+        self.quality = quality
+        self.fields = FEATURES["nq"] + FEATURES["hq"]
+        self.columns = [array("d") for _ in self.fields]
+        self.item_ids = array("q")
+        self.item_names = []
+        self.worlds = []
+        self.world_indices = array("H")
+        self.minimum = np.full(len(self.fields), np.inf)
+        self.maximum = np.full(len(self.fields), -np.inf)
+        self.heap = []
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.item_ids)
+
+    @metrics.timed("scoring")
+    def add(self, entries) -> None:
+        if len(entries) < 1:
+            return
+        block = to_columns(entries, self.fields)
+        with self.lock:
+            start = len(self.item_ids)
+            for i, column in enumerate(self.columns):
+                column.extend(block[:, i])
+            for entry in entries:
+                self.item_ids.append(entry.item_id)
+                self.item_names.append(entry.item_name)
+                self.world_indices.append(self.get_world_index(entry.world))
+            np.minimum(self.minimum, block.min(axis=0), out=self.minimum)
+            np.maximum(self.maximum, block.max(axis=0), out=self.maximum)
+
+            quality_columns = self.quality_slice(self.quality)
+            scores = score_columns(
+                block[:, quality_columns],
+                self.minimum[quality_columns],
+                self.maximum[quality_columns],
+            )
+            for offset, score in enumerate(scores.tolist()):
+                item = (score, start + offset)
+                if len(self.heap) < self.num_recommendations:
+                    heapq.heappush(self.heap, item)
+                else:
+                    heapq.heappushpop(self.heap, item)
+
+    def get_world_index(self, world_name) -> int:
+        try:
+            return self.worlds.index(world_name)
+        except ValueError:
+            self.worlds.append(world_name)
+            return len(self.worlds) - 1
+
+    def quality_slice(self, quality) -> slice:
+        start = self.fields.index(FEATURES[quality][0])
+        return slice(start, start + len(FEATURES[quality]))
+
+    def leaders(self):
+        """
+        Returns the provisional best entries, scored with the bounds as they were when each entry arrived.
+        """
+        with self.lock:
+            return [
+                self.build_entry(index) for _, index in sorted(self.heap, reverse=True)
+            ]
+
+    @metrics.timed("scoring")
+    def finalize(self):
+        """
+        Returns the best entries with their `score_nq` and `score_hq` fields set,
+        scored against the final bounds of every entry that was added.
+        """
+        with self.lock:
+            columns = np.column_stack(
+                [np.frombuffer(column, dtype=np.float64) for column in self.columns]
+            )
+            scores = {}
+            for quality in FEATURES:
+                quality_columns = self.quality_slice(quality)
+                scores[quality] = score_columns(
+                    columns[:, quality_columns],
+                    self.minimum[quality_columns],
+                    self.maximum[quality_columns],
+                )
+            results = []
+            for index in top_k(scores[self.quality], self.num_recommendations):
+                entry = self.build_entry(index)
+                for quality in FEATURES:
+                    setattr(entry, f"score_{quality}", float(scores[quality][index]))
+                results.append(entry)
+            return results
+
+    def build_entry(self, index) -> MarketEntry:
+        return MarketEntry(
+            self.item_ids[index],
+            self.item_names[index],
+            world=self.worlds[self.world_indices[index]],
+            **{
+                field: column[index] for field, column in zip(self.fields, self.columns)
+            },
+        )
+
+
+class IncrementalRanker(object):
+    """
+    Keeps a changing set of entries scored and ranked for both qualities,
+    so that replacing a few entries only rescores those entries, instead of every entry like `score_entries`.
+    Each feature's values are kept sorted, so its bounds stay exact when the entry holding one is replaced or removed.
+    Every score depends on the bounds, so a quality is still rescored in full when its bounds move,
+    but with a few array operations instead of any per-entry work.
+    Entries are keyed by their world and item ID, and are never modified. Equal scores are in no particular order.
+    Safe to share between threads.
+    """
+
+    def __init__(self, entries=()) -> None:
+        self.fields = FEATURES["nq"] + FEATURES["hq"]
+        # Key to the row of its entry, which indexes every array below
+        self.rows = {}
+        self.entries = []
+        self.free_rows = []
+        self.live = np.zeros(0, dtype=bool)
+        self.columns = np.empty((0, len(self.fields)), dtype=np.float64)
+        # Every live value of each feature, in ascending order
+        self.sorted_values = [np.empty(0, dtype=np.float64) for _ in self.fields]
+        self.minimum = np.full(len(self.fields), np.inf)
+        self.maximum = np.full(len(self.fields), -np.inf)
+        self.scores = {quality: np.empty(0, dtype=np.float64) for quality in FEATURES}
+        # Live rows from the highest score to the lowest, and their negated scores in the same order
+        self.order = {quality: np.empty(0, dtype=np.intp) for quality in FEATURES}
+        self.sorted_scores = {
+            quality: np.empty(0, dtype=np.float64) for quality in FEATURES
+        }
+        # Each quality's bounds when it was last scored, to tell whether they moved since
+        self.last_bounds = {quality: None for quality in FEATURES}
+        self.lock = threading.Lock()
+        self.update(entries)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @metrics.timed("scoring")
+    def update(self, entries) -> None:
+        """
+        Adds the given entries, replacing any with the same key, and rescores them.
+        """
+        if len(entries) < 1:
+            return
+        # A later entry replaces an earlier one with the same key
+        by_key = {(entry.world, entry.item_id): entry for entry in entries}
+        block = to_columns(list(by_key.values()), self.fields)
+        with self.lock:
+            replaced = np.array(
+                [self.rows[key] for key in by_key if key in self.rows], dtype=np.intp
+            )
+            self.replace_values(self.columns[replaced], block)
+            rows = np.array([self.get_row(key) for key in by_key], dtype=np.intp)
+            for row, entry in zip(rows.tolist(), by_key.values()):
+                self.entries[row] = entry
+            self.columns[rows] = block
+            self.live[rows] = True
+            self.rescore(rows, rows)
+
+    @metrics.timed("scoring")
+    def remove(self, keys) -> None:
+        """
+        Removes the entries with the given `(world, item ID)` keys, where present.
+        """
+        with self.lock:
+            rows = np.array(
+                [self.rows.pop(key) for key in keys if key in self.rows], dtype=np.intp
+            )
+            if len(rows) < 1:
+                return
+            self.replace_values(self.columns[rows], self.columns[:0])
+            self.live[rows] = False
+            for row in rows.tolist():
+                self.entries[row] = None
+                self.free_rows.append(row)
+            self.rescore(rows[:0], rows)
+
+    def get_row(self, key) -> int:
+        row = self.rows.get(key)
+        if row is not None:
+            return row
+        if len(self.free_rows) > 0:
+            row = self.free_rows.pop()
+        else:
+            row = len(self.entries)
+            self.entries.append(None)
+            if row >= len(self.live):
+                self.grow(max(16, 2 * len(self.live)))
+        self.rows[key] = row
+        return row
+
+    def grow(self, capacity) -> None:
+        """
+        Extends every per-row array to `capacity` rows, so adding entries one batch at a time stays linear.
+        """
+        extra = capacity - len(self.live)
+        self.live = np.concatenate([self.live, np.zeros(extra, dtype=bool)])
+        self.columns = np.concatenate(
+            [self.columns, np.zeros((extra, len(self.fields)), dtype=np.float64)]
+        )
+        for quality in FEATURES:
+            self.scores[quality] = np.concatenate(
+                [self.scores[quality], np.zeros(extra, dtype=np.float64)]
+            )
+
+    def replace_values(self, old_block: np.ndarray, new_block: np.ndarray) -> None:
+        """
+        Removes one occurrence of each old row's values from the sorted values of each feature,
+        adds the new rows' values, and updates the bounds.
+        """
+        for i, values in enumerate(self.sorted_values):
+            if len(old_block) > 0:
+                old = np.sort(old_block[:, i])
+                # Equal old values each remove a different occurrence of that value
+                positions = (
+                    np.searchsorted(values, old)
+                    + np.arange(len(old))
+                    - np.searchsorted(old, old)
+                )
+                values = np.delete(values, positions)
+            if len(new_block) > 0:
+                new = np.sort(new_block[:, i])
+                values = np.insert(values, np.searchsorted(values, new), new)
+            self.sorted_values[i] = values
+            self.minimum[i] = values[0] if len(values) > 0 else np.inf
+            self.maximum[i] = values[-1] if len(values) > 0 else -np.inf
+
+    def rescore(self, changed_rows: np.ndarray, stale_rows: np.ndarray) -> None:
+        """
+        Scores `changed_rows` and moves them to their place in each ranking, after taking out `stale_rows`.
+        A quality whose bounds moved is rescored and sorted in full instead.
+        """
+        for quality in FEATURES:
+            quality_columns = self.quality_slice(quality)
+            minimum = self.minimum[quality_columns]
+            maximum = self.maximum[quality_columns]
+            if len(self.order[quality]) > 0 and (
+                self.last_bounds[quality] == (minimum.tolist(), maximum.tolist())
+            ):
+                self.merge(quality, changed_rows, stale_rows, minimum, maximum)
+            else:
+                rows = np.flatnonzero(self.live)
+                scores = score_columns(
+                    self.columns[rows, quality_columns], minimum, maximum
+                )
+                self.scores[quality][rows] = scores
+                order = np.argsort(-scores, kind="stable")
+                self.order[quality] = rows[order]
+                self.sorted_scores[quality] = -scores[order]
+                metrics.add("full_rescores")
+            self.last_bounds[quality] = (minimum.tolist(), maximum.tolist())
+
+    def merge(self, quality, changed_rows, stale_rows, minimum, maximum) -> None:
+        order = self.order[quality]
+        sorted_scores = self.sorted_scores[quality]
+        if len(stale_rows) > 0:
+            stale = np.zeros(len(self.live), dtype=bool)
+            stale[stale_rows] = True
+            keep = ~stale[order]
+            order = order[keep]
+            sorted_scores = sorted_scores[keep]
+        if len(changed_rows) > 0:
+            scores = score_columns(
+                self.columns[changed_rows, self.quality_slice(quality)],
+                minimum,
+                maximum,
+            )
+            self.scores[quality][changed_rows] = scores
+            new_order = np.argsort(-scores, kind="stable")
+            new_scores = -scores[new_order]
+            # Inserting in ascending order at ascending positions keeps both arrays sorted
+            positions = np.searchsorted(sorted_scores, new_scores, side="right")
+            order = np.insert(order, positions, changed_rows[new_order])
+            sorted_scores = np.insert(sorted_scores, positions, new_scores)
+        self.order[quality] = order
+        self.sorted_scores[quality] = sorted_scores
+
+    def quality_slice(self, quality) -> slice:
+        start = self.fields.index(FEATURES[quality][0])
+        return slice(start, start + len(FEATURES[quality]))
+
+    def top(self, num_recommendations, quality="nq"):
+        """
+        Returns copies of the best entries for a quality, with their `score_nq` and `score_hq` fields set.
+        """
+        with self.lock:
+            results = []
+            for row in self.order[quality][:num_recommendations].tolist():
+                entry = copy.copy(self.entries[row])
+                entry.score_nq = float(self.scores["nq"][row])
+                entry.score_hq = float(self.scores["hq"][row])
+                results.append(entry)
+            return results
+
+    def ranks(self):
+        """
+        Returns a dict of item ID to its best place in either quality's ranking, from 0 (the best) to 1 (the worst).
+        """
+        with self.lock:
+            last = max(1, len(self.rows) - 1)
+            best = np.ones(len(self.live), dtype=np.float64)
+            for order in self.order.values():
+                places = np.empty(len(self.live), dtype=np.float64)
+                places[order] = np.arange(len(order)) / last
+                np.minimum(best, np.where(self.live, places, 1.0), out=best)
+            ranks = {}
+            rows = np.flatnonzero(self.live)
+            for row, rank in zip(rows.tolist(), best[rows].tolist()):
+                item_id = self.entries[row].item_id
+                ranks[item_id] = min(rank, ranks.get(item_id, rank))
+            return ranks
@@ -0,0 +1,438 @@
+import copy
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlsplit
+
+from .analyzer import add_trends
+from .fast_json import dumps
+from .http_client import get_json
+from .market_data import MarketEntry
+from .metrics import metrics
+from .scoring import FEATURES, IncrementalRanker
+from .universalis import query_items
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8642
+DEFAULT_INTERVAL = 300  # Seconds between the starts of consecutive refreshes
+DEFAULT_LIVE_INTERVAL = 5  # Seconds between rescoring the items changed by live updates
+DEFAULT_RECOMMENDATIONS = 5
+# The most recommendations a single request can ask for
+MAX_RECOMMENDATIONS = 1000
+# Stands for the ranking of every world against each other.
+ALL_WORLDS = "all"
+
+
+class Snapshot(object):
+    """
+    The scored entries of one world, or of every world together, as of the latest refresh.
+    Refreshes replace entries in place, so only the entries that changed are rescored,
+    and a query only has to take the first few of each quality's ranking.
+    """
+
+    def __init__(self, entries, refreshed_at) -> None:
+        self.ranker = IncrementalRanker(entries)
+        self.refreshed_at = refreshed_at
+
+    @property
+    def count(self) -> int:
+        return len(self.ranker)
+
+    def update(self, entries, refreshed_at) -> None:
+        self.ranker.update(entries)
+        self.refreshed_at = refreshed_at
+
+    def top(self, num_recommendations, quality="nq"):
+        return self.ranker.top(num_recommendations, quality)
+
+    def ranks(self):
+        """
+        Returns a dict of item ID to its best place in either quality's ranking, from 0 (the best) to 1 (the worst).
+        """
+        return self.ranker.ranks()
+
+
+class MarketService(object):
+    """
+    Keeps the latest scores for a set of worlds in memory, and refreshes them in the background,
+    so recommendations can be answered in milliseconds instead of with a full scan.
+    Worlds are refreshed one at a time through the shared Universalis rate limiter,
+    so a refresh never uses more than the usual request budget.
+    With a `RefreshScheduler`, only the items it says are due are refreshed, instead of every item every `interval`.
+    With a `LiveFeed`, every item is loaded once and then kept up to date from live events,
+    and the changed items are rescored every `interval` instead.
+    Safe to share between threads.
+    """
+
+    def __init__(
+        self,
+        items,
+        world_names,
+        interval=DEFAULT_INTERVAL,
+        cache=None,
+        history=None,
+        scheduler=None,
+        live=None,
+    ) -> None:
+        self.items = items
+        self.item_names = dict(items)
+        self.world_names = world_names
+        self.interval = interval
+        self.cache = cache
+        self.history = history
+        self.scheduler = scheduler
+        self.live = live
+        # World name to a dict of item ID to its latest entry
+        self.entries = {world_name: {} for world_name in world_names}
+        self.snapshots = {}
+        self.refreshing = False
+        self.last_refresh = None
+        self.lock = threading.Lock()
+        self.refresh_requested = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self) -> None:
+        if self.scheduler is not None:
+            for world_name in self.world_names:
+                self.scheduler.add(world_name, self.item_names)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopping.set()
+        self.refresh_requested.set()
+        if self.thread is not None:
+            self.thread.join()
+        if self.live is not None:
+            self.live.stop()
+
+    def request_refresh(self) -> None:
+        """
+        Starts the next refresh now, instead of at the end of the interval.
+        With a scheduler, every item is refreshed, not just the due ones,
+        and with live updates, every item is loaded again.
+        """
+        if self.scheduler is not None:
+            self.scheduler.make_due()
+        if self.live is not None:
+            self.live.resync.set()
+        self.refresh_requested.set()
+
+    def run(self) -> None:
+        while not self.stopping.is_set():
+            start = time.time()
+            try:
+                self.refresh()
+            except Exception as error:
+                # A failed refresh keeps the previous scores, and the next one tries again.
+                print(f"Error: Refresh failed: {error!r}")
+            self.refresh_requested.wait(
+                max(0.0, self.next_refresh(start) - time.time())
+            )
+            self.refresh_requested.clear()
+
+    def next_refresh(self, start) -> float:
+        next_check = None if self.scheduler is None else self.scheduler.next_check()
+        return start + self.interval if next_check is None else next_check
+
+    @metrics.timed("refresh")
+    def refresh(self) -> None:
+        with self.lock:
+            self.refreshing = True
+        try:
+            if self.live is not None:
+                self.refresh_live()
+            elif self.scheduler is not None:
+                self.refresh_due()
+            else:
+                self.refresh_all()
+        finally:
+            with self.lock:
+                self.refreshing = False
+                self.last_refresh = time.time()
+
+    def refresh_all(self) -> None:
+        for world_name in self.world_names:
+            if self.stopping.is_set():
+                return
+            # The cache's TTL is about as long as the interval, so every other refresh would only read it back.
+            entries = query_items(
+                self.items,
+                world_name,
+                cache=self.cache,
+                verbose=False,
+                history=self.history,
+                refresh=True,
+            )
+            self.entries[world_name] = {entry.item_id: entry for entry in entries}
+            snapshot = self.publish(world_name)
+            print(f"- Refreshed {snapshot.count} items on {world_name}.")
+        self.publish_overall()
+
+    def refresh_due(self) -> None:
+        """
+        Refreshes only the items that the scheduler says are due, and rescores just those items.
+        """
+        # World name to the IDs of the items that were refreshed on it
+        changed = {}
+        for world_name in self.world_names:
+            if self.stopping.is_set():
+                return
+            batches = self.scheduler.take_due(world_name)
+            if len(batches) < 1:
+                continue
+            item_ids = [item_id for batch in batches for item_id in batch]
+            try:
+                entries = query_items(
+                    [(item_id, self.item_names[item_id]) for item_id in item_ids],
+                    world_name,
+                    batch_size=self.scheduler.batch_size,
+                    cache=self.cache,
+                    verbose=False,
+                    history=self.history,
+                    # Items can come due well within the cache's TTL, like the ones added to fill the last batch
+                    refresh=True,
+                )
+            except Exception:
+                # Otherwise the items would never be scheduled again
+                self.scheduler.update(world_name, item_ids, [])
+                raise
+            self.entries[world_name].update((entry.item_id, entry) for entry in entries)
+            changed[world_name] = [entry.item_id for entry in entries]
+            snapshot = self.publish(world_name, changed[world_name])
+            self.scheduler.update(world_name, item_ids, entries, snapshot.ranks())
+            print(
+                f"- Refreshed {len(entries)} of {snapshot.count} items on {world_name}."
+            )
+        if len(changed) > 0:
+            self.publish_overall(changed)
+
+    def refresh_live(self) -> None:
+        """
+        Rescores the items that changed since the last refresh, after loading every item
+        the first time, or again if live updates were interrupted.
+        Velocities decay between sales, but an item's entry only picks that up when it next changes,
+        which is negligible next to a velocity window of a week.
+        """
+        if self.live.thread is None:
+            # Loading waits for the subscriptions, so events that happen while loading aren't missed
+            self.live.start()
+        if self.live.resync.is_set():
+            self.live.seed()
+
+        now = time.time()
+        market = self.live.market
+        changed = market.take_changed()
+        for world_name, item_ids in changed.items():
+            world_entries = self.entries[world_name]
+            for item_id in item_ids:
+                world_entries[item_id] = market.entry(world_name, item_id, now)
+            self.publish(world_name, item_ids)
+            metrics.add("live_rescored", len(item_ids))
+        if len(changed) > 0:
+            self.publish_overall(changed)
+
+    def publish(self, world_name, item_ids=None) -> Snapshot:
+        """
+        Ranks the latest entries of a world. Given the IDs of the items that changed,
+        only those are rescored in the world's current snapshot, and otherwise a new snapshot replaces it.
+        """
+        with self.lock:
+            snapshot = self.snapshots.get(world_name.lower())
+        entries = self.get_entries(world_name, item_ids)
+        if snapshot is None or item_ids is None:
+            snapshot = Snapshot(entries, time.time())
+            with self.lock:
+                self.snapshots[world_name.lower()] = snapshot
+        else:
+            snapshot.update(entries, time.time())
+        return snapshot
+
+    def publish_overall(self, changed=None) -> None:
+        """
+        Ranks the latest entries of every world against each other.
+        Given a dict of world name to the IDs of the items that changed, only those are rescored.
+        """
+        if len(self.world_names) < 2:
+            return
+        with self.lock:
+            overall = self.snapshots.get(ALL_WORLDS)
+        if overall is None or changed is None:
+            changed = dict.fromkeys(self.world_names)
+            overall = None
+        entries = []
+        for world_name, item_ids in changed.items():
+            entries.extend(self.get_entries(world_name, item_ids))
+        if overall is None:
+            overall = Snapshot(entries, time.time())
+            with self.lock:
+                self.snapshots[ALL_WORLDS] = overall
+        else:
+            overall.update(entries, time.time())
+
+    def get_entries(self, world_name, item_ids=None):
+        """
+        Returns the latest entries of a world for the given item IDs, or for every item.
+        Rankings of several worlds show which world an entry is from, same as `analyze_worlds`,
+        so those entries are copies with their world set.
+        """
+        world_entries = self.entries[world_name]
+        if item_ids is None:
+            item_ids = world_entries
+        entries = [
+            world_entries[item_id] for item_id in item_ids if item_id in world_entries
+        ]
+        if len(self.world_names) > 1:
+            entries = [copy.copy(entry) for entry in entries]
+            for entry in entries:
+                entry.world = world_name
+        return entries
+
+    def recommend(
+        self, world_name=None, num_recommendations=DEFAULT_RECOMMENDATIONS, quality="nq"
+    ):
+        """
+        Returns the snapshot for a world, or `ALL_WORLDS`, and copies of its best entries with their trends,
+        or `None` if the world hasn't been refreshed yet.
+        Defaults to the first world.
+        """
+        if world_name is None:
+            world_name = self.world_names[0]
+        with self.lock:
+            snapshot = self.snapshots.get(world_name.lower())
+        if snapshot is None:
+            return None
+        results = snapshot.top(num_recommendations, quality)
+        add_trends(results, self.history, world_name)
+        return snapshot, results
+
+    def status(self):
+        with self.lock:
+            return {
+                "worlds": self.world_names,
+                "items": len(self.items),
+                "interval": self.interval,
+                "refreshing": self.refreshing,
+                "lastRefresh": self.last_refresh,
+                "scheduled": (
+                    None if self.scheduler is None else self.scheduler.status()
+                ),
+                "snapshots": {
+                    world: {
+                        "refreshedAt": snapshot.refreshed_at,
+                        "count": snapshot.count,
+                    }
+                    for world, snapshot in self.snapshots.items()
+                },
+            }
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """
+    GET /recommendations?world=&top=&quality= returns the best entries of a world, or of "all" worlds.
+    GET /status describes the service, and POST /refresh starts a refresh now.
+    """
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, which Nagle's algorithm would hold back for a delayed ACK.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        parts = urlsplit(self.path)
+        if parts.path == "/status":
+            self.send_json(200, self.server.service.status())
+        elif parts.path == "/recommendations":
+            self.recommendations(parse_qs(parts.query))
+        else:
+            self.send_json(404, {"error": f"Unknown path {parts.path}."})
+
+    def do_POST(self) -> None:
+        # Nothing is read from the body, but it has to be consumed to keep the connection usable
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if urlsplit(self.path).path == "/refresh":
+            self.server.service.request_refresh()
+            self.send_json(202, {"refreshing": True})
+        else:
+            self.send_json(404, {"error": f"Unknown path {self.path}."})
+
+    def recommendations(self, query) -> None:
+        service = self.server.service
+        world_name = query.get("world", [service.world_names[0]])[0]
+        quality = query.get("quality", ["nq"])[0]
+        try:
+            num_recommendations = int(
+                query.get("top", [str(DEFAULT_RECOMMENDATIONS)])[0]
+            )
+        except ValueError:
+            num_recommendations = 0
+        if not 1 <= num_recommendations <= MAX_RECOMMENDATIONS:
+            self.send_json(
+                400,
+                {"error": f"top must be a number from 1 to {MAX_RECOMMENDATIONS}."},
+            )
+            return
+        if quality not in FEATURES:
+            self.send_json(400, {"error": "quality must be nq or hq."})
+            return
+        known_worlds = [name.lower() for name in service.world_names]
+        # Only a service for several worlds ranks them against each other
+        if len(known_worlds) > 1:
+            known_worlds.append(ALL_WORLDS)
+        if world_name.lower() not in known_worlds:
+            self.send_json(
+                404, {"error": f"{world_name} isn't refreshed by this service."}
+            )
+            return
+
+        result = service.recommend(world_name, num_recommendations, quality)
+        if result is None:
+            self.send_json(
+                503,
+                {"error": f"{world_name} hasn't been refreshed yet. Try again soon."},
+            )
+            return
+        snapshot, results = result
+        self.send_json(
+            200,
+            {
+                "world": world_name,
+                "refreshedAt": snapshot.refreshed_at,
+                "results": [entry.to_dict() for entry in results],
+            },
+        )
+
+    def send_json(self, status, data) -> None:
+        body = dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def make_server(service: MarketService, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    server = ThreadingHTTPServer((host, port), ServiceHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+def fetch_recommendations(
+    server_url: str,
+    world_name=None,
+    num_recommendations=DEFAULT_RECOMMENDATIONS,
+    quality="nq",
+):
+    """
+    Asks a running service for recommendations, and returns its response with the results as `MarketEntry`s.
+    """
+    query = f"top={num_recommendations}&quality={quality}"
+    if world_name is not None:
+        query += f"&world={quote(world_name)}"
+    data = get_json(f"{server_url.rstrip('/')}/recommendations?{query}")
+    data["results"] = [MarketEntry(**entry) for entry in data["results"]]
+    return data
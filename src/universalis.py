@@ -0,0 +1,402 @@
+import math
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+
+from .http_client import get, get_json
+from .market_data import CACHED_FIELDS, MarketEntry, Response, decode_response
+from .metrics import metrics
+from .retry import NETWORK_ERRORS, call_with_retries, fetch_with_splitting
+from .util import TokenBucket, clamp, make_batches
+
+UNIVERSALIS_URL = "https://universalis.app/api"
+MAX_WORKERS = 8
+# Universalis accepts at most this many item IDs per request.
+MAX_BATCH_SIZE = 100
+MIN_BATCH_SIZE = 20
+
+# Shared by every Universalis request, regardless of which thread makes it.
+limiter = TokenBucket(20, 1)
+
+
+def fetch_json(url: str):
+    """
+    Requests and decodes the given URL, retrying transient failures.
+    Every attempt waits for a token from the shared rate limiter.
+    """
+    return call_with_retries(get_json, url, limiter=limiter)
+
+
+def get_response(url: str, endpoint: str, single: bool) -> Response:
+    return decode_response(endpoint, get(url), single)
+
+
+def fetch_response(url: str, endpoint: str, single: bool) -> Response:
+    """
+    Requests a listings or history URL and decodes it into records, retrying transient failures.
+    """
+    return call_with_retries(get_response, url, endpoint, single, limiter=limiter)
+
+
+def try_fetch_record(url: str, endpoint: str):
+    """
+    Requests a single item's listings or history, and returns its record,
+    or `None` on an HTTP, network or decoding error.
+    """
+    try:
+        return fetch_response(url, endpoint, True).items[0]
+    except (HTTPError, ValueError, *NETWORK_ERRORS):
+        return None
+
+
+def get_region_worlds(region: str, base_url=UNIVERSALIS_URL):
+    """
+    Returns the names of every world in the given region (e.g. "North-America") or data centre.
+    """
+    data_centres = fetch_json(f"{base_url}/v2/data-centers")
+    world_names = {
+        world["id"]: world["name"] for world in fetch_json(f"{base_url}/v2/worlds")
+    }
+    return [
+        world_names[world_id]
+        for data_centre in data_centres
+        if region.lower()
+        in (data_centre["region"].lower(), data_centre["name"].lower())
+        for world_id in data_centre["worlds"]
+        if world_id in world_names
+    ]
+
+
+def get_world_ids(base_url=UNIVERSALIS_URL):
+    """
+    Returns a dict of every world's lowercase name to its ID, which is how live events refer to worlds.
+    """
+    return {
+        world["name"].lower(): world["id"]
+        for world in fetch_json(f"{base_url}/v2/worlds")
+    }
+
+
+def listings_url(world_name: str, item_ids, base_url=UNIVERSALIS_URL, trim=True) -> str:
+    """
+    Builds the URL for current listing data.
+    With `trim`, individual listings and sales are skipped and only the aggregate fields used for scoring are returned.
+    """
+    url = f"{base_url}/{world_name}/{','.join(map(str, item_ids))}"
+    if not trim:
+        return f"{url}?entries=100"
+    return f"{url}?listings=0&entries=0&fields={response_fields(item_ids, 'listings')}"
+
+
+def current_listings_url(world_name: str, item_ids, base_url=UNIVERSALIS_URL) -> str:
+    """
+    Builds the URL for every individual listing of the given items, without their sale history.
+    """
+    return f"{base_url}/{world_name}/{','.join(map(str, item_ids))}?entries=0&fields={response_fields(item_ids, 'live')}"
+
+
+def history_url(world_name: str, item_ids, base_url=UNIVERSALIS_URL, trim=True) -> str:
+    """
+    Builds the URL for historical sale data.
+    With `trim`, only the sale velocities are returned instead of every recent sale.
+    """
+    url = f"{base_url}/history/{world_name}/{','.join(map(str, item_ids))}"
+    if not trim:
+        return url
+    return f"{url}?entriesToReturn=1&fields={response_fields(item_ids, 'history')}"
+
+
+def response_fields(item_ids, endpoint: str) -> str:
+    # Multi-item responses nest each item's fields under "items"
+    if len(item_ids) == 1:
+        return ",".join(CACHED_FIELDS[endpoint])
+    return ",".join(
+        ["unresolvedItems", *(f"items.{field}" for field in CACHED_FIELDS[endpoint])]
+    )
+
+
+def get_batch_size(num_items, max_workers=MAX_WORKERS) -> int:
+    """
+    Picks a batch size that spreads the items over every worker,
+    without going over the number of IDs Universalis allows per request.
+    """
+    return clamp(math.ceil(num_items / max_workers), MIN_BATCH_SIZE, MAX_BATCH_SIZE)
+
+
+def fetch_batch(make_url, item_ids, endpoint: str):
+    """
+    Requests the URL made from the given item IDs, and decodes the response into the endpoint's records.
+    Rejected batches are split with `fetch_with_splitting`, so that one bad ID only loses itself
+    instead of the whole batch, and the IDs of halves that failed are added to `unresolvedItems`.
+    Returns the combined `Response`, or `None` if every request failed.
+    """
+
+    def fetch(item_ids):
+        return fetch_response(make_url(item_ids), endpoint, len(item_ids) == 1)
+
+    def combine(parts):
+        items = []
+        unresolved_items = []
+        for half, part in parts:
+            if part is None:
+                unresolved_items.extend(half)
+                continue
+            items.extend(part.items)
+            unresolved_items.extend(part.unresolvedItems)
+        if all(part is None for _, part in parts):
+            return None
+        return Response(items, unresolved_items)
+
+    return fetch_with_splitting(fetch, item_ids, combine)
+
+
+def parse_listing(listing, item_id, item_name, sales=None) -> MarketEntry:
+    """
+    Builds an item's entry from its `Listing`, and its `Sales` if there are any.
+    Velocities are zero for an item without sales data.
+    """
+    return MarketEntry(
+        item_id,
+        item_name,
+        currentAveragePriceNQ=listing.currentAveragePriceNQ,
+        averagePriceNQ=listing.averagePriceNQ,
+        nqSaleVelocity=0 if sales is None else sales.nqSaleVelocity,
+        currentPriceDifferenceNQ=listing.currentAveragePriceNQ - listing.minPriceNQ,
+        currentAveragePriceHQ=listing.currentAveragePriceHQ,
+        averagePriceHQ=listing.averagePriceHQ,
+        hqSaleVelocity=0 if sales is None else sales.hqSaleVelocity,
+        currentPriceDifferenceHQ=listing.currentAveragePriceHQ - listing.minPriceHQ,
+    )
+
+
+def query_items(item_tuples, world_name, **kwargs):
+    """
+    Queries Universalis for every given `(item_id, name)` tuple and returns all of the entries at once.
+    Takes the same options as `iter_items`.
+    """
+    return [
+        entry
+        for batch in iter_items(item_tuples, world_name, **kwargs)
+        for entry in batch
+    ]
+
+
+def iter_items(
+    item_tuples,
+    world_name,
+    batch_size=None,
+    max_workers=MAX_WORKERS,
+    base_url=UNIVERSALIS_URL,
+    cache=None,
+    verbose=True,
+    trim=True,
+    history=None,
+    refresh=False,
+):
+    """
+    Queries Universalis for multiple items at once, yielding a list of entries for each batch as it arrives.
+    Several batches are in flight at a time, but only a bounded number of them,
+    so memory doesn't grow with the number of items.
+    All requests share one rate limiter, so together they stay under 20 calls per second.
+    Pass `verbose=False` to only print a summary, e.g. when several worlds are queried at once.
+    Newly downloaded data is recorded in `history`, if given.
+    With `refresh`, every item is downloaded again instead of being read from `cache`, which is still updated.
+    """
+    item_names = dict(item_tuples)
+    read_cache = None if refresh else cache
+
+    # Items that are fully cached are batched separately, so they don't take up room in network requests.
+    fresh_ids = set()
+    if read_cache is not None:
+        fresh_ids = cache.get_fresh_ids(
+            world_name, item_names, "listings"
+        ) & cache.get_fresh_ids(world_name, item_names, "history")
+        if verbose:
+            print(f"Found cached data for {len(fresh_ids)} items.")
+    stale_ids = [item_id for item_id in item_names if item_id not in fresh_ids]
+    if batch_size is None:
+        batch_size = get_batch_size(len(stale_ids), max_workers)
+    batches = make_batches(
+        [item_id for item_id in item_names if item_id in fresh_ids], MAX_BATCH_SIZE
+    ) + make_batches(stale_ids, batch_size)
+    print(
+        f"{world_name}: Querying {len(stale_ids)} items in batches of {batch_size} items each..."
+    )
+
+    def fetch(batch):
+        return fetch_entries_data(world_name, batch, base_url, read_cache, trim)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = deque()
+        next_batch = 0
+        for i in range(0, len(batches)):
+            # Keep every worker busy, plus a few batches queued up behind them.
+            while next_batch < len(batches) and len(pending) < max_workers * 2:
+                pending.append(pool.submit(fetch, batches[next_batch]))
+                next_batch += 1
+
+            listing_data, listings_response, sale_data, sale_response = (
+                pending.popleft().result()
+            )
+            if verbose:
+                print(f"Received data for Batch {i + 1}...")
+            with metrics.timer("merge"):
+                entries = merge_batch(
+                    world_name,
+                    item_names,
+                    batches[i],
+                    listing_data,
+                    listings_response,
+                    sale_data,
+                    sale_response,
+                    cache,
+                    verbose,
+                    history,
+                )
+            yield entries
+
+
+@metrics.timed("fetch")
+def fetch_entries_data(world_name, batch, base_url, cache, trim):
+    """
+    Gets the listing and sale data for one batch, from the cache where possible.
+    Returns the cached data for each endpoint along with the responses for the remaining items,
+    which are `None` if there were no remaining items or if the request failed.
+    """
+    listing_data = {}
+    sale_data = {}
+    if cache is not None:
+        listing_data = cache.get_fresh(world_name, batch, "listings")
+        sale_data = cache.get_fresh(world_name, batch, "history")
+        # Counted once per endpoint, since each one is cached separately
+        hits = len(listing_data) + len(sale_data)
+        metrics.add("cache_hits", hits)
+        metrics.add("cache_misses", len(batch) * 2 - hits)
+
+    listings_response = None
+    missing_ids = [item_id for item_id in batch if item_id not in listing_data]
+    if len(missing_ids) > 0:
+        listings_response = fetch_batch(
+            lambda ids: listings_url(world_name, ids, base_url, trim),
+            missing_ids,
+            "listings",
+        )
+    sale_response = None
+    missing_ids = [item_id for item_id in batch if item_id not in sale_data]
+    if len(missing_ids) > 0:
+        sale_response = fetch_batch(
+            lambda ids: history_url(world_name, ids, base_url, trim),
+            missing_ids,
+            "history",
+        )
+    return listing_data, listings_response, sale_data, sale_response
+
+
+def merge_batch(
+    world_name,
+    item_names,
+    batch,
+    listing_data,
+    listings_response,
+    sale_data,
+    sale_response,
+    cache,
+    verbose,
+    history=None,
+):
+    """
+    Combines one batch's cached data and responses into entries, and caches and records the new data.
+    Everything here is scoped to the batch, so a failure in one batch can't affect another.
+    """
+    fetched_ids = []
+    if len(listing_data) < len(batch):
+        items = collect_batch(item_names, listings_response, "listing", verbose)
+        if items is None:
+            print(f"- {world_name}: Listings request failed. Skipping batch...")
+        else:
+            if cache is not None:
+                cache.put(world_name, "listings", items)
+            listing_data.update((item.itemID, item) for item in items)
+            fetched_ids = [item.itemID for item in items]
+
+    # Sale velocities are kind of weird, so they come from a separate request for historical data.
+    if len(sale_data) < len(batch):
+        items = collect_batch(item_names, sale_response, "sales", verbose)
+        # A failed request should only happen if the world name is wrong.
+        if items is None:
+            print(
+                f"- {world_name}: Warning: Failed to obtain sale data from Universalis."
+            )
+        else:
+            if cache is not None:
+                cache.put(world_name, "history", items)
+            sale_data.update((item.itemID, item) for item in items)
+
+    # Cached data was already recorded when it was downloaded
+    if history is not None and len(fetched_ids) > 0:
+        history.record(
+            world_name, [listing_data[item_id] for item_id in fetched_ids], sale_data
+        )
+
+    entries = []
+    for item_id in batch:
+        if item_id not in listing_data:
+            continue
+        entries.append(
+            parse_listing(
+                listing_data[item_id],
+                item_id,
+                item_names[item_id],
+                sale_data.get(item_id),
+            )
+        )
+    return entries
+
+
+def collect_batch(item_names, response, data_name, verbose=True):
+    """
+    Returns the per-item data of one batch's response, or `None` if the request failed.
+    """
+    if response is None:
+        return None
+    items = response.items
+    if not verbose:
+        return items
+
+    failed_items = response.unresolvedItems
+    if len(failed_items) > 0:
+        print(f"- Failed to retrieve {data_name} data for {len(failed_items)} items:")
+        for item in failed_items:
+            print(f"  - Item {item}: {item_names.get(item)}")
+    else:
+        print(f"- Successfully found {data_name} data for all items in batch:")
+
+    for item in items:
+        print(
+            f"  - Found {data_name} data for Item {item.itemID}: {item_names.get(item.itemID)}"
+        )
+    return items
+
+
+def query_item(item_tuple, world_name, base_url=UNIVERSALIS_URL):
+    # Query Universalis for a single item, using the same rate limiter as `query_items`
+    item_id, item_name = item_tuple
+    print(f"Querying Item {item_id}: {item_name}...")
+
+    # Get listing data from Universalis
+    listing = try_fetch_record(
+        listings_url(world_name, [item_id], base_url), "listings"
+    )
+    if listing is None:
+        print("- Listing data not found on Universalis. Skipping...")
+        return None
+    print("- Successfully obtained listing data from Universalis.")
+
+    # Sale velocities are kind of weird, so we need to make a separate request for historical data.
+    sales = try_fetch_record(history_url(world_name, [item_id], base_url), "history")
+    if sales is None:
+        print("- Warning: Failed to obtain sale data from Universalis.")
+    else:
+        print("- Successfully obtained historical sale data from Universalis.")
+
+    return parse_listing(listing, item_id, item_name, sales)
@@ -1,5 +1,8 @@
 # Various utility functions
 
+import threading
+import time
+
 
 def clamp(v, minv, maxv):
     """
@@ -15,6 +18,26 @@ def get_user_agent() -> str:
     return "XIVMarketAnalyzer/1.0.1 https://github.com/lyao6104/XIVMarketAnalyzer"
 
 
+def make_batches(items, batch_size):
+    """
+    Splits a list into consecutive batches of at most `batch_size` items,
+    without copying the rest of the list for every batch.
+    """
+    return [items[i : i + batch_size] for i in range(0, len(items), batch_size)]
+
+
+def print_progress(current, total, label) -> None:
+    """
+    Prints a progress counter that overwrites itself, instead of one line per item.
+    The line is ended once `current` reaches `total`.
+    """
+    print(
+        f"\r{label}: {current}/{total}",
+        end="\n" if current >= total else "",
+        flush=True,
+    )
+
+
 class MinMax(object):
     """
     Class for easily calculating the minimum and maximum value in a collection,
@@ -43,3 +66,55 @@ class MinMax(object):
             return 0
         else:
             return (v - self.minimum) / (self.maximum - self.minimum)
+
+
+class TokenBucket(object):
+    """
+    Thread-safe token bucket rate limiter.
+    A single instance can be shared between any number of worker threads,
+    so that all of their requests together stay within `rate` calls per `period` seconds.
+    """
+
+    def __init__(self, rate, period=1.0, capacity=1) -> None:
+        self.fill_rate = rate / period
+        # A capacity of 1 spaces calls evenly instead of allowing bursts,
+        # which keeps any one-second window from going over the budget.
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1) -> float:
+        """
+        Blocks until the requested number of tokens is available, then consumes them.
+        Returns the number of seconds spent waiting.
+        """
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity,
+                    self.tokens + (now - self.last_refill) * self.fill_rate,
+                )
+                self.last_refill = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return waited
+                delay = (tokens - self.tokens) / self.fill_rate
+            time.sleep(delay)
+            waited += delay
+
+    def pause(self, seconds) -> None:
+        """
+        Holds back every caller for at least the given number of seconds, e.g. after the server asks to slow down.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity,
+                self.tokens + (now - self.last_refill) * self.fill_rate,
+            )
+            self.last_refill = now
+            # A deficit takes this long to refill before anyone can get a token again
+            self.tokens = min(self.tokens, -seconds * self.fill_rate)
@@ -0,0 +1,251 @@
+# Minimal WebSocket client (RFC 6455), enough to subscribe to the Universalis WebSocket API
+# without depending on a WebSocket library. Extensions like compression aren't negotiated.
+import base64
+import hashlib
+import os
+import socket
+import ssl
+import struct
+import threading
+from urllib.parse import urlsplit
+
+from .util import get_user_agent
+
+# Appended to the handshake key by the server, as set by the RFC.
+HANDSHAKE_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+OPCODE_CONTINUATION = 0x0
+OPCODE_TEXT = 0x1
+OPCODE_BINARY = 0x2
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+# Messages larger than this are treated as a protocol error instead of being buffered.
+MAX_MESSAGE_SIZE = 16 * 2**20
+
+
+class WebSocketError(Exception):
+    pass
+
+
+class WebSocket(object):
+    """
+    One client connection. `receive` answers pings and reassembles fragmented messages,
+    and `send` can be called from any thread while another one is receiving.
+    """
+
+    def __init__(self, sock: socket.socket, file) -> None:
+        self.sock = sock
+        self.file = file
+        self.send_lock = threading.Lock()
+        self.closed = False
+
+    @classmethod
+    def connect(cls, url: str, timeout=30, headers=None):
+        """
+        Opens a connection to a ws:// or wss:// URL and completes the opening handshake.
+        """
+        parts = urlsplit(url)
+        secure = parts.scheme == "wss"
+        host = parts.hostname
+        port = parts.port or (443 if secure else 80)
+        sock = socket.create_connection((host, port), timeout=timeout)
+        try:
+            if secure:
+                sock = ssl.create_default_context().wrap_socket(
+                    sock, server_hostname=host
+                )
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            file = sock.makefile("rb")
+            key = base64.b64encode(os.urandom(16)).decode()
+            path = parts.path or "/"
+            if parts.query:
+                path += "?" + parts.query
+            request_headers = {
+                "Host": host if parts.port is None else f"{host}:{port}",
+                "User-Agent": get_user_agent(),
+                "Upgrade": "websocket",
+                "Connection": "Upgrade",
+                "Sec-WebSocket-Key": key,
+                "Sec-WebSocket-Version": "13",
+            }
+            if headers is not None:
+                request_headers.update(headers)
+            sock.sendall(
+                (
+                    f"GET {path} HTTP/1.1\r\n"
+                    + "".join(
+                        f"{name}: {value}\r\n"
+                        for name, value in request_headers.items()
+                    )
+                    + "\r\n"
+                ).encode()
+            )
+            check_handshake(file, key)
+        except Exception:
+            sock.close()
+            raise
+        # Messages can be far apart, so only the handshake is timed out.
+        sock.settimeout(None)
+        return cls(sock, file)
+
+    def send(self, payload, opcode=OPCODE_BINARY) -> None:
+        """
+        Sends one message in a single frame. Client frames have to be masked.
+        """
+        if isinstance(payload, str):
+            payload = payload.encode()
+        length = len(payload)
+        if length < 126:
+            header = struct.pack("!BB", 0x80 | opcode, 0x80 | length)
+        elif length < 2**16:
+            header = struct.pack("!BBH", 0x80 | opcode, 0x80 | 126, length)
+        else:
+            header = struct.pack("!BBQ", 0x80 | opcode, 0x80 | 127, length)
+        mask = os.urandom(4)
+        with self.send_lock:
+            self.sock.sendall(header + mask + apply_mask(payload, mask))
+
+    def receive(self):
+        """
+        Returns the next message as `(opcode, payload)`, or `None` once the connection is closed.
+        Text messages are returned as `str`, and binary ones as `bytes`.
+        """
+        opcode = None
+        fragments = []
+        size = 0
+        while True:
+            frame = self.read_frame()
+            if frame is None:
+                return None
+            fin, frame_opcode, payload = frame
+            if frame_opcode == OPCODE_PING:
+                self.send(payload, OPCODE_PONG)
+                continue
+            if frame_opcode == OPCODE_PONG:
+                continue
+            if frame_opcode == OPCODE_CLOSE:
+                self.close()
+                return None
+
+            if frame_opcode == OPCODE_CONTINUATION:
+                if opcode is None:
+                    raise WebSocketError("Continuation frame without a message")
+            elif opcode is not None:
+                raise WebSocketError("New message before the last one finished")
+            else:
+                opcode = frame_opcode
+            fragments.append(payload)
+            size += len(payload)
+            if size > MAX_MESSAGE_SIZE:
+                raise WebSocketError(f"Message is larger than {MAX_MESSAGE_SIZE} bytes")
+            if fin:
+                message = fragments[0] if len(fragments) == 1 else b"".join(fragments)
+                if opcode == OPCODE_TEXT:
+                    return opcode, message.decode()
+                return opcode, message
+
+    def read_frame(self):
+        """
+        Returns the next frame as `(fin, opcode, payload)`, or `None` if the connection was closed.
+        """
+        header = self.read_exactly(2)
+        if header is None:
+            return None
+        first, second = header
+        length = second & 0x7F
+        if length == 126:
+            extended = self.read_exactly(2)
+            if extended is None:
+                return None
+            length = struct.unpack("!H", extended)[0]
+        elif length == 127:
+            extended = self.read_exactly(8)
+            if extended is None:
+                return None
+            length = struct.unpack("!Q", extended)[0]
+        if length > MAX_MESSAGE_SIZE:
+            raise WebSocketError(f"Frame is larger than {MAX_MESSAGE_SIZE} bytes")
+        mask = None
+        if second & 0x80:
+            mask = self.read_exactly(4)
+            if mask is None:
+                return None
+        payload = self.read_exactly(length)
+        if payload is None:
+            return None
+        if mask is not None:
+            payload = apply_mask(payload, mask)
+        return bool(first & 0x80), first & 0x0F, payload
+
+    def read_exactly(self, size):
+        if size == 0:
+            return b""
+        try:
+            data = self.file.read(size)
+        except (OSError, ValueError):
+            # Closed from another thread, or by the server
+            return None
+        if data is None or len(data) < size:
+            return None
+        return data
+
+    def close(self) -> None:
+        """
+        Sends a close frame if the connection is still open, then closes the socket.
+        Safe to call from another thread to stop a `receive`.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.send(b"", OPCODE_CLOSE)
+        except OSError:
+            pass
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.file.close()
+        self.sock.close()
+
+
+def check_handshake(file, key: str) -> None:
+    """
+    Reads the server's response to the opening handshake, and raises a `WebSocketError` unless it accepted.
+    """
+    status_line = file.readline().decode("latin-1").strip()
+    response_headers = {}
+    while True:
+        line = file.readline().decode("latin-1")
+        if line in ("\r\n", "\n", ""):
+            break
+        name, _, value = line.partition(":")
+        response_headers[name.strip().lower()] = value.strip()
+
+    parts = status_line.split(" ", 2)
+    if len(parts) < 2 or parts[1] != "101":
+        raise WebSocketError(f"Handshake was refused: {status_line}")
+    if response_headers.get("sec-websocket-accept") != get_accept_key(key):
+        raise WebSocketError("Handshake response has the wrong Sec-WebSocket-Accept")
+
+
+def get_accept_key(key: str) -> str:
+    """
+    Returns the Sec-WebSocket-Accept value for a handshake key.
+    """
+    return base64.b64encode(
+        hashlib.sha1((key + HANDSHAKE_GUID).encode()).digest()
+    ).decode()
+
+
+def apply_mask(payload: bytes, mask: bytes) -> bytes:
+    """
+    XORs the payload with the repeating 4-byte mask, a whole integer at a time instead of byte by byte.
+    """
+    length = len(payload)
+    if length == 0:
+        return payload
+    repeated = (mask * (length // 4 + 1))[:length]
+    return (
+        int.from_bytes(payload, "little") ^ int.from_bytes(repeated, "little")
+    ).to_bytes(length, "little")
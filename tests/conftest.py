@@ -0,0 +1,10 @@
+import pytest
+
+from src import universalis
+from src.util import TokenBucket
+
+
+@pytest.fixture(autouse=True)
+def no_rate_limit(monkeypatch):
+    # The mocks are local, so there's nothing to protect
+    monkeypatch.setattr(universalis, "limiter", TokenBucket(1000000, 1, 1000))
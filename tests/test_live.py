@@ -0,0 +1,264 @@
+# Checks live updates against the local mocks of the Universalis REST and WebSocket APIs
+# in benchmarks/mock_server.py and benchmarks/mock_websocket.py.
+import os
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+from benchmarks.bench_live import WORLD_NAMES, check_aggregates
+from benchmarks.mock_server import SyntheticCatalog, start_server
+from benchmarks.mock_websocket import record_events, start_websocket_server
+from src import bson_codec
+from src.live_market import SALE_WINDOW, LiveFeed, LiveMarket
+from src.market_data import from_dict
+from src.metrics import metrics
+from src.websocket import (
+    OPCODE_BINARY,
+    OPCODE_CONTINUATION,
+    OPCODE_PING,
+    OPCODE_PONG,
+    OPCODE_TEXT,
+    WebSocket,
+    WebSocketError,
+    apply_mask,
+)
+
+NUM_ITEMS = 1000
+NUM_EVENTS = 2000
+WORLD_IDS = list(range(0, len(WORLD_NAMES)))
+TIMEOUT = 30
+
+
+@pytest.fixture
+def catalog():
+    return SyntheticCatalog(NUM_ITEMS)
+
+
+@pytest.fixture
+def connection():
+    """
+    A client `WebSocket` on one end of a socket pair, and the raw socket on the other end for the server.
+    """
+    client_sock, server_sock = socket.socketpair()
+    client = WebSocket(client_sock, client_sock.makefile("rb"))
+    yield client, server_sock
+    client.close()
+    server_sock.close()
+
+
+def server_frame(payload, opcode, fin=True) -> bytes:
+    # Server frames aren't masked
+    return struct.pack("!BB", (0x80 if fin else 0) | opcode, len(payload)) + payload
+
+
+def read_raw_frame(sock):
+    """
+    Reads one short client frame straight off the socket, and returns its header byte, mask and masked payload.
+    """
+    file = sock.makefile("rb")
+    first, second = file.read(2)
+    assert second & 0x80, "client frames have to be masked"
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack("!H", file.read(2))[0]
+    mask = file.read(4)
+    return first, mask, file.read(length)
+
+
+def wait_until(condition) -> None:
+    deadline = time.perf_counter() + TIMEOUT
+    while not condition():
+        assert time.perf_counter() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def start_feed(catalog, events, latency=0.0, **websocket_options):
+    server, base_url = start_server(catalog, latency)
+    websocket_server, websocket_url = start_websocket_server(
+        events, rest_server=server, **websocket_options
+    )
+    item_names = {item_id: catalog.name(item_id) for item_id in catalog.item_ids()}
+    feed = LiveFeed(item_names, WORLD_NAMES, websocket_url, f"{base_url}/api")
+    return feed, server, websocket_server
+
+
+def test_bson_round_trip():
+    document = {
+        "event": "listings/add",
+        "item": 5057,
+        "world": 2**40,
+        "ratio": 0.25,
+        "hq": True,
+        "retainer": None,
+        "listings": [
+            {"listingID": "a", "pricePerUnit": 1200, "hq": False},
+            {"listingID": "b", "pricePerUnit": -(2**31), "hq": True},
+        ],
+        "nested": {"name": "Émeraude", "empty": []},
+    }
+    assert bson_codec.decode(bson_codec.encode(document)) == document
+    with pytest.raises(ValueError):
+        bson_codec.decode(bson_codec.encode(document)[:-3])
+
+
+@pytest.mark.parametrize("size", [0, 5, 300])
+def test_client_frames_are_masked(connection, size):
+    client, server_sock = connection
+    payload = os.urandom(size)
+    client.send(payload)
+
+    first, mask, masked = read_raw_frame(server_sock)
+    assert first == 0x80 | OPCODE_BINARY
+    assert len(mask) == 4
+    assert apply_mask(masked, mask) == payload
+
+
+def test_fragmented_messages_are_reassembled(connection):
+    client, server_sock = connection
+    server_sock.sendall(
+        server_frame(b"abc", OPCODE_BINARY, fin=False)
+        # Control frames can come between fragments, and are answered right away
+        + server_frame(b"hi", OPCODE_PING)
+        + server_frame(b"def", OPCODE_CONTINUATION, fin=False)
+        + server_frame(b"ghi", OPCODE_CONTINUATION)
+        + server_frame("né".encode(), OPCODE_TEXT)
+    )
+    assert client.receive() == (OPCODE_BINARY, b"abcdefghi")
+    assert client.receive() == (OPCODE_TEXT, "né")
+
+    first, mask, masked = read_raw_frame(server_sock)
+    assert first == 0x80 | OPCODE_PONG
+    assert apply_mask(masked, mask) == b"hi"
+
+
+def test_continuation_without_a_message_is_an_error(connection):
+    client, server_sock = connection
+    server_sock.sendall(server_frame(b"abc", OPCODE_CONTINUATION))
+    with pytest.raises(WebSocketError):
+        client.receive()
+
+
+def test_events_are_held_back_while_loading():
+    market = LiveMarket({1: "Synthetic Item 1", 2: "Synthetic Item 2"})
+    market.add_world("Mock-1", 0)
+    now = 1700000000.0
+
+    def event(kind, **fields):
+        return {"event": kind, "item": 1, "world": 0, **fields}
+
+    market.begin_seed("Mock-1", [1])
+    assert market.apply(
+        event(
+            "listings/add",
+            listings=[{"listingID": "c", "pricePerUnit": 300, "hq": False}],
+        )
+    )
+    assert market.apply(event("listings/remove", listings=[{"listingID": "a"}]))
+    assert market.apply(
+        event(
+            "sales/add",
+            sales=[
+                # Already in the snapshot's velocity
+                {"pricePerUnit": 100, "hq": False, "timestamp": now - 60},
+                {"pricePerUnit": 100, "hq": False, "timestamp": now},
+            ],
+        )
+    )
+    # Nothing is applied until the item is loaded
+    assert ("Mock-1", 1) not in market.items
+    # Items that aren't being loaded, or aren't tracked, still ignore events
+    assert not market.apply({**event("listings/remove", listings=[]), "item": 2})
+
+    record = from_dict(
+        "live",
+        {
+            "itemID": 1,
+            "listings": [
+                {"listingID": "a", "pricePerUnit": 100, "hq": False},
+                {"listingID": "b", "pricePerUnit": 200, "hq": False},
+            ],
+        },
+    )
+    sales = {1: from_dict("history", {"itemID": 1, "nqSaleVelocity": 2.0})}
+    market.seed("Mock-1", [1, 2], [record], sales, now)
+
+    item = market.items[("Mock-1", 1)]
+    assert set(item.listings) == {"b", "c"}
+    assert item.min_price(False) == 200
+    assert item.nq.sale_rate == pytest.approx(2.0 + 24 * 60 * 60 / SALE_WINDOW)
+    assert market.pending == {}
+    assert market.take_changed() == {"Mock-1": [1]}
+
+    # Once loaded, events are applied as they arrive
+    assert market.apply(event("listings/remove", listings=[{"listingID": "b"}]))
+    assert item.min_price(False) == 300
+
+
+def test_loading_waits_for_subscriptions(catalog):
+    feed, server, websocket_server = start_feed(catalog, [])
+    seeding = threading.Thread(target=feed.seed)
+    try:
+        seeding.start()
+        wait_until(lambda: len(feed.world_ids) == len(WORLD_NAMES))
+        time.sleep(0.3)
+        # Only the world IDs were requested
+        assert seeding.is_alive()
+        assert server.request_count == 1
+
+        feed.start()
+        seeding.join(TIMEOUT)
+        assert not seeding.is_alive()
+        assert server.request_count > 1
+        assert feed.subscribed.is_set()
+        assert not feed.resync.is_set()
+        assert len(feed.market.items) > 0
+    finally:
+        feed.stop()
+        websocket_server.shutdown()
+        server.shutdown()
+
+
+def test_aggregates_match_after_loading(catalog):
+    events = record_events(catalog, WORLD_IDS, NUM_EVENTS)
+    feed, server, websocket_server = start_feed(catalog, events, paused=True)
+    try:
+        feed.start()
+        feed.seed()
+        metrics.reset()
+        websocket_server.replaying.set()
+        wait_until(
+            lambda: metrics.summary()["counters"].get("live_events", 0) >= len(events)
+        )
+    finally:
+        feed.stop()
+        websocket_server.shutdown()
+        server.shutdown()
+    assert check_aggregates(feed, events) == 0
+
+
+def test_aggregates_match_when_events_arrive_while_loading(catalog):
+    events = record_events(catalog, WORLD_IDS, NUM_EVENTS)
+    # Slow enough that loading takes about a second, and the events keep arriving during it
+    feed, server, websocket_server = start_feed(
+        catalog, events, rate=NUM_EVENTS, latency=0.1
+    )
+    total_bytes = sum(len(payload) for _, _, payload in websocket_server.frames)
+    try:
+        metrics.reset()
+        feed.start()
+        feed.seed()
+        sent_while_loading = websocket_server.sent_count
+        # Events from before an item started loading aren't applied, so this waits for every byte instead.
+        wait_until(
+            lambda: metrics.summary()["counters"].get("live_bytes", 0) >= total_bytes
+        )
+    finally:
+        # Also waits for the last event to be applied
+        feed.stop()
+        websocket_server.shutdown()
+        server.shutdown()
+    assert sent_while_loading > 0
+    assert check_aggregates(feed, events) == 0
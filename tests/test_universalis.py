@@ -0,0 +1,88 @@
+# Checks the Universalis fetch engine against the local mock server in benchmarks/mock_server.py.
+import pytest
+
+from benchmarks.mock_server import SyntheticCatalog, start_server, synthetic_listing
+from src import universalis
+
+NUM_ITEMS = 300
+NUM_QUERIED = 100
+BATCH_SIZE = 20
+WORLD_NAME = "Mock-1"
+
+
+@pytest.fixture
+def catalog():
+    return SyntheticCatalog(NUM_ITEMS)
+
+
+def query(catalog, item_ids, **server_options):
+    """
+    Queries the given items from a fresh mock server in batches of `BATCH_SIZE`,
+    and returns a dict of item ID to entry.
+    """
+    server, base_url = start_server(catalog, **server_options)
+    try:
+        entries = universalis.query_items(
+            [(item_id, catalog.name(item_id)) for item_id in item_ids],
+            WORLD_NAME,
+            batch_size=BATCH_SIZE,
+            base_url=f"{base_url}/api",
+            verbose=False,
+        )
+    finally:
+        server.shutdown()
+    return {entry.item_id: entry for entry in entries}
+
+
+def check_entry(entry, sales=True) -> None:
+    data = synthetic_listing(entry.item_id)
+    assert entry.currentAveragePriceNQ == pytest.approx(data["currentAveragePriceNQ"])
+    assert entry.currentPriceDifferenceNQ == pytest.approx(
+        data["currentAveragePriceNQ"] - data["minPriceNQ"]
+    )
+    assert entry.averagePriceHQ == pytest.approx(data["averagePriceHQ"])
+    if sales:
+        assert entry.nqSaleVelocity == pytest.approx(data["nqSaleVelocity"])
+        assert entry.hqSaleVelocity == pytest.approx(data["hqSaleVelocity"])
+    else:
+        assert entry.nqSaleVelocity == 0
+        assert entry.hqSaleVelocity == 0
+
+
+def test_merges_by_item_id(catalog):
+    marketable_ids = catalog.marketable_ids()[:NUM_QUERIED]
+    unmarketable_ids = [
+        item_id for item_id in catalog.item_ids() if not catalog.is_marketable(item_id)
+    ][:5]
+    unresolved_ids = marketable_ids[3:6]
+    # Reversed and mixed in with unmarketable items, so nothing lines up by position
+    item_ids = list(reversed(marketable_ids)) + unmarketable_ids
+
+    entries = query(catalog, item_ids, unresolved_ids=unresolved_ids)
+
+    assert set(entries) == set(marketable_ids) - set(unresolved_ids)
+    for entry in entries.values():
+        assert entry.item_name == catalog.name(entry.item_id)
+        check_entry(entry)
+
+
+def test_failed_history_only_zeroes_its_batch(catalog):
+    item_ids = catalog.marketable_ids()[:NUM_QUERIED]
+    failed_batch = item_ids[BATCH_SIZE : 2 * BATCH_SIZE]
+
+    entries = query(catalog, item_ids, failing_ids={"history": [failed_batch[5]]})
+
+    assert set(entries) == set(item_ids)
+    for item_id, entry in entries.items():
+        check_entry(entry, sales=item_id not in failed_batch)
+
+
+def test_failed_listings_only_drop_their_batch(catalog):
+    item_ids = catalog.marketable_ids()[:NUM_QUERIED]
+    failed_batch = item_ids[BATCH_SIZE : 2 * BATCH_SIZE]
+
+    entries = query(catalog, item_ids, failing_ids={"listings": [failed_batch[5]]})
+
+    assert set(entries) == set(item_ids) - set(failed_batch)
+    for entry in entries.values():
+        check_entry(entry)